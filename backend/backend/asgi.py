@@ -3,6 +3,11 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serving through this module (e.g. ``uvicorn backend.asgi:application``)
+enables the async runs/stream proxy: SSE streams are relayed on the event
+loop with httpx, so one worker can hold many concurrent generations.
+WSGI deployments keep using the blocking streaming path.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'blog.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'blog.middleware.VisitMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -65,6 +66,11 @@ if not CORS_ALLOW_ALL_ORIGINS:
     CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', 'http://localhost:5173').split(',')
 
 CORS_ALLOW_CREDENTIALS = True
+# Run streams: the SDK reads Content-Location to rejoin a run and resumes with Last-Event-ID.
+# Thread history: clients revalidate with If-None-Match and read ETag / X-History-Mode.
+from corsheaders.defaults import default_headers
+CORS_ALLOW_HEADERS = (*default_headers, 'last-event-id', 'if-none-match')
+CORS_EXPOSE_HEADERS = ['Content-Location', 'X-Run-Stream-Id', 'ETag', 'X-History-Mode']
 CSRF_TRUSTED_ORIGINS = [
     'http://localhost:5173',
     'http://frp-cup.com',
@@ -159,6 +165,133 @@ CHAINLIT_BASE_URL = os.getenv('CHAINLIT_BASE_URL', 'http://localhost:8001')
 CHAT_TOKEN_SECRET = os.getenv('CHAT_TOKEN_SECRET', 'dev-chat-secret')
 SERVICE_TOKEN_SECRET = os.getenv('SERVICE_TOKEN_SECRET', 'dev-service-secret')
 
+# JWT principals: resolved users are cached per process for JWT_PRINCIPAL_CACHE_TTL
+# seconds (0 entries disables). With JWT_EMBED_CLAIMS, tokens also carry username
+# and is_staff so read-only views that opt in can skip the user lookup entirely
+JWT_PRINCIPAL_CACHE_SIZE = int(os.getenv('JWT_PRINCIPAL_CACHE_SIZE', '1024'))
+JWT_PRINCIPAL_CACHE_TTL = int(os.getenv('JWT_PRINCIPAL_CACHE_TTL', '60'))
+JWT_EMBED_CLAIMS = os.getenv('JWT_EMBED_CLAIMS', 'False') == 'True'
+# Access tokens live JWT_ACCESS_TOKEN_TTL seconds; clients renew them at
+# /api/auth/refresh/ with a rotating refresh token valid JWT_REFRESH_TOKEN_TTL seconds
+JWT_ACCESS_TOKEN_TTL = int(os.getenv('JWT_ACCESS_TOKEN_TTL', '900'))
+JWT_REFRESH_TOKEN_TTL = int(os.getenv('JWT_REFRESH_TOKEN_TTL', str(30 * 24 * 3600)))
+# A refresh token replayed this soon after its rotation (another tab refreshing at
+# the same moment) gets the same successor instead of revoking the login
+JWT_REFRESH_GRACE_SECONDS = int(os.getenv('JWT_REFRESH_GRACE_SECONDS', '10'))
+
+# LangGraph upstream client (keep-alive connection pool, timeouts in seconds)
+LANGGRAPH_POOL_CONNECTIONS = int(os.getenv('LANGGRAPH_POOL_CONNECTIONS', '4'))
+LANGGRAPH_POOL_MAXSIZE = int(os.getenv('LANGGRAPH_POOL_MAXSIZE', '20'))
+LANGGRAPH_POOL_BLOCK = os.getenv('LANGGRAPH_POOL_BLOCK', 'False') == 'True'
+LANGGRAPH_CONNECT_TIMEOUT = float(os.getenv('LANGGRAPH_CONNECT_TIMEOUT', '3.05'))
+LANGGRAPH_DEFAULT_TIMEOUT = float(os.getenv('LANGGRAPH_DEFAULT_TIMEOUT', '10'))
+LANGGRAPH_LONG_TIMEOUT = float(os.getenv('LANGGRAPH_LONG_TIMEOUT', '60'))
+LANGGRAPH_THREAD_TIMEOUT = float(os.getenv('LANGGRAPH_THREAD_TIMEOUT', '15'))
+
+# Async streaming for runs/stream when served by backend.asgi (requires httpx)
+CHAT_ASYNC_STREAMING = os.getenv('CHAT_ASYNC_STREAMING', 'True') == 'True'
+LANGGRAPH_ASYNC_MAX_CONNECTIONS = int(os.getenv('LANGGRAPH_ASYNC_MAX_CONNECTIONS', '1000'))
+
+# Circuit breakers per upstream endpoint class (threads, runs, state, history, assistants)
+LANGGRAPH_BREAKER_FAILURE_THRESHOLD = int(os.getenv('LANGGRAPH_BREAKER_FAILURE_THRESHOLD', '5'))
+LANGGRAPH_BREAKER_RESET_TIMEOUT = float(os.getenv('LANGGRAPH_BREAKER_RESET_TIMEOUT', '30'))
+# A half-open trial call that has not reported back after this many seconds is
+# abandoned so another call can probe
+LANGGRAPH_BREAKER_TRIAL_TIMEOUT = float(os.getenv('LANGGRAPH_BREAKER_TRIAL_TIMEOUT', '60'))
+LANGGRAPH_HEALTH_PATH = os.getenv('LANGGRAPH_HEALTH_PATH', '/ok')
+# Calls slower than this count as failures; runs are left out since LLM latency varies widely
+LANGGRAPH_BREAKER_SLOW_CALL_SECONDS = {
+    'threads': 8,
+    'state': 8,
+    'history': 12,
+    'assistants': 8,
+}
+
+# Assistant registry cache: fresh for CHAT_ASSISTANTS_CACHE_TTL seconds, then served
+# stale for up to CHAT_ASSISTANTS_STALE_TTL more while refreshed in the background
+CHAT_ASSISTANTS_CACHE_TTL = int(os.getenv('CHAT_ASSISTANTS_CACHE_TTL', '300'))
+CHAT_ASSISTANTS_STALE_TTL = int(os.getenv('CHAT_ASSISTANTS_STALE_TTL', '3600'))
+
+# Identical concurrent thread/state/history reads share one upstream call; answers
+# are also reused for this many milliseconds (0 disables the micro-cache)
+CHATPROXY_MICRO_CACHE_MS = int(os.getenv('CHATPROXY_MICRO_CACHE_MS', '300'))
+# Forward upstream JSON bodies byte-for-byte instead of parsing and re-rendering them
+CHATPROXY_PASSTHROUGH = os.getenv('CHATPROXY_PASSTHROUGH', 'True') == 'True'
+
+# Response compression (gzip, or brotli when the brotli package is installed)
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'True') == 'True'
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '5'))
+
+# runs/stream replay buffers for Last-Event-ID resumption (per run, per process)
+CHAT_STREAM_REPLAY_MAX_EVENTS = int(os.getenv('CHAT_STREAM_REPLAY_MAX_EVENTS', '2000'))
+CHAT_STREAM_REPLAY_MAX_BYTES = int(os.getenv('CHAT_STREAM_REPLAY_MAX_BYTES', str(2 * 1024 * 1024)))
+CHAT_STREAM_REPLAY_MAX_RUNS = int(os.getenv('CHAT_STREAM_REPLAY_MAX_RUNS', '500'))
+CHAT_STREAM_REPLAY_TTL = int(os.getenv('CHAT_STREAM_REPLAY_TTL', '300'))
+CHAT_STREAM_KEEPALIVE = int(os.getenv('CHAT_STREAM_KEEPALIVE', '15'))
+# Live events queued per subscriber before it is dropped as a slow consumer
+CHAT_STREAM_SUBSCRIBER_QUEUE = int(os.getenv('CHAT_STREAM_SUBSCRIBER_QUEUE', '256'))
+# Admission control for runs/wait and runs/stream: concurrent runs per process and
+# per user; extra runs queue (fairly across users) for up to CHAT_RUNS_QUEUE_TIMEOUT
+# seconds, and get 429 with Retry-After once CHAT_RUNS_QUEUE_SIZE runs are waiting
+CHAT_RUNS_MAX_CONCURRENT = int(os.getenv('CHAT_RUNS_MAX_CONCURRENT', '32'))
+CHAT_RUNS_MAX_PER_USER = int(os.getenv('CHAT_RUNS_MAX_PER_USER', '3'))
+CHAT_RUNS_QUEUE_SIZE = int(os.getenv('CHAT_RUNS_QUEUE_SIZE', '64'))
+CHAT_RUNS_QUEUE_TIMEOUT = float(os.getenv('CHAT_RUNS_QUEUE_TIMEOUT', '10'))
+# Batch runs endpoint: items per request and worker threads per batch
+# (also capped by CHAT_RUNS_MAX_PER_USER)
+CHAT_BATCH_MAX_ITEMS = int(os.getenv('CHAT_BATCH_MAX_ITEMS', '100'))
+CHAT_BATCH_WORKERS = int(os.getenv('CHAT_BATCH_WORKERS', '3'))
+# Pre-created LangGraph threads per assistant_id, per worker (opt-in; 0 disables the pool). Pools for
+# assistants not claimed within CHAT_THREAD_POOL_TTL seconds, and threads older
+# than that, are deleted upstream
+CHAT_THREAD_POOL_SIZE = int(os.getenv('CHAT_THREAD_POOL_SIZE', '0'))
+CHAT_THREAD_POOL_MAX_ASSISTANTS = int(os.getenv('CHAT_THREAD_POOL_MAX_ASSISTANTS', '8'))
+CHAT_THREAD_POOL_TTL = int(os.getenv('CHAT_THREAD_POOL_TTL', '3600'))
+CHAT_THREAD_POOL_ASSISTANTS = [a.strip() for a in os.getenv('CHAT_THREAD_POOL_ASSISTANTS', '').split(',') if a.strip()]
+
+# Write-behind for usage rows: queued in memory and bulk-inserted by a background
+# thread every WRITE_BEHIND_BATCH_SIZE rows or WRITE_BEHIND_INTERVAL seconds. Rows
+# beyond WRITE_BEHIND_MAX_PENDING, or still queued at shutdown, go to spill files
+# in WRITE_BEHIND_SPILL_DIR and are replayed on the next start. TEST_RUNNER turns
+# both off for the test suite.
+WRITE_BEHIND_BACKGROUND = os.getenv('WRITE_BEHIND_BACKGROUND', 'True') == 'True'
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '200'))
+WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', '2'))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '10000'))
+# A row that keeps failing on its own (e.g. a foreign key to a deleted user) is
+# dropped and logged after this many attempts; locked/unavailable database errors never count
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', '3'))
+WRITE_BEHIND_SPILL_DIR = os.getenv('WRITE_BEHIND_SPILL_DIR', str(BASE_DIR / 'spill'))
+TEST_RUNNER = 'blog.test_runner.TestRunner'
+# Site visits use the same buffering: flushed every VISIT_BUFFER_BATCH_SIZE rows or
+# VISIT_BUFFER_INTERVAL seconds. Past VISIT_BUFFER_SAMPLE_ABOVE of the buffer new
+# visits are sampled, and once VISIT_BUFFER_MAX_PENDING rows wait they are dropped
+VISIT_BUFFER_BATCH_SIZE = int(os.getenv('VISIT_BUFFER_BATCH_SIZE', '500'))
+VISIT_BUFFER_INTERVAL = float(os.getenv('VISIT_BUFFER_INTERVAL', '5'))
+VISIT_BUFFER_MAX_PENDING = int(os.getenv('VISIT_BUFFER_MAX_PENDING', '20000'))
+VISIT_BUFFER_SAMPLE_ABOVE = float(os.getenv('VISIT_BUFFER_SAMPLE_ABOVE', '0.5'))
+# Seconds between saves of the per-day visit sketches (unique IPs, top paths/agents)
+VISIT_SKETCH_PERSIST_INTERVAL = int(os.getenv('VISIT_SKETCH_PERSIST_INTERVAL', '60'))
+# Retention: `manage.py archive_visits` moves visits older than VISIT_RETENTION_DAYS
+# into per-day gzip JSONL files under VISIT_ARCHIVE_DIR, VISIT_ARCHIVE_CHUNK_SIZE
+# rows per delete transaction
+VISIT_RETENTION_DAYS = int(os.getenv('VISIT_RETENTION_DAYS', '90'))
+VISIT_ARCHIVE_DIR = os.getenv('VISIT_ARCHIVE_DIR', str(BASE_DIR / 'archive' / 'visits'))
+VISIT_ARCHIVE_CHUNK_SIZE = int(os.getenv('VISIT_ARCHIVE_CHUNK_SIZE', '1000'))
+
+# Incremental thread history: page size used when walking new checkpoints and the
+# number of checkpoints kept per thread in the local cache
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_PAGE_SIZE', '20'))
+CHAT_HISTORY_CACHE_MAX_ENTRIES = int(os.getenv('CHAT_HISTORY_CACHE_MAX_ENTRIES', '200'))
+
+# Thread ownership checks on chatproxy calls: owners are cached for
+# CHAT_OWNER_CACHE_TTL seconds and unknown thread ids for CHAT_OWNER_NEGATIVE_TTL
+CHAT_OWNER_CACHE_SIZE = int(os.getenv('CHAT_OWNER_CACHE_SIZE', '4096'))
+CHAT_OWNER_CACHE_TTL = int(os.getenv('CHAT_OWNER_CACHE_TTL', '300'))
+CHAT_OWNER_NEGATIVE_TTL = int(os.getenv('CHAT_OWNER_NEGATIVE_TTL', '30'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
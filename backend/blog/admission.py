@@ -0,0 +1,175 @@
+import math
+import time
+import threading
+from collections import OrderedDict, deque
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+
+
+class RunsThrottled(Throttled):
+    """429 with Retry-After, raised when a run cannot be admitted."""
+    default_detail = '当前运行请求过多，请稍后重试'
+    default_code = 'runs_throttled'
+    extra_detail_singular = '请在 {wait} 秒后重试。'
+    extra_detail_plural = '请在 {wait} 秒后重试。'
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'event', 'granted', 'enqueued_at')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class Permit:
+    """A running slot. ``release`` is idempotent and safe from any thread."""
+    def __init__(self, admission, user_id):
+        self._admission = admission
+        self.user_id = user_id
+        self.acquired_at = time.monotonic()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self, *args):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._admission._release(self)
+
+
+class RunAdmission:
+    """
+    Caps concurrent runs globally and per user.
+
+    A run that cannot start waits in a bounded queue for at most
+    ``max_wait`` seconds. Queued runs are kept in one FIFO per user and
+    slots are handed out round-robin across users, so one user's burst
+    cannot push everyone else to the back. When the queue is full, or the
+    wait times out, RunsThrottled is raised with a Retry-After estimated
+    from recent run durations.
+    """
+    def __init__(self, max_running=32, max_per_user=3, max_queue=64, max_wait=10.0):
+        self.max_running = max_running
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._running = {}
+        self._total = 0
+        self._queues = OrderedDict()
+        self._waiting = 0
+        self._avg_run_seconds = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def config(self):
+        return (self.max_running, self.max_per_user, self.max_queue, self.max_wait)
+
+    def _can_start(self, user_id):
+        return self._total < self.max_running and self._running.get(user_id, 0) < self.max_per_user
+
+    def _grant(self, user_id):
+        self._total += 1
+        self._running[user_id] = self._running.get(user_id, 0) + 1
+        self.admitted += 1
+        return Permit(self, user_id)
+
+    def _retry_after(self):
+        # Roughly how long until the queue ahead of a new arrival drains
+        avg = self._avg_run_seconds or self.max_wait
+        return max(1, min(60, math.ceil(avg * (self._waiting + 1) / self.max_running)))
+
+    def acquire(self, user_id):
+        with self._lock:
+            # Users already queued keep their order, so only jump ahead when idle
+            if user_id not in self._queues and self._can_start(user_id):
+                return self._grant(user_id)
+            if self._waiting >= self.max_queue:
+                self.rejected += 1
+                raise RunsThrottled(wait=self._retry_after())
+            waiter = _Waiter(user_id)
+            self._queues.setdefault(user_id, deque()).append(waiter)
+            self._waiting += 1
+            self.queued += 1
+        if not waiter.event.wait(self.max_wait):
+            with self._lock:
+                if not waiter.granted:
+                    queue = self._queues.get(user_id)
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._queues[user_id]
+                    self._waiting -= 1
+                    self.timed_out += 1
+                    raise RunsThrottled(wait=self._retry_after())
+        return waiter.granted
+
+    def _release(self, permit):
+        elapsed = time.monotonic() - permit.acquired_at
+        with self._lock:
+            self._total -= 1
+            count = self._running[permit.user_id] - 1
+            if count:
+                self._running[permit.user_id] = count
+            else:
+                del self._running[permit.user_id]
+            self._avg_run_seconds = elapsed if self._avg_run_seconds is None else 0.8 * self._avg_run_seconds + 0.2 * elapsed
+            self._dispatch()
+
+    def _dispatch(self):
+        # Called with the lock held: hand free slots to queued users in turn
+        while self._total < self.max_running:
+            user_id = next((u for u in self._queues if self._running.get(u, 0) < self.max_per_user), None)
+            if user_id is None:
+                return
+            queue = self._queues.pop(user_id)
+            waiter = queue.popleft()
+            if queue:
+                self._queues[user_id] = queue  # to the back of the rotation
+            self._waiting -= 1
+            waiter.granted = self._grant(user_id)
+            waiter.event.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'running': self._total,
+                'waiting': self._waiting,
+                'users_running': len(self._running),
+                'users_waiting': len(self._queues),
+                'max_running': self.max_running,
+                'max_per_user': self.max_per_user,
+                'max_queue': self.max_queue,
+                'max_wait': self.max_wait,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_run_seconds': round(self._avg_run_seconds, 3) if self._avg_run_seconds is not None else None,
+            }
+
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+def get_run_admission():
+    """Per-process RunAdmission, rebuilt when its settings change."""
+    global _admission
+    config = (
+        getattr(settings, 'CHAT_RUNS_MAX_CONCURRENT', 32),
+        getattr(settings, 'CHAT_RUNS_MAX_PER_USER', 3),
+        getattr(settings, 'CHAT_RUNS_QUEUE_SIZE', 64),
+        getattr(settings, 'CHAT_RUNS_QUEUE_TIMEOUT', 10.0),
+    )
+    if _admission is None or _admission.config != config:
+        with _admission_lock:
+            if _admission is None or _admission.config != config:
+                _admission = RunAdmission(*config)
+    return _admission
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BlogConfig(AppConfig):
     name = 'blog'
+
+    def ready(self):
+        # Connects the signals that invalidate cached JWT principals and thread owners
+        from . import authentication, ownership  # noqa: F401
@@ -0,0 +1,130 @@
+import os
+import glob
+import gzip
+import json
+import time
+import logging
+import datetime
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import SiteVisit
+from .rollups import day_start
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('id', 'ip_address', 'path', 'user_agent', 'timestamp')
+
+
+def archive_dir():
+    return getattr(settings, 'VISIT_ARCHIVE_DIR', '')
+
+
+def archive_path(day, base=None):
+    """``<base>/YYYY/MM/visits-YYYY-MM-DD.jsonl.gz``: one file per local day."""
+    base = base or archive_dir()
+    return os.path.join(base, f'{day:%Y}', f'{day:%m}', f'visits-{day:%Y-%m-%d}.jsonl.gz')
+
+
+def _append(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Each append adds a gzip member; gzip.open reads them back as one stream
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            for row in rows:
+                # isoformat keeps microseconds, which DjangoJSONEncoder would truncate
+                row = dict(row, timestamp=row['timestamp'].isoformat())
+                f.write(json.dumps(row, ensure_ascii=False).encode('utf-8') + b'\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def archive_visits(before, chunk_size=1000, pause=0.0, base=None):
+    """
+    Move SiteVisit rows older than ``before`` (a date, local time) into the
+    per-day archive files, oldest first, ``chunk_size`` rows at a time.
+
+    Each chunk is written and fsynced before its rows are deleted in a
+    short transaction of its own, so the SQLite write lock is never held
+    for long and other writers can interleave (``pause`` seconds between
+    chunks gives them more room). A crash between the two steps leaves rows
+    in both places; readers drop the duplicates by id. Visit rollups and
+    sketches are left as they are, so dashboard totals do not change.
+    Returns the number of rows archived.
+    """
+    base = base or archive_dir()
+    if not base:
+        raise ValueError('VISIT_ARCHIVE_DIR is not configured')
+    cutoff = day_start(before)
+    archived = 0
+    while True:
+        rows = list(
+            SiteVisit.objects.filter(timestamp__lt=cutoff)
+            .order_by('timestamp', 'id')
+            .values(*FIELDS)[:chunk_size]
+        )
+        if not rows:
+            return archived
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(timezone.localdate(row['timestamp']), []).append(row)
+        for day, day_rows in by_day.items():
+            _append(archive_path(day, base), day_rows)
+        with transaction.atomic():
+            SiteVisit.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        archived += len(rows)
+        logger.info(f"[VisitArchive] archived {len(rows)} visits up to {rows[-1]['timestamp']}")
+        if pause:
+            time.sleep(pause)
+
+
+def archived_days(base=None):
+    """Local days that have an archive file, oldest first."""
+    base = base or archive_dir()
+    if not base:
+        return []
+    days = []
+    for path in glob.glob(os.path.join(base, '*', '*', 'visits-*.jsonl.gz')):
+        try:
+            days.append(datetime.date.fromisoformat(os.path.basename(path)[7:17]))
+        except ValueError:
+            continue
+    return sorted(days)
+
+
+def iter_archived_day(day, base=None):
+    """Archived visits of one local day, in file order, without duplicate ids."""
+    path = archive_path(day, base)
+    if not os.path.exists(path):
+        return
+    seen = set()
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            if row['id'] in seen:
+                continue
+            seen.add(row['id'])
+            row['timestamp'] = parse_datetime(row['timestamp'])
+            yield row
+
+
+def read_archived_visits(start, end, path_prefix=None, limit=None, base=None):
+    """
+    Archived visits for local days ``start``..``end``, oldest first.
+    ``path_prefix`` filters on the request path; ``limit`` stops early.
+    """
+    base = base or archive_dir()
+    if not base:
+        return []
+    visits = []
+    day = start
+    while day <= end:
+        for row in iter_archived_day(day, base):
+            if path_prefix and not row['path'].startswith(path_prefix):
+                continue
+            visits.append(row)
+            if limit is not None and len(visits) >= limit:
+                return visits
+        day += datetime.timedelta(days=1)
+    return visits
@@ -1,9 +1,71 @@
 import jwt
+import copy
+import hmac
+import time
+import uuid
+import base64
+import hashlib
+import secrets
 import datetime
 from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from rest_framework import authentication
 from rest_framework import exceptions
+from rest_framework.permissions import SAFE_METHODS
 from django.contrib.auth.models import User
+from django.utils import timezone
+from .caching import TTLCache
+from .models import RefreshToken
+
+# Resolved users keyed by (user_id, iat). Entries for a user are dropped when
+# that user is saved or deleted in this process; other processes catch up
+# within JWT_PRINCIPAL_CACHE_TTL seconds.
+_principal_cache = TTLCache(
+    maxsize=getattr(settings, 'JWT_PRINCIPAL_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'JWT_PRINCIPAL_CACHE_TTL', 60),
+)
+# user_id -> wall-clock time of the last change seen here. Claims in tokens
+# issued before it may be stale, so those tokens are resolved from the DB.
+_changed_at = TTLCache(maxsize=4096, ttl=24 * 3600)
+
+CLAIM_FIELDS = ('username', 'is_staff')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_principal(sender, instance, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which no claim depends on
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        _changed_at.set(instance.pk, time.time())
+    _principal_cache.delete_where(lambda key: key[0] == instance.pk)
+
+
+def principal_cache_stats():
+    return {'size': len(_principal_cache), 'maxsize': _principal_cache.maxsize, 'ttl': _principal_cache.ttl}
+
+
+def _claims_allowed(request, payload):
+    """
+    Read-only requests to views with ``jwt_claims_principal = True`` may
+    trust the username/is_staff claims instead of loading the user.
+    """
+    if request.method not in SAFE_METHODS or not all(k in payload for k in CLAIM_FIELDS):
+        return False
+    view = (getattr(request, 'parser_context', None) or {}).get('view')
+    if not getattr(view, 'jwt_claims_principal', False):
+        return False
+    changed = _changed_at.get(payload['user_id'])
+    return changed is None or payload.get('iat', 0) > changed
+
+
+def _user_from_claims(payload):
+    # A partially loaded instance: fields not in the token are fetched on access
+    known = {'id': payload['user_id'], 'username': payload['username'], 'is_staff': payload['is_staff'], 'is_active': True}
+    fields = [f.attname for f in User._meta.concrete_fields if f.attname in known]
+    return User.from_db('default', fields, [known[f] for f in fields])
+
 
 class JWTAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
@@ -26,17 +88,107 @@ class JWTAuthentication(authentication.BaseAuthentication):
         except jwt.InvalidTokenError:
             raise exceptions.AuthenticationFailed('Invalid token')
 
-        try:
-            user = User.objects.get(pk=payload['user_id'])
-        except User.DoesNotExist:
-            raise exceptions.AuthenticationFailed('User not found')
+        if _claims_allowed(request, payload):
+            return (_user_from_claims(payload), token)
+
+        key = (payload['user_id'], payload.get('iat'))
+        user = _principal_cache.get(key)
+        if user is None:
+            try:
+                user = User.objects.get(pk=payload['user_id'])
+            except User.DoesNotExist:
+                raise exceptions.AuthenticationFailed('User not found')
+            _principal_cache.set(key, user)
+
+        # Each request gets its own copy so views cannot change the cached one
+        return (copy.copy(user), token)
+
+    def authenticate_header(self, request):
+        # Makes failed token checks 401, which tells clients to refresh
+        return 'Bearer realm="api"'
 
-        return (user, token)
+def access_token_ttl():
+    return getattr(settings, 'JWT_ACCESS_TOKEN_TTL', 900)
 
 def generate_token(user):
     payload = {
         'user_id': user.id,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1),
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=access_token_ttl()),
         'iat': datetime.datetime.utcnow()
     }
+    if getattr(settings, 'JWT_EMBED_CLAIMS', False):
+        payload.update({field: getattr(user, field) for field in CLAIM_FIELDS})
     return jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
+
+
+class RefreshTokenInvalid(exceptions.AuthenticationFailed):
+    default_detail = '刷新令牌无效或已过期，请重新登录'
+    default_code = 'refresh_token_invalid'
+
+
+def _hash_refresh_token(raw):
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _successor(raw):
+    """
+    The token a rotation of ``raw`` issues. Deriving it (keyed by SECRET_KEY)
+    lets a replay within the grace window get the same successor back, from
+    any worker, without storing token values.
+    """
+    digest = hmac.new(settings.SECRET_KEY.encode('utf-8'), b'refresh:' + raw.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def issue_refresh_token(user, family=None, raw=None):
+    """Store a new refresh token for ``user`` and return its value (shown once)."""
+    raw = raw or secrets.token_urlsafe(32)
+    RefreshToken.objects.create(
+        token_hash=_hash_refresh_token(raw),
+        user=user,
+        family=family or uuid.uuid4().hex,
+        expires_at=timezone.now() + datetime.timedelta(seconds=getattr(settings, 'JWT_REFRESH_TOKEN_TTL', 30 * 24 * 3600)),
+    )
+    return raw
+
+
+def rotate_refresh_token(raw):
+    """
+    Exchange a refresh token for (user, new refresh token). Verification is
+    one indexed lookup of the token's SHA-256, with no password hashing.
+
+    A token rotated less than JWT_REFRESH_GRACE_SECONDS ago yields the same
+    successor again, as long as that successor is still unused, so tabs
+    refreshing at once do not lock each other out. Any other reuse of a
+    rotated or revoked token is treated as theft and revokes the family.
+    """
+    now = timezone.now()
+    row = RefreshToken.objects.select_related('user').filter(token_hash=_hash_refresh_token(raw or '')).first()
+    if row is None or row.expires_at <= now or not row.user.is_active:
+        raise RefreshTokenInvalid()
+    new_raw = _successor(raw)
+    with transaction.atomic():
+        # Only one concurrent refresh can win the conditional update
+        rotated = RefreshToken.objects.filter(pk=row.pk, revoked_at__isnull=True).update(revoked_at=now)
+        if rotated:
+            issue_refresh_token(row.user, family=row.family, raw=new_raw)
+    if rotated:
+        return row.user, new_raw
+    revoked_at = RefreshToken.objects.filter(pk=row.pk).values_list('revoked_at', flat=True).first()
+    grace = datetime.timedelta(seconds=getattr(settings, 'JWT_REFRESH_GRACE_SECONDS', 10))
+    if revoked_at is not None and now - revoked_at <= grace and RefreshToken.objects.filter(
+            token_hash=_hash_refresh_token(new_raw), revoked_at__isnull=True, expires_at__gt=now).exists():
+        return row.user, new_raw
+    RefreshToken.objects.filter(family=row.family, revoked_at__isnull=True).update(revoked_at=now)
+    raise RefreshTokenInvalid()
+
+
+def revoke_refresh_token(raw):
+    """Revoke the family ``raw`` belongs to (logout). Unknown tokens are ignored."""
+    family = RefreshToken.objects.filter(token_hash=_hash_refresh_token(raw or '')).values_list('family', flat=True).first()
+    if family:
+        RefreshToken.objects.filter(family=family, revoked_at__isnull=True).update(revoked_at=timezone.now())
+
+
+def token_response(user, refresh):
+    return {'token': generate_token(user), 'refresh': refresh, 'expires_in': access_token_ttl()}
@@ -0,0 +1,99 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from .admission import get_run_admission, RunsThrottled
+from .services import create_langgraph_thread, get_upstream_client, invalidate_thread_reads, ServiceUnavailable, CircuitOpen, LONG_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Item keys consumed here rather than forwarded in the run payload
+ITEM_KEYS = {'thread_id', 'title'}
+
+
+class BatchItemError(ValueError):
+    pass
+
+
+def parse_batch(data):
+    """
+    Validate a batch request body and return its items as
+    (thread_id or None, title, run payload) tuples.
+    """
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BatchItemError('items 必须是非空列表')
+    max_items = getattr(settings, 'CHAT_BATCH_MAX_ITEMS', 100)
+    if len(items) > max_items:
+        raise BatchItemError(f'单次最多提交 {max_items} 项')
+    default_assistant = data.get('assistant_id')
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise BatchItemError(f'第 {index} 项格式错误')
+        payload = {k: v for k, v in item.items() if k not in ITEM_KEYS}
+        payload.setdefault('assistant_id', default_assistant)
+        if not payload['assistant_id']:
+            raise BatchItemError(f'第 {index} 项缺少 assistant_id')
+        parsed.append((item.get('thread_id') or None, item.get('title'), payload))
+    return parsed
+
+
+def _error(status_code, detail, **extra):
+    return dict(status=status_code, error=detail, **extra)
+
+
+def run_item(user_id, thread_id, payload):
+    """
+    Run one batch item against LangGraph runs/wait, creating its thread
+    first when ``thread_id`` is None. Never raises: failures are reported
+    in the returned dict so one bad item does not sink the batch.
+    """
+    created = False
+    try:
+        permit = get_run_admission().acquire(user_id)
+    except RunsThrottled as e:
+        return _error(e.status_code, str(e.detail), retry_after=e.wait)
+    try:
+        if thread_id is None:
+            thread_id = create_langgraph_thread(payload['assistant_id'])
+            created = True
+        resp = get_upstream_client().post(f'/threads/{thread_id}/runs/wait', json=payload, timeout=LONG_TIMEOUT)
+        invalidate_thread_reads(thread_id)
+        try:
+            data = resp.json()
+        except ValueError:
+            data = resp.text
+        if resp.status_code >= 400:
+            return _error(resp.status_code, data, thread_id=thread_id, created=created)
+        return {'status': resp.status_code, 'thread_id': thread_id, 'created': created, 'result': data}
+    except CircuitOpen as e:
+        return _error(e.status_code, str(e.detail), thread_id=thread_id, created=created, retry_after=e.retry_after)
+    except ServiceUnavailable as e:
+        return _error(e.status_code, str(e.detail), thread_id=thread_id, created=created)
+    except Exception as e:
+        logger.error(f"[RunBatch] item failed for thread {thread_id}: {e}")
+        return _error(502, str(e), thread_id=thread_id, created=created)
+    finally:
+        permit.release()
+
+
+def iter_batch(user_id, items):
+    """
+    Execute ``(index, thread_id, payload)`` items on a bounded worker pool
+    and yield ``(index, result)`` in completion order. The pool never
+    exceeds the per-user run cap, so a batch queues behind itself rather
+    than being throttled by it. Pending items are cancelled if the
+    consumer stops early (e.g. the client disconnected).
+    """
+    workers = min(
+        len(items),
+        getattr(settings, 'CHAT_BATCH_WORKERS', 3),
+        get_run_admission().max_per_user,
+    )
+    executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='run-batch')
+    try:
+        futures = {executor.submit(run_item, user_id, thread_id, payload): index for index, thread_id, payload in items}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
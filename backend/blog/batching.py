@@ -0,0 +1,347 @@
+import os
+import glob
+import json
+import time
+import random
+import itertools
+import atexit
+import logging
+import threading
+from collections import deque
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, OperationalError
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """
+    Write-behind buffer for database rows.
+
+    ``put`` appends an item (a dict of JSON-serialisable values) and returns
+    immediately; a daemon thread hands batches to ``write`` once
+    ``batch_size`` items are pending or ``interval`` seconds have passed. A
+    batch that fails with a ``transient`` error (the database is locked or
+    down) is put back and retried on the next round. Any other error is
+    blamed on its rows: the batch is bisected so the good rows are written,
+    and a row that fails on its own ``max_attempts`` times is dropped and
+    logged rather than blocking the queue.
+
+    With a ``spill_dir``, items that cannot be kept in memory (more than
+    ``max_pending``) or are still pending at interpreter exit are appended
+    to ``<spill_dir>/<name>-<pid>.jsonl`` and loaded back by ``replay`` the
+    next time a writer with that name starts, so nothing is lost. Without
+    one, overflowing items are dropped and counted. ``sample_above`` (a
+    fraction of ``max_pending``) turns on load shedding for lossy data:
+    past that mark items are kept with a probability that falls linearly to
+    zero as the buffer fills, and the rest are counted as ``sampled_out``.
+
+    With ``background=False`` no thread is started and each ``put`` that
+    fills a batch writes it on the caller's thread; ``flush`` writes the rest.
+    """
+    def __init__(self, name, write, batch_size=200, interval=2.0, max_pending=10000,
+                 spill_dir=None, decode=None, background=True, sample_above=None,
+                 max_attempts=3, transient=(OperationalError,)):
+        self.name = name
+        self.write = write
+        self.batch_size = max(batch_size, 1)
+        self.interval = interval
+        self.max_pending = max_pending
+        self.spill_dir = spill_dir
+        self.decode = decode
+        self.background = background
+        self.sample_above = sample_above
+        self.max_attempts = max_attempts
+        self.transient = transient
+        # (sequence number, item) pairs; the number identifies a row across retries
+        self._pending = deque()
+        self._seq = itertools.count()
+        # sequence number -> failed attempts, for rows that failed on their own
+        self._attempts = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self.stats = {'queued': 0, 'flushed': 0, 'batches': 0, 'errors': 0, 'spilled': 0, 'replayed': 0, 'dropped': 0, 'sampled_out': 0, 'poisoned': 0, 'corrupt': 0}
+
+    def put(self, item):
+        """Queue one item. Returns False if it had to be dropped."""
+        with self._cond:
+            if self._shed(len(self._pending)):
+                self.stats['sampled_out'] += 1
+                return False
+            if len(self._pending) >= self.max_pending:
+                overflow = True
+            else:
+                overflow = False
+                self._pending.append((next(self._seq), item))
+                self.stats['queued'] += 1
+                full = len(self._pending) >= self.batch_size
+                if full:
+                    self._cond.notify()
+        if overflow:
+            if self.spill_dir:
+                return self._spill([item])
+            self.stats['dropped'] += 1
+            return False
+        if self.background:
+            self._ensure_thread()
+        elif full:
+            self.flush()
+        return True
+
+    def _shed(self, pending):
+        if self.sample_above is None:
+            return False
+        mark = self.max_pending * self.sample_above
+        if pending < mark or pending >= self.max_pending:
+            return False
+        return random.random() >= (self.max_pending - pending) / (self.max_pending - mark)
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _take(self):
+        with self._cond:
+            n = min(len(self._pending), self.batch_size)
+            return [self._pending.popleft() for _ in range(n)]
+
+    def _requeue(self, batch):
+        with self._cond:
+            self._pending.extendleft(reversed(batch))
+
+    def flush(self):
+        """Write everything pending now, on the calling thread. Returns rows written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    return written
+                done, retry = self._write_isolating(batch)
+                written += done
+                if retry:
+                    # Retried on the next round, not in a tight loop here
+                    self._requeue(retry)
+                    return written
+
+    def _write_isolating(self, batch):
+        """
+        Write ``batch``, bisecting it on row errors. Returns (rows written,
+        rows to retry later).
+        """
+        written = 0
+        retry = []
+        chunks = [batch]
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                self.write([item for _, item in chunk])
+            except self.transient as e:
+                self.stats['errors'] += 1
+                logger.error(f"[BatchWriter] {self.name}: writing {len(chunk)} rows failed: {e}")
+                retry.extend(chunk)
+                for rest in reversed(chunks):
+                    retry.extend(rest)
+                return written, retry
+            except Exception as e:
+                self.stats['errors'] += 1
+                if len(chunk) > 1:
+                    # Write each half on its own so one bad row only holds back itself
+                    mid = len(chunk) // 2
+                    chunks.append(chunk[mid:])
+                    chunks.append(chunk[:mid])
+                    continue
+                seq, item = chunk[0]
+                attempts = self._attempts.pop(seq, 0) + 1
+                if attempts >= self.max_attempts:
+                    self.stats['poisoned'] += 1
+                    logger.error(f"[BatchWriter] {self.name}: dropping row after {attempts} failed attempts: {e}; row: {item!r}")
+                else:
+                    logger.error(f"[BatchWriter] {self.name}: writing a row failed (attempt {attempts}): {e}")
+                    self._attempts[seq] = attempts
+                    retry.append(chunk[0])
+                continue
+            if self._attempts:
+                for seq, _ in chunk:
+                    self._attempts.pop(seq, None)
+            written += len(chunk)
+            self.stats['flushed'] += len(chunk)
+            self.stats['batches'] += 1
+        return written, retry
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, daemon=True, name=f'batch-writer-{self.name}')
+            self._thread.start()
+
+    def _run(self):
+        deadline = time.monotonic() + self.interval
+        while True:
+            with self._cond:
+                while not self._stopped and len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopped:
+                    return
+            close_old_connections()
+            self.flush()
+            deadline = time.monotonic() + self.interval
+
+    def stop(self):
+        """Stop the writer thread, write what is pending and spill any remainder."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+        self.flush()
+        with self._cond:
+            rest = [item for _, item in self._pending]
+            self._pending.clear()
+        if rest:
+            if self.spill_dir:
+                self._spill(rest)
+            else:
+                self.stats['dropped'] += len(rest)
+                logger.error(f"[BatchWriter] {self.name}: {len(rest)} rows lost at shutdown")
+
+    def _spill_path(self):
+        return os.path.join(self.spill_dir, f'{self.name}-{os.getpid()}.jsonl')
+
+    def _spill(self, items):
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._spill_path(), 'a', encoding='utf-8') as f:
+                for item in items:
+                    f.write(json.dumps(item, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            self.stats['dropped'] += len(items)
+            logger.error(f"[BatchWriter] {self.name}: spilling {len(items)} rows failed: {e}")
+            return False
+        self.stats['spilled'] += len(items)
+        return True
+
+    def _claimable_spills(self):
+        """
+        Spill files safe to replay: those whose writer process is gone (or is
+        this one, when a predecessor with the same pid left it), plus files a
+        replaying process had claimed before dying.
+        """
+        me = os.getpid()
+        paths = []
+        for path in glob.glob(os.path.join(self.spill_dir, f'{self.name}-*.jsonl*')):
+            base, sep, claimer = os.path.basename(path).partition('.replay-')
+            owner = claimer if sep else base[len(self.name) + 1:-len('.jsonl')]
+            if not owner.isdigit() or not base.endswith('.jsonl'):
+                continue
+            pid = int(owner)
+            if pid == me and sep:
+                continue
+            if pid == me or not _pid_alive(pid):
+                paths.append(path)
+        return paths
+
+    def replay(self):
+        """Queue rows spilled by earlier processes. Returns how many were loaded."""
+        if not self.spill_dir:
+            return 0
+        loaded = []
+        for path in self._claimable_spills():
+            base = path.partition('.replay-')[0]
+            claimed = f'{base}.replay-{os.getpid()}'
+            try:
+                # Renaming claims the file, so concurrent workers never replay it twice
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            complete = False
+            try:
+                with open(claimed, encoding='utf-8') as f:
+                    for lineno, line in enumerate(f, 1):
+                        if not line.strip():
+                            continue
+                        try:
+                            item = json.loads(line)
+                            loaded.append(self.decode(item) if self.decode else item)
+                        except (ValueError, TypeError, KeyError) as e:
+                            # A crash mid-write leaves a truncated last line
+                            self.stats['corrupt'] += 1
+                            logger.error(f"[BatchWriter] {self.name}: skipping bad line {lineno} of {claimed}: {e}")
+                complete = True
+            except (OSError, ValueError) as e:
+                logger.error(f"[BatchWriter] {self.name}: reading {claimed} failed: {e}")
+            finally:
+                try:
+                    if complete:
+                        os.remove(claimed)
+                    else:
+                        os.replace(claimed, f'{base}.corrupt')
+                        logger.error(f"[BatchWriter] {self.name}: quarantined unreadable spill file as {base}.corrupt")
+                except OSError as e:
+                    logger.error(f"[BatchWriter] {self.name}: could not clear {claimed}: {e}")
+        if loaded:
+            with self._cond:
+                self._pending.extend((next(self._seq), item) for item in loaded)
+            self.stats['replayed'] += len(loaded)
+            logger.info(f"[BatchWriter] {self.name}: replaying {len(loaded)} spilled rows")
+            if self.background:
+                self._ensure_thread()
+        return len(loaded)
+
+    def snapshot(self):
+        return {'pending': self.pending(), **self.stats}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        return True
+    except OSError:
+        return False
+    return True
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_batch_writer(name, factory):
+    """
+    Per-process BatchWriter registry. ``factory`` builds the writer on first
+    use (and again after a fork); it is replayed from its spill file and
+    stopped at interpreter exit.
+    """
+    pid = os.getpid()
+    entry = _writers.get(name)
+    if entry is None or entry[0] != pid:
+        with _writers_lock:
+            entry = _writers.get(name)
+            if entry is None or entry[0] != pid:
+                writer = factory()
+                entry = _writers[name] = (pid, writer)
+                atexit.register(writer.stop)
+                try:
+                    writer.replay()
+                except Exception as e:
+                    logger.error(f"[BatchWriter] {name}: replay failed: {e}")
+    return entry[1]
+
+
+def batch_writer_stats():
+    pid = os.getpid()
+    return {name: writer.snapshot() for name, (owner, writer) in list(_writers.items()) if owner == pid}
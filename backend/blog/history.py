@@ -0,0 +1,195 @@
+import hashlib
+import threading
+from django.conf import settings
+from .caching import SingleFlight, TTLCache
+from .services import coalesced_get, THREAD_TIMEOUT
+
+DEFAULT_HISTORY_LIMIT = 10
+MAX_HISTORY_LIMIT = 1000
+# Query parameters the incremental path understands; anything else is proxied as-is
+INCREMENTAL_PARAMS = {'limit', 'since'}
+
+_history_cache = TTLCache(maxsize=256, ttl=600)
+_sync_flight = SingleFlight()
+history_stats = {'not_modified': 0, 'cache_hits': 0, 'delta_responses': 0, 'pages_fetched': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        history_stats[name] += 1
+
+
+class HistoryResult:
+    def __init__(self, status_code, data=None, etag=None, mode='full', not_modified=False):
+        self.status_code = status_code
+        self.data = data
+        self.etag = etag
+        self.mode = mode
+        self.not_modified = not_modified
+
+
+class _CachedHistory:
+    """
+    Newest-first prefix of a thread's checkpoint history. ``complete`` means
+    the prefix reaches the first checkpoint. Instances are never mutated so
+    readers can use them without locking.
+    """
+    def __init__(self, entries, complete):
+        self.entries = entries
+        self.complete = complete
+        self.ids = [checkpoint_id(e) for e in entries]
+
+    @property
+    def head(self):
+        return self.ids[0] if self.ids else None
+
+
+def checkpoint_id(state):
+    if not isinstance(state, dict):
+        return None
+    checkpoint = state.get('checkpoint') or {}
+    return checkpoint.get('checkpoint_id') or state.get('checkpoint_id')
+
+
+def supports_incremental(params):
+    return set(params.keys()) <= INCREMENTAL_PARAMS
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_HISTORY_LIMIT
+    return max(1, min(limit, MAX_HISTORY_LIMIT))
+
+
+def make_etag(head, limit, since):
+    digest = hashlib.sha1(f'{head}:{limit}:{since or ""}'.encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in candidates or f'W/{etag}' in candidates
+
+
+def _fetch_page(thread_id, limit, before=None, micro_cache=True):
+    params = {'limit': str(limit)}
+    if before:
+        params['before'] = before
+    _count('pages_fetched')
+    resp = coalesced_get(f'/threads/{thread_id}/history', params, timeout=THREAD_TIMEOUT, micro_cache=micro_cache)
+    if resp.status_code != 200:
+        return resp, None
+    data = resp.json()
+    return resp, data if isinstance(data, list) else None
+
+
+def _sync(thread_id, head, needed, until=None):
+    """
+    Bring the cached prefix up to ``head``, fetching only checkpoints newer
+    than the cached head, then extend it until it holds ``needed`` entries
+    (or contains ``until``) or the history is exhausted.
+    Returns (cached, error_response).
+    """
+    page_size = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 20)
+    max_entries = getattr(settings, 'CHAT_HISTORY_CACHE_MAX_ENTRIES', 200)
+    cached = _history_cache.get(thread_id)
+    fresh = []
+    before = None
+    complete = False
+    # 1. Walk newest-first until we meet the cached head. The page holding
+    #    the old head is kept, since the head's pending writes may have changed.
+    if cached is None or cached.head != head:
+        while True:
+            resp, page = _fetch_page(thread_id, page_size, before)
+            if page is None:
+                return None, resp
+            known = None
+            if cached is not None:
+                for i, state in enumerate(page):
+                    if checkpoint_id(state) == cached.head:
+                        known = i
+                        break
+            if known is not None:
+                fresh.extend(page[:known + 1])
+                cached = _CachedHistory(fresh + cached.entries[1:], cached.complete)
+                break
+            fresh.extend(page)
+            if len(page) < page_size:
+                complete = True
+            if complete or (cached is None and len(fresh) >= needed and (until is None or until in [checkpoint_id(e) for e in fresh])):
+                cached = _CachedHistory(fresh, complete)
+                break
+            if len(fresh) >= max_entries:
+                # Too far behind to stitch (or nothing cached yet): restart from the new head
+                cached = _CachedHistory(fresh, False)
+                break
+            before = checkpoint_id(page[-1])
+    else:
+        _count('cache_hits')
+    # 2. Extend older entries when the request needs more than we hold.
+    while not cached.complete and (len(cached.entries) < needed or (until is not None and until not in cached.ids)):
+        if len(cached.entries) >= max_entries:
+            break
+        resp, page = _fetch_page(thread_id, page_size, cached.ids[-1] if cached.ids else None)
+        if page is None:
+            return None, resp
+        cached = _CachedHistory(cached.entries + page, len(page) < page_size)
+    if len(cached.entries) > max_entries:
+        cached = _CachedHistory(cached.entries[:max_entries], False)
+    _history_cache.set(thread_id, cached)
+    return cached, None
+
+
+def get_thread_history(thread_id, limit=None, since=None, if_none_match=None):
+    """
+    Conditional, incremental history for a thread.
+
+    One ``limit=1`` probe tells us the latest checkpoint id, which keys the
+    ETag; a matching If-None-Match returns ``not_modified`` without touching
+    the cache. The probe bypasses the read micro-cache, so a run that just
+    finished, possibly on another worker, is never hidden behind a stale
+    ETag. On a mismatch the per-thread cache is synced by fetching only the
+    checkpoints newer than those already seen. With ``since`` only entries
+    newer than that checkpoint are returned (``mode='delta'``); if ``since``
+    is unknown the full list is returned instead.
+    """
+    limit = parse_limit(limit)
+    resp, probe = _fetch_page(thread_id, 1, micro_cache=False)
+    if probe is None:
+        try:
+            data = resp.json()
+        except ValueError:
+            data = resp.text
+        return HistoryResult(resp.status_code, data)
+    head = checkpoint_id(probe[0]) if probe else None
+    etag = make_etag(head, limit, since)
+    if etag_matches(if_none_match, etag):
+        _count('not_modified')
+        return HistoryResult(304, etag=etag, not_modified=True)
+    if head is None:
+        return HistoryResult(200, [], etag=etag)
+    cached, error = _sync_flight.do(
+        (thread_id, head, limit, since),
+        lambda: _sync(thread_id, head, limit, until=since),
+    )
+    if cached is None:
+        return HistoryResult(error.status_code, error.json() if 'json' in error.headers.get('Content-Type', '') else error.text)
+    if since and since in cached.ids:
+        _count('delta_responses')
+        index = cached.ids.index(since)
+        return HistoryResult(200, cached.entries[:index], etag=etag, mode='delta')
+    return HistoryResult(200, cached.entries[:limit], etag=etag)
+
+
+def history_snapshot():
+    with _stats_lock:
+        data = dict(history_stats)
+    data['cached_threads'] = len(_history_cache)
+    return data
@@ -0,0 +1,32 @@
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from blog.archive import archive_dir, archive_visits
+from blog.models import SiteVisit
+from blog.rollups import day_start
+
+
+class Command(BaseCommand):
+    help = 'Move SiteVisit rows older than the retention period into gzip JSONL archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'VISIT_RETENTION_DAYS', 90),
+                            help='Keep this many days of visits in the database (default: VISIT_RETENTION_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=getattr(settings, 'VISIT_ARCHIVE_CHUNK_SIZE', 1000),
+                            help='Rows archived and deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between chunks')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would be archived')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        if not archive_dir():
+            raise CommandError('VISIT_ARCHIVE_DIR is not configured')
+        before = timezone.localdate() - datetime.timedelta(days=options['days'])
+        if options['dry_run']:
+            count = SiteVisit.objects.filter(timestamp__lt=day_start(before)).count()
+            self.stdout.write(f'{count} visits before {before} would be archived')
+            return
+        count = archive_visits(before, chunk_size=max(options['chunk_size'], 1), pause=options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {count} visits before {before} to {archive_dir()}'))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils.dateparse import parse_date
+from blog.models import TokenUsage, TokenUsageDaily
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per user, day and model token rollups from TokenUsage rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD), default: earliest usage')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD), default: today')
+
+    def handle(self, *args, **options):
+        start = self._date(options['start']) if options['start'] else None
+        end = self._date(options['end']) if options['end'] else None
+        usage = TokenUsage.objects.annotate(day=TruncDate('timestamp'))
+        days = TokenUsageDaily.objects.all()
+        if start:
+            usage = usage.filter(day__gte=start)
+            days = days.filter(day__gte=start)
+        if end:
+            usage = usage.filter(day__lte=end)
+            days = days.filter(day__lte=end)
+
+        grouped = usage.values('user_id', 'day', 'model_name').annotate(
+            input=Sum('input_tokens'),
+            output=Sum('output_tokens'),
+            total=Sum('total_tokens'),
+            runs=Count('id'),
+        ).order_by()
+        rows = {}
+        for row in grouped.iterator():
+            # NULL and '' model names share one rollup row
+            key = (row['user_id'], row['day'], row['model_name'] or '')
+            rollup = rows.get(key)
+            if rollup is None:
+                rollup = rows[key] = TokenUsageDaily(user_id=key[0], day=key[1], model_name=key[2])
+            rollup.input_tokens += row['input'] or 0
+            rollup.output_tokens += row['output'] or 0
+            rollup.total_tokens += row['total'] or 0
+            rollup.runs += row['runs']
+
+        # Replacing the range in one transaction keeps the rebuild idempotent
+        with transaction.atomic():
+            days.delete()
+            TokenUsageDaily.objects.bulk_create(rows.values(), batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(rows)} token rollups'))
+
+    def _date(self, value):
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Invalid date: {value}')
+        return day
@@ -0,0 +1,89 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from blog.archive import archive_dir, archived_days, iter_archived_day
+from blog.models import SiteVisit, VisitHourlyRollup, VisitDailyRollup
+from blog.rollups import day_start
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the hourly and daily visit rollups from SiteVisit rows plus the visit archive. '
+            'Without an archive, days before the earliest remaining visit are left untouched.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD), default: earliest visit')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD), default: today')
+
+    def handle(self, *args, **options):
+        start = self._date(options['start']) if options['start'] else None
+        end = self._date(options['end']) if options['end'] else None
+        if not archive_dir():
+            # Archived visits may be gone from the table; rebuilding their days
+            # from what is left would wipe their totals
+            first = SiteVisit.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+            if first is None:
+                raise CommandError('No visits to rebuild from and VISIT_ARCHIVE_DIR is not configured')
+            first = timezone.localdate(first)
+            if start is None or start < first:
+                if start is not None:
+                    self.stdout.write(self.style.WARNING(f'VISIT_ARCHIVE_DIR is not configured; starting at {first}, the earliest visit in the database'))
+                start = first
+        visits = SiteVisit.objects.all()
+        hours = VisitHourlyRollup.objects.all()
+        days = VisitDailyRollup.objects.all()
+        if start:
+            visits = visits.filter(timestamp__gte=day_start(start))
+            hours = hours.filter(hour__gte=day_start(start))
+            days = days.filter(day__gte=start)
+        if end:
+            visits = visits.filter(timestamp__lt=day_start(end + datetime.timedelta(days=1)))
+            hours = hours.filter(hour__lt=day_start(end + datetime.timedelta(days=1)))
+            days = days.filter(day__lte=end)
+
+        hourly = visits.annotate(bucket=TruncHour('timestamp')).values('bucket').annotate(n=Count('id')).order_by()
+        counts = {row['bucket']: row['n'] for row in hourly.iterator()}
+        archived = self._add_archived(counts, start, end)
+        daily = {}
+        hour_rows = []
+        for bucket, n in counts.items():
+            hour_rows.append(VisitHourlyRollup(hour=bucket, count=n))
+            day = timezone.localtime(bucket).date()
+            daily[day] = daily.get(day, 0) + n
+
+        # Replacing the range in one transaction keeps the rebuild idempotent
+        with transaction.atomic():
+            hours.delete()
+            days.delete()
+            VisitHourlyRollup.objects.bulk_create(hour_rows, batch_size=1000)
+            VisitDailyRollup.objects.bulk_create([VisitDailyRollup(day=d, count=n) for d, n in daily.items()], batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(hour_rows)} hourly and {len(daily)} daily rollups ({archived} archived visits)'))
+
+    def _add_archived(self, counts, start, end):
+        """Add archived visits in range to ``counts``; rows still in the table are counted there."""
+        added = 0
+        for day in archived_days():
+            if (start and day < start) or (end and day > end):
+                continue
+            rows = list(iter_archived_day(day))
+            ids = [row['id'] for row in rows]
+            # An interrupted archive run leaves rows in both places
+            present = set()
+            for i in range(0, len(ids), 500):
+                present.update(SiteVisit.objects.filter(id__in=ids[i:i + 500]).values_list('id', flat=True))
+            for row in rows:
+                if row['id'] in present:
+                    continue
+                bucket = timezone.localtime(row['timestamp']).replace(minute=0, second=0, microsecond=0)
+                counts[bucket] = counts.get(bucket, 0) + 1
+                added += 1
+        return added
+
+    def _date(self, value):
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Invalid date: {value}')
+        return day
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from blog.models import RefreshToken
+
+
+class Command(BaseCommand):
+    help = 'Delete expired refresh tokens (revoked ones are kept until they expire, for reuse detection)'
+
+    def handle(self, *args, **options):
+        deleted, _ = RefreshToken.objects.filter(expires_at__lte=timezone.now()).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired refresh tokens'))
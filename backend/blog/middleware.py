@@ -1,5 +1,53 @@
+import re
+import zlib
+import atexit
+import threading
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from django.utils import timezone
+from django.utils.deprecation import MiddlewareMixin
+from .batching import BatchWriter, get_batch_writer
+from .sketches import visit_sketches
+from . import rollups
 from .models import SiteVisit
+import logging
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+def _write_visits(items):
+    with transaction.atomic():
+        SiteVisit.objects.bulk_create([SiteVisit(**item) for item in items])
+        rollups.add_visits([item['timestamp'] for item in items])
+    # Sketches are fed by VisitMiddleware; persisting rides on the writer thread.
+    # While every request is throttled nothing is written, so pending deltas
+    # wait for the next visit row (or the exit hook).
+    visit_sketches.persist_if_due(getattr(settings, 'VISIT_SKETCH_PERSIST_INTERVAL', 60))
+
+def _make_visit_writer():
+    background = getattr(settings, 'WRITE_BEHIND_BACKGROUND', True)
+    if background:
+        # Registered before the writer's own stop hook, so it runs after the final flush
+        atexit.register(visit_sketches.persist)
+    return BatchWriter(
+        'site_visits',
+        _write_visits,
+        batch_size=getattr(settings, 'VISIT_BUFFER_BATCH_SIZE', 500) if background else 1,
+        interval=getattr(settings, 'VISIT_BUFFER_INTERVAL', 5.0),
+        max_pending=getattr(settings, 'VISIT_BUFFER_MAX_PENDING', 20000),
+        background=background,
+        sample_above=getattr(settings, 'VISIT_BUFFER_SAMPLE_ABOVE', 0.5),
+        max_attempts=getattr(settings, 'WRITE_BEHIND_MAX_ATTEMPTS', 3),
+    )
+
+def get_visit_writer():
+    return get_batch_writer('site_visits', _make_visit_writer)
 
 class VisitMiddleware:
     def __init__(self, get_response):
@@ -28,22 +76,182 @@ class VisitMiddleware:
             return
 
         ip = self.get_client_ip(request)
-        
+        path = request.path[:200]
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+
+        # Sketches see every request, before throttling and load shedding, so
+        # paths and user agents are not skewed towards first visits
+        try:
+            visit_sketches.add(ip, path, user_agent)
+        except Exception as e:
+            logger.error(f"Error recording visit sketch: {e}")
+
         # Anti-abuse: Throttle visits from the same IP
         # Using cache to store the IP for a specific duration (e.g., 30 minutes)
         # This prevents refreshing the page from increasing the count
         cache_key = f'visit_throttle_{ip}'
         
         if not cache.get(cache_key):
-            # Create a new visit record
+            # Queue a new visit record; a background writer inserts it in bulk
             try:
-                SiteVisit.objects.create(
-                    ip_address=ip,
-                    path=request.path,
-                    user_agent=request.META.get('HTTP_USER_AGENT', '')
-                )
-                # Set the throttle for 30 minutes (1800 seconds)
-                cache.set(cache_key, True, 1800)
+                queued = get_visit_writer().put({
+                    'ip_address': ip,
+                    'path': path,
+                    'user_agent': user_agent,
+                    'timestamp': timezone.now(),
+                })
+                if queued:
+                    # Set the throttle for 30 minutes (1800 seconds)
+                    cache.set(cache_key, True, 1800)
             except Exception as e:
                 # Silently fail to not disrupt the user experience
                 logger.error(f"Error recording visit: {e}")
+
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/', 'application/javascript', 'application/xml')
+
+compression_stats = {'responses': 0, 'streams': 0, 'bytes_in': 0, 'bytes_out': 0}
+_compression_lock = threading.Lock()
+
+def _account(bytes_in, bytes_out, stream=False, finished=True):
+    with _compression_lock:
+        compression_stats['bytes_in'] += bytes_in
+        compression_stats['bytes_out'] += bytes_out
+        if finished:
+            compression_stats['streams' if stream else 'responses'] += 1
+
+def compression_snapshot():
+    with _compression_lock:
+        data = dict(compression_stats)
+    data['bytes_saved'] = data['bytes_in'] - data['bytes_out']
+    return data
+
+def negotiate_encoding(accept_encoding):
+    """
+    Pick 'br' or 'gzip' from an Accept-Encoding header, honouring q-values.
+    Brotli is only offered when the brotli package is installed.
+    """
+    offered = {}
+    for part in accept_encoding.split(','):
+        match = re.match(r'\s*([\w*-]+)\s*(?:;\s*q=([0-9.]+))?', part)
+        if not match:
+            continue
+        try:
+            offered[match.group(1).lower()] = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_q = None, 0
+    for encoding in candidates:
+        q = offered.get(encoding, offered.get('*', 0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+class _StreamCompressor:
+    """
+    Incremental compressor that flushes after every chunk, so each SSE
+    event reaches the client as soon as it is produced.
+    """
+    def __init__(self, encoding):
+        if encoding == 'br':
+            self._br = brotli.Compressor(quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5))
+        else:
+            self._br = None
+            # wbits=31 writes a gzip header and trailer
+            self._zlib = zlib.compressobj(getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        if self._br is not None:
+            return self._br.process(chunk) + self._br.flush()
+        return self._zlib.compress(chunk) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self._br is not None:
+            return self._br.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+def _compress_bytes(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5))
+    compressor = zlib.compressobj(getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Negotiated gzip/brotli compression for JSON, text and SSE responses.
+
+    Regular responses are compressed when at least COMPRESSION_MIN_SIZE bytes
+    and only kept if smaller. Streaming responses (sync or async) go through
+    a flushing compressor so events are not held back. Responses that are
+    already encoded, such as raw passthrough bodies, are left alone.
+    """
+    def process_response(self, request, response):
+        if not getattr(settings, 'COMPRESSION_ENABLED', True):
+            return response
+        if request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        if response.has_header('Content-Encoding') or 'no-transform' in response.get('Cache-Control', ''):
+            return response
+        content_type = response.get('Content-Type', '').lower()
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return response
+        min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        if response.streaming:
+            length = response.get('Content-Length')
+            if length and length.isdigit() and int(length) < min_size:
+                return response
+        elif len(response.content) < min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self._compress_async(response.streaming_content, encoding)
+            else:
+                response.streaming_content = self._compress_sync(response.streaming_content, encoding)
+            if response.has_header('Content-Length'):
+                del response.headers['Content-Length']
+        else:
+            compressed = _compress_bytes(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            _account(len(response.content), len(compressed))
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def _compress_sync(iterator, encoding):
+        compressor = _StreamCompressor(encoding)
+        for chunk in iterator:
+            if not chunk:
+                continue
+            out = compressor.compress(chunk)
+            _account(len(chunk), len(out), stream=True, finished=False)
+            yield out
+        tail = compressor.finish()
+        _account(0, len(tail), stream=True)
+        yield tail
+
+    @staticmethod
+    async def _compress_async(iterator, encoding):
+        compressor = _StreamCompressor(encoding)
+        async for chunk in iterator:
+            if not chunk:
+                continue
+            out = compressor.compress(chunk)
+            _account(len(chunk), len(out), stream=True, finished=False)
+            yield out
+        tail = compressor.finish()
+        _account(0, len(tail), stream=True)
+        yield tail
@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-17 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_sitevisit_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('kind', models.CharField(max_length=16)),
+                ('data', models.BinaryField(default=bytes)),
+                ('top', models.JSONField(blank=True, default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('day', 'kind')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-17 21:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_tokenusagedaily'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sitevisit',
+            index=models.Index(fields=['timestamp'], name='sitevisit_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatthread',
+            index=models.Index(fields=['user', 'thread_id'], name='chatthread_user_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatthread',
+            index=models.Index(fields=['user', '-updated_at'], name='chatthread_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tokenusage',
+            index=models.Index(fields=['user', 'timestamp'], name='tokenusage_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tokenusagedaily',
+            index=models.Index(fields=['day'], name='tokenusagedaily_day_idx'),
+        ),
+    ]
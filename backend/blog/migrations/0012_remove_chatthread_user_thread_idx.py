@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-17 23:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_refreshtoken'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='chatthread',
+            name='chatthread_user_thread_idx',
+        ),
+    ]
@@ -9,6 +9,10 @@ class BaseAuthenticatedView(views.APIView):
     """
     authentication_classes = [JWTAuthentication, authentication.SessionAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    # When True, GET/HEAD/OPTIONS requests whose token carries username and
+    # is_staff claims (JWT_EMBED_CLAIMS) skip the user lookup. Only set it on
+    # views that need nothing more than request.user's id, username and is_staff.
+    jwt_claims_principal = False
 
 class BaseAdminView(BaseAuthenticatedView):
     """
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Article(models.Model):
     title = models.CharField(max_length=200)
@@ -15,16 +16,52 @@ class SiteVisit(models.Model):
     ip_address = models.GenericIPAddressField(verbose_name="IP Address")
     path = models.CharField(max_length=200, verbose_name="Access Path")
     user_agent = models.TextField(verbose_name="User Agent", blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Visit Time")
+    # Set when the request arrives, not when the buffered insert runs
+    timestamp = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Visit Time")
 
     class Meta:
         verbose_name = "Site Visit"
         verbose_name_plural = "Site Visits"
         ordering = ['-timestamp']
+        indexes = [models.Index(fields=['timestamp'], name='sitevisit_timestamp_idx')]
 
     def __str__(self):
         return f"{self.ip_address} - {self.timestamp}"
 
+class VisitHourlyRollup(models.Model):
+    hour = models.DateTimeField(unique=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['hour']
+
+    def __str__(self):
+        return f"{self.hour} - {self.count}"
+
+class VisitDailyRollup(models.Model):
+    day = models.DateField(unique=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day']
+
+    def __str__(self):
+        return f"{self.day} - {self.count}"
+
+class VisitSketch(models.Model):
+    """Persisted per-day visit sketch (HyperLogLog registers or count-min counters)."""
+    day = models.DateField()
+    kind = models.CharField(max_length=16)
+    data = models.BinaryField(default=bytes)
+    top = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('day', 'kind')
+
+    def __str__(self):
+        return f"{self.day} - {self.kind}"
+
 class ChatThread(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_threads')
     thread_id = models.CharField(max_length=64, unique=True)
@@ -35,21 +72,65 @@ class ChatThread(models.Model):
     
     class Meta:
         ordering = ['-updated_at']
+        # Lookups by thread_id (ownership checks) use its unique index
+        indexes = [
+            models.Index(fields=['user', '-updated_at'], name='chatthread_user_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.assistant_id} - {self.thread_id}"
 
+class RefreshToken(models.Model):
+    """
+    A long-lived refresh token, stored as the SHA-256 of its value. Each
+    refresh revokes the row and issues a successor in the same family;
+    presenting a revoked token revokes the whole family.
+    """
+    token_hash = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='refresh_tokens')
+    family = models.CharField(max_length=32, db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.family} - {self.expires_at}"
+
 class TokenUsage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='token_usages')
     thread_id = models.CharField(max_length=64, blank=True, null=True)
     input_tokens = models.IntegerField(default=0)
     output_tokens = models.IntegerField(default=0)
     total_tokens = models.IntegerField(default=0)
+    # The LLM model reported by the stream (e.g. gpt-4o), falling back to the
+    # assistant_id when it is not reported. Rows written before per-model
+    # accounting hold the assistant_id.
     model_name = models.CharField(max_length=128, blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the usage happened, not when the write-behind queue inserts it
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [models.Index(fields=['user', 'timestamp'], name='tokenusage_user_ts_idx')]
 
     def __str__(self):
         return f"{self.user.username} - {self.total_tokens} tokens - {self.timestamp}"
+
+class TokenUsageDaily(models.Model):
+    """Per user, day and model totals, kept in step with TokenUsage inserts."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='token_usage_daily')
+    day = models.DateField()
+    model_name = models.CharField(max_length=128, blank=True, default='')
+    input_tokens = models.BigIntegerField(default=0)
+    output_tokens = models.BigIntegerField(default=0)
+    total_tokens = models.BigIntegerField(default=0)
+    runs = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'day', 'model_name')
+        ordering = ['day']
+        # The unique index leads with user; site-wide ranges need their own
+        indexes = [models.Index(fields=['day'], name='tokenusagedaily_day_idx')]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.day} - {self.model_name} - {self.total_tokens} tokens"
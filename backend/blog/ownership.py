@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .caching import TTLCache
+from .models import ChatThread
+
+# thread_id -> owner user_id. Owners never change, so entries only go away on
+# delete (or after CHAT_OWNER_CACHE_TTL, which bounds staleness across processes).
+_owners = TTLCache(
+    maxsize=getattr(settings, 'CHAT_OWNER_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'CHAT_OWNER_CACHE_TTL', 300),
+)
+# thread_ids with no ChatThread row, kept briefly so scans of bogus ids stay off the DB
+_missing = TTLCache(
+    maxsize=getattr(settings, 'CHAT_OWNER_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'CHAT_OWNER_NEGATIVE_TTL', 30),
+)
+ownership_cache_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+
+
+@receiver(post_save, sender=ChatThread)
+def _thread_saved(sender, instance, created, **kwargs):
+    if created:
+        _missing.delete(instance.thread_id)
+        _owners.set(instance.thread_id, instance.user_id)
+
+
+@receiver(post_delete, sender=ChatThread)
+def _thread_deleted(sender, instance, **kwargs):
+    _owners.delete(instance.thread_id)
+    _missing.delete(instance.thread_id)
+
+
+def thread_owner(thread_id):
+    """The owning user id of ``thread_id``, or None if there is no such thread."""
+    owner = _owners.get(thread_id)
+    if owner is not None:
+        ownership_cache_stats['hits'] += 1
+        return owner
+    if _missing.get(thread_id):
+        ownership_cache_stats['negative_hits'] += 1
+        return None
+    ownership_cache_stats['misses'] += 1
+    owner = ChatThread.objects.filter(thread_id=thread_id).values_list('user_id', flat=True).first()
+    if owner is None:
+        _missing.set(thread_id, True)
+    else:
+        _owners.set(thread_id, owner)
+    return owner
+
+
+def ownership_snapshot():
+    return {'owners': len(_owners), 'missing': len(_missing), **ownership_cache_stats}
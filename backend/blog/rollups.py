@@ -0,0 +1,90 @@
+import datetime
+from collections import Counter
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import VisitHourlyRollup, VisitDailyRollup, TokenUsageDaily
+
+
+def hour_bucket(timestamp):
+    return timezone.localtime(timestamp).replace(minute=0, second=0, microsecond=0)
+
+
+def _increment(model, key, **deltas):
+    """Add ``deltas`` to the ``model`` row matching ``key``, creating it if missing."""
+    updates = {field: F(field) + n for field, n in deltas.items()}
+    if model.objects.filter(**key).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Another writer created the row first
+        model.objects.filter(**key).update(**updates)
+
+
+def add_visits(timestamps):
+    """Count visits into the hourly and daily rollups. Call inside the insert's transaction."""
+    hours = Counter(hour_bucket(ts) for ts in timestamps)
+    days = Counter()
+    for hour, n in hours.items():
+        days[hour.date()] += n
+        _increment(VisitHourlyRollup, {'hour': hour}, count=n)
+    for day, n in days.items():
+        _increment(VisitDailyRollup, {'day': day}, count=n)
+
+
+def total_visits():
+    return VisitDailyRollup.objects.aggregate(total=Sum('count'))['total'] or 0
+
+
+def daily_visits(start, end):
+    rows = VisitDailyRollup.objects.filter(day__gte=start, day__lte=end).order_by('day')
+    return [{'date': row.day, 'count': row.count} for row in rows]
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def hourly_visits(start, end):
+    rows = VisitHourlyRollup.objects.filter(hour__gte=day_start(start), hour__lt=day_start(end + datetime.timedelta(days=1))).order_by('hour')
+    return [{'hour': row.hour, 'count': row.count} for row in rows]
+
+
+TOKEN_FIELDS = ('input_tokens', 'output_tokens', 'total_tokens')
+
+
+def add_token_usage(items):
+    """Fold TokenUsage rows (as dicts) into TokenUsageDaily. Call inside the insert's transaction."""
+    totals = {}
+    for item in items:
+        key = (item['user_id'], timezone.localdate(item['timestamp']), item.get('model_name') or '')
+        total = totals.setdefault(key, dict.fromkeys(TOKEN_FIELDS + ('runs',), 0))
+        for field in TOKEN_FIELDS:
+            total[field] += item.get(field) or 0
+        total['runs'] += 1
+    for (user_id, day, model_name), deltas in totals.items():
+        _increment(TokenUsageDaily, {'user_id': user_id, 'day': day, 'model_name': model_name}, **deltas)
+
+
+def token_totals(qs):
+    totals = qs.aggregate(total=Sum('total_tokens'), input=Sum('input_tokens'), output=Sum('output_tokens'))
+    return {k: v or 0 for k, v in totals.items()}
+
+
+def daily_token_usage(qs, start, end):
+    rows = qs.filter(day__gte=start, day__lte=end).values('day').annotate(
+        total_tokens=Sum('total_tokens'),
+        count=Sum('runs'),
+    ).order_by('day')
+    return [{'date': row['day'], 'total_tokens': row['total_tokens'], 'count': row['count']} for row in rows]
+
+
+def token_usage_by_model(qs):
+    rows = qs.values('model_name').annotate(
+        input_tokens=Sum('input_tokens'),
+        output_tokens=Sum('output_tokens'),
+        total_tokens=Sum('total_tokens'),
+    ).order_by('-total_tokens')
+    return list(rows)
@@ -1,15 +1,29 @@
 import os
+import time
+import atexit
+import asyncio
+import threading
+import weakref
 import requests
+from collections import OrderedDict, deque
+from requests.adapters import HTTPAdapter
 from django.conf import settings
+from django.core.cache import cache
 from rest_framework.exceptions import APIException
+from .caching import SingleFlight, TTLCache
 import logging
 
+try:
+    import httpx
+except ImportError:  # async streaming is optional, the sync path works without it
+    httpx = None
+
 logger = logging.getLogger(__name__)
 
-# Constants
-DEFAULT_TIMEOUT = 10
-LONG_TIMEOUT = 60
-THREAD_TIMEOUT = 15
+# Constants (read timeouts in seconds, overridable from settings)
+DEFAULT_TIMEOUT = getattr(settings, 'LANGGRAPH_DEFAULT_TIMEOUT', 10)
+LONG_TIMEOUT = getattr(settings, 'LANGGRAPH_LONG_TIMEOUT', 60)
+THREAD_TIMEOUT = getattr(settings, 'LANGGRAPH_THREAD_TIMEOUT', 15)
 MAX_LIMIT = 50
 
 class ServiceUnavailable(APIException):
@@ -17,6 +31,15 @@ class ServiceUnavailable(APIException):
     default_detail = '后端服务不可用'
     default_code = 'service_unavailable'
 
+class CircuitOpen(ServiceUnavailable):
+    status_code = 503
+    default_detail = '后端服务暂时不可用，请稍后重试'
+    default_code = 'circuit_open'
+
+    def __init__(self, retry_after, detail=None):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
 def get_langgraph_base_url():
     return getattr(settings, 'LANGGRAPH_API_URL', 'http://127.0.0.1:2024')
 
@@ -28,19 +51,453 @@ def get_service_headers():
         'Accept': 'application/json'
     }
 
-def create_langgraph_thread(assistant_id, title=None):
+ENDPOINT_CLASSES = ('threads', 'runs', 'state', 'history', 'assistants')
+
+def classify_endpoint(path):
+    """
+    Map an upstream path to the endpoint class its circuit breaker tracks.
+    """
+    path = path.split('?', 1)[0].rstrip('/')
+    if path.startswith('/assistants'):
+        return 'assistants'
+    if '/runs' in path:
+        return 'runs'
+    if path.endswith('/state'):
+        return 'state'
+    if path.endswith('/history'):
+        return 'history'
+    return 'threads'
+
+class CircuitBreaker:
+    """
+    Per endpoint class failure tracker.
+
+    Closed: calls go through; consecutive failures (connection errors, 5xx
+    and, when ``slow_call_seconds`` is set, calls slower than it) are counted.
+    Open: calls fail immediately with CircuitOpen. After ``reset_timeout`` a
+    background probe hits the health endpoint; on success the breaker goes
+    half-open, otherwise it stays open and probes again later.
+    Half-open: a single trial call is let through; its outcome closes or
+    re-opens the breaker. A trial that ends without an outcome (cancelled,
+    or failed for reasons unrelated to upstream) calls ``release_trial``;
+    one that never reports back is given up after ``trial_timeout`` seconds
+    so another call can try.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, slow_call_seconds=None, probe=None, trial_timeout=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.trial_timeout = trial_timeout
+        self.slow_call_seconds = slow_call_seconds
+        self.probe = probe
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.trial_started_at = None
+        self.total_calls = 0
+        self.total_failures = 0
+        self.rejected = 0
+        self.avg_latency = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN:
+                now = time.monotonic()
+                if not self.trial_in_flight or now - self.trial_started_at >= self.trial_timeout:
+                    self.trial_in_flight = True
+                    self.trial_started_at = now
+                    return True
+            self.rejected += 1
+            return False
+
+    def release_trial(self):
+        """End a trial call that produced no verdict about upstream health."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return self.reset_timeout
+        return max(1, int(self.opened_at + self.reset_timeout - time.monotonic()) + 1)
+
+    def record_success(self, latency):
+        if self.slow_call_seconds and latency >= self.slow_call_seconds:
+            self.record_failure(latency)
+            return
+        with self._lock:
+            self._observe(latency)
+            self.failures = 0
+            self.trial_in_flight = False
+            self.state = self.CLOSED
+            self.opened_at = None
+
+    def record_failure(self, latency=None):
+        with self._lock:
+            self._observe(latency)
+            self.total_failures += 1
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._open()
+
+    def _observe(self, latency):
+        self.total_calls += 1
+        if latency is not None:
+            # Exponentially weighted so the figure follows recent behaviour
+            self.avg_latency = latency if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * latency
+
+    def _open(self):
+        if self.state != self.OPEN:
+            logger.warning(f"[CircuitBreaker] {self.name} opened after {self.failures} failures")
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._schedule_probe()
+
+    def _schedule_probe(self):
+        if self.probe is None or (self._timer is not None and self._timer.is_alive()):
+            return
+        self._timer = threading.Timer(self.reset_timeout, self._run_probe)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run_probe(self):
+        try:
+            healthy = self.probe()
+        except Exception:
+            healthy = False
+        with self._lock:
+            self._timer = None
+            if self.state != self.OPEN:
+                return
+            if healthy:
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+                logger.info(f"[CircuitBreaker] {self.name} half-open after successful probe")
+            else:
+                self.opened_at = time.monotonic()
+                self._schedule_probe()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'total_calls': self.total_calls,
+                'total_failures': self.total_failures,
+                'rejected': self.rejected,
+                'avg_latency_ms': round(self.avg_latency * 1000, 1) if self.avg_latency is not None else None,
+                'retry_after': self.retry_after() if self.state == self.OPEN else None,
+            }
+
+def _probe_upstream():
+    resp = get_upstream_client().probe()
+    return resp.status_code < 500
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(endpoint_class):
+    breaker = _breakers.get(endpoint_class)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(endpoint_class)
+            if breaker is None:
+                slow_calls = getattr(settings, 'LANGGRAPH_BREAKER_SLOW_CALL_SECONDS', {})
+                breaker = CircuitBreaker(
+                    endpoint_class,
+                    failure_threshold=getattr(settings, 'LANGGRAPH_BREAKER_FAILURE_THRESHOLD', 5),
+                    reset_timeout=getattr(settings, 'LANGGRAPH_BREAKER_RESET_TIMEOUT', 30),
+                    slow_call_seconds=slow_calls.get(endpoint_class),
+                    probe=_probe_upstream,
+                    trial_timeout=getattr(settings, 'LANGGRAPH_BREAKER_TRIAL_TIMEOUT', 60),
+                )
+                _breakers[endpoint_class] = breaker
+    return breaker
+
+def circuit_breaker_states():
+    return {name: get_circuit_breaker(name).snapshot() for name in ENDPOINT_CLASSES}
+
+class UpstreamClient:
+    """
+    Keep-alive HTTP client for the LangGraph API.
+
+    Wraps a ``requests.Session`` whose adapter keeps a bounded pool of
+    persistent connections, so consecutive proxy calls reuse the same TCP
+    connection instead of paying a new connect/handshake every time.
+    Paths are relative to ``LANGGRAPH_API_URL`` and the service headers are
+    sent by default.
+    """
+    def __init__(self, base_url, pool_connections=4, pool_maxsize=20, pool_block=False, connect_timeout=3.05):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.pool_maxsize = pool_maxsize
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def request(self, method, path, timeout=DEFAULT_TIMEOUT, headers=None, **kwargs):
+        breaker = get_circuit_breaker(classify_endpoint(path))
+        if not breaker.allow():
+            raise CircuitOpen(breaker.retry_after())
+        merged = get_service_headers()
+        if headers:
+            merged.update(headers)
+        started = time.monotonic()
+        try:
+            # (connect, read): fail fast on connect, keep the per-call read timeout
+            resp = self.session.request(
+                method,
+                f'{self.base_url}{path}',
+                headers=merged,
+                timeout=(self.connect_timeout, timeout),
+                **kwargs
+            )
+        except requests.RequestException:
+            breaker.record_failure(time.monotonic() - started)
+            raise
+        except BaseException:
+            # Not an upstream fault (bad arguments, interrupted call)
+            breaker.release_trial()
+            raise
+        if resp.status_code >= 500:
+            breaker.record_failure(time.monotonic() - started)
+        else:
+            breaker.record_success(time.monotonic() - started)
+        return resp
+
+    def probe(self):
+        """Health check used by the circuit breakers; bypasses them."""
+        return self.session.get(
+            f'{self.base_url}{getattr(settings, "LANGGRAPH_HEALTH_PATH", "/ok")}',
+            headers=get_service_headers(),
+            timeout=(self.connect_timeout, self.connect_timeout),
+        )
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def stats(self):
+        """
+        Pool counters. A miss is a request that had to open a new connection,
+        a hit is one served by a kept-alive connection.
+        """
+        requests_count = 0
+        connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_count += pool.num_requests
+            connections += pool.num_connections
+        return {
+            'requests': requests_count,
+            'hits': max(requests_count - connections, 0),
+            'misses': connections,
+            'pool_maxsize': self.pool_maxsize,
+        }
+
+    def close(self):
+        self.session.close()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def get_upstream_client():
+    """
+    Return the per-worker UpstreamClient, creating it on first use.
+    Re-created after a fork so worker processes never share sockets.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    base_url = get_langgraph_base_url().rstrip('/')
+    if _client is None or _client_pid != pid or _client.base_url != base_url:
+        with _client_lock:
+            if _client is None or _client_pid != pid or _client.base_url != base_url:
+                _client = UpstreamClient(
+                    base_url,
+                    pool_connections=getattr(settings, 'LANGGRAPH_POOL_CONNECTIONS', 4),
+                    pool_maxsize=getattr(settings, 'LANGGRAPH_POOL_MAXSIZE', 20),
+                    pool_block=getattr(settings, 'LANGGRAPH_POOL_BLOCK', False),
+                    connect_timeout=getattr(settings, 'LANGGRAPH_CONNECT_TIMEOUT', 3.05),
+                )
+                _client_pid = pid
+    return _client
+
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_upstream_client():
+    """
+    Return the httpx.AsyncClient bound to the running event loop, or None when
+    httpx is not installed. Used by the ASGI streaming path so a stream waits
+    on the event loop instead of holding a worker thread.
+    """
+    if httpx is None:
+        return None
+    loop = asyncio.get_running_loop()
+    base_url = get_langgraph_base_url().rstrip('/')
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed or str(client.base_url).rstrip('/') != base_url:
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=get_service_headers(),
+            limits=httpx.Limits(
+                max_connections=getattr(settings, 'LANGGRAPH_ASYNC_MAX_CONNECTIONS', 1000),
+                max_keepalive_connections=getattr(settings, 'LANGGRAPH_POOL_MAXSIZE', 20),
+            ),
+            timeout=httpx.Timeout(LONG_TIMEOUT, connect=getattr(settings, 'LANGGRAPH_CONNECT_TIMEOUT', 3.05)),
+        )
+        _async_clients[loop] = client
+    return client
+
+def is_asgi_request(request):
+    from django.core.handlers.asgi import ASGIRequest
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+def async_streaming_available(request):
+    """
+    True when ``request`` is served by the ASGI handler and the async client
+    can be used. WSGI deployments always get the blocking generator.
+    """
+    if httpx is None or not getattr(settings, 'CHAT_ASYNC_STREAMING', True):
+        return False
+    return is_asgi_request(request)
+
+ASSISTANTS_CACHE_KEY = 'langgraph_assistants'
+_assistants_flight = SingleFlight()
+assistants_cache_stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+def _fetch_assistants():
+    """
+    Query /assistants/search and cache a successful answer.
+    Returns (data, status_code).
+    """
+    payload = {
+        'metadata': {},
+        'limit': MAX_LIMIT,
+        'offset': 0
+    }
+    resp = get_upstream_client().post('/assistants/search', json=payload, timeout=DEFAULT_TIMEOUT)
+    data = resp.json()
+    if resp.status_code == 200:
+        ttl = getattr(settings, 'CHAT_ASSISTANTS_CACHE_TTL', 300)
+        stale_ttl = getattr(settings, 'CHAT_ASSISTANTS_STALE_TTL', 3600)
+        cache.set(ASSISTANTS_CACHE_KEY, {'data': data, 'fetched_at': time.time()}, ttl + stale_ttl)
+    return data, resp.status_code
+
+def _refresh_assistants():
+    try:
+        _assistants_flight.do(ASSISTANTS_CACHE_KEY, _fetch_assistants)
+        assistants_cache_stats['refreshes'] += 1
+    except Exception as e:
+        assistants_cache_stats['refresh_errors'] += 1
+        logger.warning(f"[Assistants] Background refresh failed, keeping stale entry: {e}")
+
+def get_assistants():
+    """
+    Assistant registry with a TTL cache and stale-while-revalidate.
+
+    Fresh entries are served directly. Entries past CHAT_ASSISTANTS_CACHE_TTL
+    but within CHAT_ASSISTANTS_STALE_TTL are served as-is while one background
+    thread refreshes them. A cold cache is filled through a single-flight call
+    so a burst of page loads triggers one upstream request.
+    Returns (data, status_code).
+    """
+    ttl = getattr(settings, 'CHAT_ASSISTANTS_CACHE_TTL', 300)
+    if ttl <= 0:
+        return _fetch_assistants()
+    entry = cache.get(ASSISTANTS_CACHE_KEY)
+    if entry is not None:
+        if time.time() - entry['fetched_at'] < ttl:
+            assistants_cache_stats['hits'] += 1
+        else:
+            assistants_cache_stats['stale_hits'] += 1
+            if not _assistants_flight.in_flight(ASSISTANTS_CACHE_KEY):
+                threading.Thread(target=_refresh_assistants, daemon=True).start()
+        return entry['data'], 200
+    assistants_cache_stats['misses'] += 1
+    return _assistants_flight.do(ASSISTANTS_CACHE_KEY, _fetch_assistants)
+
+_read_flight = SingleFlight()
+_read_cache = TTLCache(maxsize=2048, ttl=0.3)
+coalescing_stats = {'micro_cache_hits': 0}
+
+def coalesced_get(path, params=None, timeout=DEFAULT_TIMEOUT, micro_cache=True):
+    """
+    GET an upstream read endpoint, sharing work between identical requests.
+
+    Concurrent calls with the same path and query parameters wait on one
+    in-flight upstream request and receive the same response. Responses
+    below 500 are also kept for CHATPROXY_MICRO_CACHE_MS milliseconds so a
+    reconnect storm is absorbed even when requests arrive back to back.
+    ``micro_cache=False`` still joins in-flight calls but neither reads nor
+    fills the micro-cache, for reads that must reflect the latest state.
+    Callers must have checked thread ownership already.
+    """
+    if params is not None and hasattr(params, 'lists'):
+        items = [(k, v) for k, values in params.lists() for v in values]
+    else:
+        items = list((params or {}).items())
+    key = (path, tuple(sorted(items)))
+    micro_ttl = getattr(settings, 'CHATPROXY_MICRO_CACHE_MS', 300) / 1000 if micro_cache else 0
+    if micro_ttl > 0:
+        resp = _read_cache.get(key)
+        if resp is not None:
+            coalescing_stats['micro_cache_hits'] += 1
+            return resp
+
+    def fetch():
+        resp = get_upstream_client().get(path, params=items, timeout=timeout)
+        if micro_ttl > 0 and resp.status_code < 500:
+            _read_cache.set(key, resp, micro_ttl)
+        return resp
+
+    return _read_flight.do(key, fetch)
+
+def invalidate_thread_reads(thread_id):
+    """Drop micro-cached reads of a thread after it was written to."""
+    prefix = f'/threads/{thread_id}'
+    _read_cache.delete_where(lambda key: key[0] == prefix or key[0].startswith(prefix + '/'))
+
+def coalescing_snapshot():
+    return {
+        'upstream_calls': _read_flight.executed,
+        'shared_calls': _read_flight.shared,
+        'micro_cache_hits': coalescing_stats['micro_cache_hits'],
+        'micro_cache_size': len(_read_cache),
+    }
+
+def _create_upstream_thread(assistant_id):
     """
     Create a thread in LangGraph service.
     Returns the thread_id.
     """
-    api_url = get_langgraph_base_url()
     payload = {'metadata': {'assistant_id': assistant_id}}
     
     try:
-        resp = requests.post(
-            f'{api_url}/threads', 
+        resp = get_upstream_client().post(
+            '/threads', 
             json=payload, 
-            headers=get_service_headers(), 
             timeout=THREAD_TIMEOUT
         )
         try:
@@ -58,3 +515,179 @@ def create_langgraph_thread(assistant_id, title=None):
     except requests.RequestException as e:
         logger.error(f"LangGraph connection error: {e}")
         raise ServiceUnavailable(detail=f'后端线程服务连接失败: {str(e)}')
+
+def _delete_upstream_thread(thread_id):
+    try:
+        get_upstream_client().delete(f'/threads/{thread_id}', timeout=THREAD_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"[ThreadPool] Failed to delete pooled thread {thread_id}: {e}")
+
+class ThreadPool:
+    """
+    Pre-created LangGraph threads, kept per assistant_id so a new
+    conversation can claim a ready thread id without a round trip.
+
+    Pools are created on first claim (or listed in ``assistants``) and
+    topped up to ``size`` by a background thread. At most
+    ``max_assistants`` pools are kept; the least recently claimed one is
+    dropped beyond that, and pools unclaimed for ``ttl`` seconds are
+    dropped too. Threads older than ``ttl`` are never handed out.
+    Dropped and expired threads are deleted upstream.
+    """
+    def __init__(self, size=2, max_assistants=8, ttl=3600, assistants=(), create=None, delete=None):
+        self.size = size
+        self.max_assistants = max_assistants
+        self.ttl = ttl
+        self.create = create or _create_upstream_thread
+        self.delete = delete or _delete_upstream_thread
+        self._pools = OrderedDict()
+        self._claimed_at = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self.stats = {'hits': 0, 'misses': 0, 'created': 0, 'reclaimed': 0, 'errors': 0}
+        for assistant_id in assistants:
+            self._register(assistant_id)
+
+    def _register(self, assistant_id):
+        # Called with the lock held (or during __init__)
+        if assistant_id not in self._pools:
+            self._pools[assistant_id] = deque()
+        self._pools.move_to_end(assistant_id)
+        self._claimed_at[assistant_id] = time.monotonic()
+
+    def claim(self, assistant_id):
+        """Return a pooled thread id, or create one synchronously on a miss."""
+        now = time.monotonic()
+        thread_id = None
+        with self._lock:
+            self._register(assistant_id)
+            pool = self._pools[assistant_id]
+            while pool:
+                created_at, candidate = pool.popleft()
+                if now - created_at < self.ttl:
+                    thread_id = candidate
+                    break
+            self.stats['hits' if thread_id else 'misses'] += 1
+        self._kick()
+        if thread_id is not None:
+            return thread_id
+        return self.create(assistant_id)
+
+    def _kick(self):
+        self._wakeup.set()
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, daemon=True, name='thread-pool')
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(max(self.ttl / 4, 1))
+            self._wakeup.clear()
+            try:
+                self.replenish()
+            except Exception as e:
+                logger.error(f"[ThreadPool] Replenish failed: {e}")
+
+    def _collect_garbage(self):
+        """Remove expired threads and idle or excess pools; return thread ids to delete."""
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            for assistant_id in [a for a, t in self._claimed_at.items() if now - t > self.ttl]:
+                stale.extend(tid for _, tid in self._pools.pop(assistant_id, ()))
+                del self._claimed_at[assistant_id]
+            while len(self._pools) > self.max_assistants:
+                assistant_id, pool = self._pools.popitem(last=False)
+                self._claimed_at.pop(assistant_id, None)
+                stale.extend(tid for _, tid in pool)
+            for pool in self._pools.values():
+                while pool and now - pool[0][0] >= self.ttl:
+                    stale.append(pool.popleft()[1])
+            self.stats['reclaimed'] += len(stale)
+        return stale
+
+    def replenish(self):
+        """Reclaim stale entries, then top every pool up to ``size``."""
+        for thread_id in self._collect_garbage():
+            self.delete(thread_id)
+        with self._lock:
+            missing = [(a, self.size - len(p)) for a, p in self._pools.items() if len(p) < self.size]
+        for assistant_id, count in missing:
+            for _ in range(count):
+                try:
+                    thread_id = self.create(assistant_id)
+                except Exception as e:
+                    # Leave the rest for the next round rather than hammer a failing upstream
+                    with self._lock:
+                        self.stats['errors'] += 1
+                    logger.warning(f"[ThreadPool] Could not pre-create thread for {assistant_id}: {e}")
+                    return
+                with self._lock:
+                    pool = self._pools.get(assistant_id)
+                    if pool is not None and len(pool) < self.size:
+                        pool.append((time.monotonic(), thread_id))
+                        self.stats['created'] += 1
+                        continue
+                self.delete(thread_id)
+
+    def drain(self):
+        """Delete every pooled thread upstream (on shutdown)."""
+        with self._lock:
+            stale = [tid for pool in self._pools.values() for _, tid in pool]
+            for pool in self._pools.values():
+                pool.clear()
+        for thread_id in stale:
+            self.delete(thread_id)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'pools': {a: len(p) for a, p in self._pools.items()},
+                **self.stats,
+            }
+
+_thread_pool = None
+_thread_pool_pid = None
+_thread_pool_lock = threading.Lock()
+
+def get_thread_pool():
+    """
+    Return the per-worker ThreadPool, or None when pre-warming is disabled
+    (CHAT_THREAD_POOL_SIZE = 0, the default). Each worker keeps its own
+    pool, so enabling it pre-creates size x assistants x workers threads.
+    """
+    global _thread_pool, _thread_pool_pid
+    size = getattr(settings, 'CHAT_THREAD_POOL_SIZE', 0)
+    if size <= 0:
+        return None
+    pid = os.getpid()
+    if _thread_pool is None or _thread_pool_pid != pid or _thread_pool.size != size:
+        with _thread_pool_lock:
+            if _thread_pool is None or _thread_pool_pid != pid or _thread_pool.size != size:
+                _thread_pool = ThreadPool(
+                    size=size,
+                    max_assistants=getattr(settings, 'CHAT_THREAD_POOL_MAX_ASSISTANTS', 8),
+                    ttl=getattr(settings, 'CHAT_THREAD_POOL_TTL', 3600),
+                    assistants=getattr(settings, 'CHAT_THREAD_POOL_ASSISTANTS', ()),
+                )
+                _thread_pool_pid = pid
+                atexit.register(_thread_pool.drain)
+    return _thread_pool
+
+def thread_pool_snapshot():
+    pool = _thread_pool
+    return pool.snapshot() if pool is not None and _thread_pool_pid == os.getpid() else None
+
+def create_langgraph_thread(assistant_id, title=None):
+    """
+    Return a LangGraph thread id for a new conversation, claimed from the
+    pre-warmed pool when one is ready, else created synchronously.
+    """
+    pool = get_thread_pool()
+    if pool is None:
+        return _create_upstream_thread(assistant_id)
+    return pool.claim(assistant_id)
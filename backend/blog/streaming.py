@@ -0,0 +1,380 @@
+import re
+import asyncio
+import itertools
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from .utils import SSEFramer
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_FRAME = b': keepalive\n\n'
+
+
+def _with_event_id(block, event_id):
+    """Re-emit an SSE block with our own ``id:`` field (upstream ids are dropped)."""
+    lines = [line for line in block.splitlines() if not line.startswith(b'id:')]
+    lines.append(b'id: ' + event_id.encode())
+    return b'\n'.join(lines) + b'\n\n'
+
+
+class StreamSubscriber:
+    """
+    One reader of a RunStream. Replayed events sit in ``backlog``; live
+    events are pushed into a queue bounded by ``maxsize``. A reader that lets
+    its queue overflow is evicted rather than slowing the pump or growing
+    memory; it can come back with Last-Event-ID and replay from the ring.
+    """
+    def __init__(self, replay, maxsize, notify):
+        self.backlog = deque(replay)
+        self.queue = deque()
+        self.maxsize = maxsize
+        self.notify = notify
+        self.evicted = False
+
+    def pop(self):
+        if self.backlog:
+            return self.backlog.popleft()
+        if self.queue:
+            return self.queue.popleft()
+        return None
+
+
+SLOW_CONSUMER_FRAME = b'event: error\ndata: {"detail": "slow consumer evicted, resume with Last-Event-ID", "code": "slow_consumer"}\n\n'
+
+
+class RunStream:
+    """
+    One upstream run stream, framed into SSE events and fanned out to any
+    number of subscribers.
+
+    Every event gets the id ``<stream id>:<seq>`` and is kept in a ring
+    buffer of at most ``max_events`` events and ``max_bytes`` bytes (oldest
+    dropped first), so late joiners and reconnecting clients can replay.
+    Live events are copied into each subscriber's bounded queue; the single
+    upstream connection is shared no matter how many clients watch.
+    """
+    def __init__(self, user_id, thread_id, max_events=2000, max_bytes=2 * 1024 * 1024, queue_size=256):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.thread_id = thread_id
+        self.run_id = None
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self.created_at = time.monotonic()
+        self.finished_at = None
+        self.last_seq = 0
+        self.dropped = 0
+        self.evictions = 0
+        self.pump_task = None
+        self._events = deque()
+        self._bytes = 0
+        self._framer = SSEFramer()
+        self._subscribers = set()
+        self._on_finish = []
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def feed(self, chunk):
+        """Add raw upstream bytes; complete events are published."""
+        for block in self._framer.feed(chunk):
+            self._append(block)
+
+    def _append(self, block):
+        if not block.strip():
+            return
+        if self.run_id is None and block.startswith(b'event: metadata'):
+            match = re.search(rb'"run_id"\s*:\s*"([^"]+)"', block)
+            if match:
+                self.run_id = match.group(1).decode()
+        evicted = []
+        with self._lock:
+            self.last_seq += 1
+            event = (self.last_seq, _with_event_id(block, f'{self.id}:{self.last_seq}'))
+            self._events.append(event)
+            self._bytes += len(event[1])
+            while len(self._events) > 1 and (len(self._events) > self.max_events or self._bytes > self.max_bytes):
+                _, old = self._events.popleft()
+                self._bytes -= len(old)
+                self.dropped += 1
+            subscribers = list(self._subscribers)
+            for sub in subscribers:
+                if len(sub.queue) >= sub.maxsize:
+                    sub.evicted = True
+                    self._subscribers.discard(sub)
+                    self.evictions += 1
+                    evicted.append(sub)
+                else:
+                    sub.queue.append(event)
+        for sub in subscribers:
+            sub.notify()
+        if evicted:
+            logger.warning(f"[RunStream] evicted {len(evicted)} slow subscriber(s) from {self.id}")
+
+    def finish(self):
+        rest = self._framer.flush()
+        if rest.strip():
+            self._append(rest)
+        with self._lock:
+            if self.finished_at is not None:
+                return
+            self.finished_at = time.monotonic()
+            subscribers = list(self._subscribers)
+            callbacks, self._on_finish = self._on_finish, []
+        for sub in subscribers:
+            sub.notify()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"[RunStream] finish callback failed: {e}")
+
+    def on_finish(self, callback):
+        with self._lock:
+            if self.finished_at is None:
+                self._on_finish.append(callback)
+                return
+        callback(self)
+
+    def read_after(self, seq):
+        """Return (buffered events newer than ``seq``, finished)."""
+        with self._lock:
+            return self._read_after(seq), self.finished
+
+    def _read_after(self, seq):
+        if not self._events:
+            return []
+        first = self._events[0][0]
+        return list(itertools.islice(self._events, max(seq - first + 1, 0), None))
+
+    def subscribe(self, after, notify):
+        """Register a reader that has seen events up to ``after``."""
+        with self._lock:
+            sub = StreamSubscriber(self._read_after(after), self.queue_size, notify)
+            if self.finished_at is None:
+                self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def _drain(self, sub):
+        """Events ready for ``sub`` and whether it is done (finished or evicted)."""
+        ready = []
+        with self._lock:
+            item = sub.pop()
+            while item is not None:
+                ready.append(item[1])
+                item = sub.pop()
+            done = sub.evicted or (self.finished_at is not None and not sub.queue)
+        return ready, done
+
+    def iter_events(self, after=0, keepalive=15):
+        """Blocking iterator for WSGI responses: replay, then follow live."""
+        wakeup = threading.Event()
+        sub = self.subscribe(after, wakeup.set)
+        try:
+            while True:
+                wakeup.clear()
+                ready, done = self._drain(sub)
+                yield from ready
+                if done:
+                    if sub.evicted:
+                        yield SLOW_CONSUMER_FRAME
+                    return
+                if not ready and not wakeup.wait(keepalive):
+                    yield KEEPALIVE_FRAME
+        finally:
+            self.unsubscribe(sub)
+
+    async def aiter_events(self, after=0, keepalive=15):
+        """Async iterator for ASGI responses: replay, then follow live."""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        sub = self.subscribe(after, lambda: loop.call_soon_threadsafe(wakeup.set))
+        try:
+            while True:
+                wakeup.clear()
+                ready, done = self._drain(sub)
+                for data in ready:
+                    yield data
+                if done:
+                    if sub.evicted:
+                        yield SLOW_CONSUMER_FRAME
+                    return
+                if ready:
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE_FRAME
+        finally:
+            self.unsubscribe(sub)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'thread_id': self.thread_id,
+                'run_id': self.run_id,
+                'events': len(self._events),
+                'bytes': self._bytes,
+                'last_seq': self.last_seq,
+                'dropped': self.dropped,
+                'subscribers': len(self._subscribers),
+                'evictions': self.evictions,
+                'finished': self.finished_at is not None,
+            }
+
+
+class RunStreamRegistry:
+    """
+    Per-process hub of run streams, addressable by stream id (for
+    Last-Event-ID resumption) and by thread (for extra viewers joining the
+    run in progress). Finished streams are kept for ``ttl`` seconds; at most
+    ``max_streams`` are held, evicting finished ones first, then the oldest.
+    """
+    def __init__(self):
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, user_id, thread_id):
+        stream = RunStream(
+            user_id,
+            thread_id,
+            max_events=getattr(settings, 'CHAT_STREAM_REPLAY_MAX_EVENTS', 2000),
+            max_bytes=getattr(settings, 'CHAT_STREAM_REPLAY_MAX_BYTES', 2 * 1024 * 1024),
+            queue_size=getattr(settings, 'CHAT_STREAM_SUBSCRIBER_QUEUE', 256),
+        )
+        with self._lock:
+            self._sweep()
+            self._streams[stream.id] = stream
+        return stream
+
+    def get(self, stream_id):
+        with self._lock:
+            self._sweep()
+            return self._streams.get(stream_id)
+
+    def find(self, user_id, thread_id, run_id=None):
+        """
+        The stream a viewer of ``thread_id`` should join: the one matching
+        ``run_id`` (ours or LangGraph's) if given, else the newest live run.
+        """
+        with self._lock:
+            self._sweep()
+            streams = [s for s in reversed(self._streams.values()) if s.user_id == user_id and s.thread_id == thread_id]
+        if run_id:
+            return next((s for s in streams if run_id in (s.id, s.run_id)), None)
+        return next((s for s in streams if not s.finished), None)
+
+    def resume(self, last_event_id, user_id, thread_id):
+        """
+        Resolve a Last-Event-ID to (stream, seq). Returns (None, None) when
+        the id is malformed, expired or belongs to another user or thread.
+        """
+        stream_id, _, seq = (last_event_id or '').strip().partition(':')
+        if not seq.isdigit():
+            return None, None
+        stream = self.get(stream_id)
+        if stream is None or stream.user_id != user_id or stream.thread_id != thread_id:
+            return None, None
+        return stream, int(seq)
+
+    def _sweep(self):
+        ttl = getattr(settings, 'CHAT_STREAM_REPLAY_TTL', 300)
+        max_streams = getattr(settings, 'CHAT_STREAM_REPLAY_MAX_RUNS', 500)
+        now = time.monotonic()
+        for stream_id in [sid for sid, s in self._streams.items() if s.finished_at is not None and now - s.finished_at > ttl]:
+            del self._streams[stream_id]
+        while len(self._streams) > max_streams:
+            finished = next((sid for sid, s in self._streams.items() if s.finished), None)
+            del self._streams[finished if finished is not None else next(iter(self._streams))]
+
+    def stats(self):
+        with self._lock:
+            self._sweep()
+            streams = list(self._streams.values())
+        snapshots = [s.snapshot() for s in streams]
+        return {
+            'streams': len(snapshots),
+            'live': sum(1 for s in snapshots if not s['finished']),
+            'subscribers': sum(s['subscribers'] for s in snapshots),
+            'evictions': sum(s['evictions'] for s in snapshots),
+            'buffered_bytes': sum(s['bytes'] for s in snapshots),
+        }
+
+
+run_streams = RunStreamRegistry()
+
+
+async def aiter_blocking(iterable):
+    """
+    Async view of a blocking iterator for ASGI responses. Each step runs in
+    the sync thread, so items reach the client as they are produced rather
+    than after Django drains the whole iterator into memory. Closing the
+    response closes the underlying generator there too.
+    """
+    iterator = iter(iterable)
+    done = object()
+    try:
+        while True:
+            item = await sync_to_async(next)(iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
+
+
+async def start_task_pump(stream, pump):
+    """
+    Schedule the ``pump`` coroutine on the running loop as the stream's
+    feeder. It runs whether or not any reader ever iterates the stream.
+    """
+    stream.pump_task = asyncio.get_running_loop().create_task(pump)
+
+
+def start_thread_pump(stream, chunks, on_chunk=None, on_done=None):
+    """
+    Feed ``stream`` from a blocking chunk iterator on a daemon thread, so the
+    run keeps going (and stays resumable) when the client disconnects.
+    """
+    def pump():
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                stream.feed(chunk)
+                if on_chunk is not None:
+                    try:
+                        on_chunk(chunk)
+                    except Exception:
+                        pass
+        except Exception as e:
+            logger.error(f"[RunStream] upstream read failed for {stream.thread_id}: {e}")
+        finally:
+            if on_done is not None:
+                try:
+                    on_done()
+                except Exception as e:
+                    logger.error(f"[RunStream] completion hook failed: {e}")
+                # The hook may have opened DB connections on this short-lived thread
+                connections.close_all()
+            stream.finish()
+
+    thread = threading.Thread(target=pump, daemon=True, name=f'run-stream-{stream.id[:8]}')
+    thread.start()
+    return thread
@@ -0,0 +1,24 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the suite with the write-behind queues writing synchronously and
+    never spilling, so tests see their rows at once and leave no spill files.
+    Production defaults stay in settings.py; tests that exercise the
+    background thread build their own BatchWriter.
+    """
+    test_settings = {
+        'WRITE_BEHIND_BACKGROUND': False,
+        'WRITE_BEHIND_SPILL_DIR': '',
+    }
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_settings = override_settings(**self.test_settings)
+        self._test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,8 +1,15 @@
-from django.test import TestCase
+import datetime
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.utils import timezone
 from django.urls import reverse
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
-from .models import ChatThread
+from .models import ChatThread, RefreshToken
+from .authentication import generate_token, _changed_at, _hash_refresh_token
+from .ownership import thread_owner, _owners, _missing
+from .views import AdminUsersListView, AdminUserDetailView, UserTokenUsageView
 from unittest.mock import patch
 
 class AuthTests(TestCase):
@@ -47,6 +54,134 @@ class AuthTests(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertFalse(resp.json().get('is_authenticated'))
 
+class RefreshTokenTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='alice', password='pass1234')
+        resp = self.client.post(reverse('login'), {'username': 'alice', 'password': 'pass1234'}, format='json')
+        self.refresh = resp.json()['refresh']
+
+    def _refresh(self, token):
+        return self.client.post(reverse('token_refresh'), {'refresh': token}, format='json')
+
+    @patch('blog.views.authenticate')
+    def test_refresh_rotates_without_password_check(self, mock_authenticate):
+        resp = self._refresh(self.refresh)
+        self.assertEqual(resp.status_code, 200)
+        mock_authenticate.assert_not_called()
+        data = resp.json()
+        self.assertNotEqual(data['refresh'], self.refresh)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + data['token'])
+        self.assertEqual(self.client.get(reverse('check_auth')).json()['username'], 'alice')
+        self.assertTrue(RefreshToken.objects.filter(token_hash=_hash_refresh_token(self.refresh), revoked_at__isnull=False).exists())
+
+    def test_concurrent_refresh_gets_same_successor(self):
+        first = self._refresh(self.refresh)
+        # Another tab sent the same token before seeing the rotation
+        second = self._refresh(self.refresh)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['refresh'], first.json()['refresh'])
+        self.assertEqual(self._refresh(first.json()['refresh']).status_code, 200)
+        # Once the successor has been used, replaying the original is reuse
+        self.assertEqual(self._refresh(self.refresh).status_code, 401)
+
+    def test_reused_refresh_token_revokes_family(self):
+        rotated = self._refresh(self.refresh).json()['refresh']
+        # Past the grace window
+        RefreshToken.objects.filter(token_hash=_hash_refresh_token(self.refresh)).update(
+            revoked_at=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(self._refresh(self.refresh).status_code, 401)
+        # The legitimate successor is revoked too, forcing a fresh login
+        self.assertEqual(self._refresh(rotated).status_code, 401)
+
+    def test_expired_and_logged_out_tokens_fail(self):
+        RefreshToken.objects.update(expires_at=timezone.now())
+        self.assertEqual(self._refresh(self.refresh).status_code, 401)
+        self.assertEqual(self._refresh('bogus').status_code, 401)
+        refresh = self.client.post(reverse('login'), {'username': 'alice', 'password': 'pass1234'}, format='json').json()['refresh']
+        self.client.post(reverse('logout'), {'refresh': refresh}, format='json')
+        self.assertEqual(self._refresh(refresh).status_code, 401)
+
+    def test_expired_access_token_is_401(self):
+        with override_settings(JWT_ACCESS_TOKEN_TTL=-1):
+            token = generate_token(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+        self.assertEqual(self.client.get(reverse('chat_threads')).status_code, 401)
+
+class PrincipalCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='alice', password='pass1234')
+        self.admin = User.objects.create_user(username='root', password='pass1234', is_staff=True)
+
+    def _user_queries(self, method, url, user):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + generate_token(user))
+        with CaptureQueriesContext(connection) as ctx:
+            resp = getattr(self.client, method)(url)
+        return resp, [q for q in ctx.captured_queries if 'FROM "auth_user"' in q['sql']]
+
+    def test_resolved_user_is_cached_until_saved(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + generate_token(self.user))
+        self.client.get(reverse('check_auth'))
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse('check_auth'))
+        self.assertEqual(resp.json()['username'], 'alice')
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "auth_user"' in q['sql']])
+        self.user.username = 'alice2'
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('check_auth')).json()['username'], 'alice2')
+        self.user.delete()
+        self.assertEqual(self.client.get(reverse('check_auth')).status_code, 401)
+
+    @override_settings(JWT_EMBED_CLAIMS=True)
+    def test_claims_skip_lookup_on_opted_in_reads(self):
+        _changed_at.clear()
+        resp, queries = self._user_queries('get', reverse('chat_threads'), self.user)
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(queries)
+        resp, queries = self._user_queries('get', reverse('admin_token_stats'), self.admin)
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(queries)
+        # Writes and views that did not opt in still load the user
+        _, queries = self._user_queries('get', reverse('check_auth'), self.user)
+        self.assertTrue(queries)
+        # User management and per-user usage (?user_id=) always check the admin against the database
+        self.assertFalse(AdminUsersListView.jwt_claims_principal)
+        self.assertFalse(AdminUserDetailView.jwt_claims_principal)
+        self.assertFalse(UserTokenUsageView.jwt_claims_principal)
+
+    @override_settings(JWT_EMBED_CLAIMS=True)
+    def test_claims_not_trusted_after_user_changes(self):
+        _changed_at.clear()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + generate_token(self.admin))
+        self.assertEqual(self.client.get(reverse('admin_token_stats')).status_code, 200)
+        self.admin.is_staff = False
+        self.admin.save()
+        self.assertEqual(self.client.get(reverse('admin_token_stats')).status_code, 403)
+
+class OwnershipCacheTests(TestCase):
+    def setUp(self):
+        _owners.clear()
+        _missing.clear()
+        self.user = User.objects.create_user(username='bob', password='pass1234')
+
+    def test_owner_cached_until_deleted(self):
+        ChatThread.objects.create(user=self.user, thread_id='t1', assistant_id='a1')
+        _owners.clear()
+        self.assertEqual(thread_owner('t1'), self.user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(thread_owner('t1'), self.user.id)
+        ChatThread.objects.get(thread_id='t1').delete()
+        self.assertIsNone(thread_owner('t1'))
+
+    def test_unknown_ids_are_negatively_cached(self):
+        self.assertIsNone(thread_owner('bogus'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(thread_owner('bogus'))
+        ChatThread.objects.create(user=self.user, thread_id='bogus', assistant_id='a1')
+        with self.assertNumQueries(0):
+            self.assertEqual(thread_owner('bogus'), self.user.id)
+
 class ThreadTests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, AsyncClient, override_settings
+from blog.admission import RunAdmission, RunsThrottled, get_run_admission
+from blog.authentication import generate_token
+from blog.models import ChatThread
+from blog.streaming import run_streams
+from blog.tests_services import FakeLangGraphServer
+
+
+class RunAdmissionTests(SimpleTestCase):
+    def test_per_user_cap_queues_and_releases(self):
+        admission = RunAdmission(max_running=4, max_per_user=1, max_queue=4, max_wait=2)
+        first = admission.acquire('a')
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(admission.acquire('a')))
+        waiter.start()
+        time.sleep(0.05)
+        self.assertEqual(admission.snapshot()['waiting'], 1)
+        other = admission.acquire('b')  # another user is not held up
+        first.release()
+        first.release()  # idempotent
+        waiter.join()
+        self.assertEqual(admission.snapshot()['running'], 2)
+        other.release()
+        results[0].release()
+        self.assertEqual(admission.snapshot()['running'], 0)
+
+    def test_full_queue_rejects_with_retry_after(self):
+        admission = RunAdmission(max_running=1, max_per_user=1, max_queue=0, max_wait=1)
+        admission.acquire('a')
+        with self.assertRaises(RunsThrottled) as ctx:
+            admission.acquire('b')
+        self.assertGreaterEqual(ctx.exception.wait, 1)
+        self.assertEqual(admission.snapshot()['rejected'], 1)
+
+    def test_wait_times_out(self):
+        admission = RunAdmission(max_running=1, max_per_user=1, max_queue=2, max_wait=0.05)
+        admission.acquire('a')
+        with self.assertRaises(RunsThrottled):
+            admission.acquire('b')
+        snapshot = admission.snapshot()
+        self.assertEqual((snapshot['timed_out'], snapshot['waiting']), (1, 0))
+
+    def test_slots_rotate_between_users(self):
+        admission = RunAdmission(max_running=1, max_per_user=5, max_queue=10, max_wait=2)
+        running = admission.acquire('a')
+        order = []
+        lock = threading.Lock()
+
+        def run(user):
+            permit = admission.acquire(user)
+            with lock:
+                order.append(user)
+            time.sleep(0.01)
+            permit.release()
+
+        workers = []
+        for user in ('a', 'a', 'a', 'b'):
+            workers.append(threading.Thread(target=run, args=(user,)))
+            workers[-1].start()
+            time.sleep(0.02)
+        running.release()
+        for w in workers:
+            w.join()
+        self.assertEqual(order[:2], ['a', 'b'])
+
+
+@override_settings(CHAT_RUNS_MAX_CONCURRENT=1, CHAT_RUNS_MAX_PER_USER=1, CHAT_RUNS_QUEUE_SIZE=0)
+class RunAdmissionViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='hank', password='pass1234')
+        ChatThread.objects.create(user=self.user, thread_id='t-busy', assistant_id='agent')
+        self.auth = f'Bearer {generate_token(self.user)}'
+
+    def test_over_cap_gets_429(self):
+        permit = get_run_admission().acquire(self.user.id)
+        try:
+            resp = self.client.post('/api/chatproxy/threads/t-busy/runs/wait', {'assistant_id': 'agent'},
+                                    content_type='application/json', HTTP_AUTHORIZATION=self.auth)
+        finally:
+            permit.release()
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn('Retry-After', resp.headers)
+
+    def test_wait_permit_is_released_when_response_closes_unread(self):
+        with FakeLangGraphServer() as server, override_settings(LANGGRAPH_API_URL=server.url):
+            resp = self.client.post('/api/chatproxy/threads/t-busy/runs/wait', {'assistant_id': 'agent'},
+                                    content_type='application/json', HTTP_AUTHORIZATION=self.auth)
+            self.assertTrue(resp.streaming)
+            self.assertEqual(get_run_admission().snapshot()['running'], 1)
+            resp.close()
+        self.assertEqual(get_run_admission().snapshot()['running'], 0)
+
+    async def test_asgi_stream_permit_is_released_without_a_reader(self):
+        with FakeLangGraphServer() as server, override_settings(LANGGRAPH_API_URL=server.url):
+            resp = await AsyncClient().post('/api/chatproxy/threads/t-busy/runs/stream', {'assistant_id': 'agent'},
+                                            content_type='application/json', headers={'Authorization': self.auth})
+            # The body is never iterated, as when the client disconnects straight away
+            stream = run_streams.get(resp['X-Run-Stream-Id'])
+            for _ in range(200):
+                if stream.finished:
+                    break
+                await asyncio.sleep(0.01)
+        self.assertTrue(stream.finished)
+        self.assertEqual(get_run_admission().snapshot()['running'], 0)
@@ -0,0 +1,89 @@
+import os
+import gzip
+import datetime
+import tempfile
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from blog.authentication import generate_token
+from blog.models import SiteVisit, VisitDailyRollup
+from blog import rollups
+from blog.archive import archive_path, archive_visits, read_archived_visits, _append
+
+
+class VisitArchiveTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(VISIT_ARCHIVE_DIR=self.tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.today = timezone.localdate()
+        self.now = timezone.now()
+        cache.clear()
+
+    def _visit(self, days, path='/api/articles/'):
+        return SiteVisit.objects.create(ip_address='1.2.3.4', path=path, user_agent='ua', timestamp=self.now - datetime.timedelta(days=days))
+
+    def test_archives_old_rows_in_chunks(self):
+        for days in (100, 100, 95, 95, 95, 10, 0):
+            self._visit(days)
+        before = self.today - datetime.timedelta(days=90)
+        self.assertEqual(archive_visits(before, chunk_size=2), 5)
+        self.assertEqual(SiteVisit.objects.count(), 2)
+        old_day = timezone.localdate(self.now - datetime.timedelta(days=100))
+        self.assertTrue(os.path.exists(archive_path(old_day)))
+        with gzip.open(archive_path(old_day), 'rt') as f:
+            self.assertEqual(len(f.readlines()), 2)
+        archived = read_archived_visits(old_day, self.today)
+        self.assertEqual(len(archived), 5)
+        self.assertEqual(archived[0]['timestamp'], self.now - datetime.timedelta(days=100))
+        self.assertEqual(archive_visits(before), 0)
+
+    def test_reader_filters_and_drops_duplicates(self):
+        rows = [self._visit(50, path=p) for p in ('/api/articles/', '/api/chat/', '/api/articles/1/')]
+        day = timezone.localdate(rows[0].timestamp)
+        # As if a crash happened after writing a chunk but before deleting it
+        _append(archive_path(day), [{'id': rows[0].id, 'ip_address': '1.2.3.4', 'path': '/api/articles/',
+                                     'user_agent': 'ua', 'timestamp': rows[0].timestamp}])
+        archive_visits(self.today)
+        self.assertEqual(len(read_archived_visits(day, day)), 3)
+        self.assertEqual(len(read_archived_visits(day, day, path_prefix='/api/articles/')), 2)
+        self.assertEqual(len(read_archived_visits(day, day, limit=1)), 1)
+
+    def test_command_and_admin_endpoint(self):
+        self._visit(120)
+        self._visit(1)
+        out = StringIO()
+        call_command('archive_visits', days=30, dry_run=True, stdout=out)
+        self.assertIn('1 visits', out.getvalue())
+        self.assertEqual(SiteVisit.objects.count(), 2)
+        call_command('archive_visits', days=30, stdout=StringIO())
+        self.assertEqual(SiteVisit.objects.count(), 1)
+
+        admin = User.objects.create_user(username='root', password='pass1234', is_staff=True)
+        start = self.today - datetime.timedelta(days=150)
+        resp = self.client.get('/api/admin/visits/archive/', {'start': str(start)}, HTTP_AUTHORIZATION=f'Bearer {generate_token(admin)}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.data['visits']), 1)
+        self.assertFalse(resp.data['truncated'])
+        user = User.objects.create_user(username='alice', password='pass1234')
+        resp = self.client.get('/api/admin/visits/archive/', HTTP_AUTHORIZATION=f'Bearer {generate_token(user)}')
+        self.assertEqual(resp.status_code, 403)
+
+    def test_backfill_keeps_archived_days(self):
+        visits = [self._visit(days) for days in (120, 120, 1)]
+        rollups.add_visits([v.timestamp for v in visits])
+        old_day = timezone.localdate(visits[0].timestamp)
+        archive_visits(self.today - datetime.timedelta(days=30))
+        call_command('backfill_visit_rollups', stdout=StringIO())
+        self.assertEqual(VisitDailyRollup.objects.get(day=old_day).count, 2)
+        self.assertEqual(rollups.total_visits(), 3)
+        # Without the archive, days before the earliest remaining visit are left alone
+        with override_settings(VISIT_ARCHIVE_DIR=''):
+            call_command('backfill_visit_rollups', start=str(old_day), stdout=StringIO())
+        self.assertEqual(VisitDailyRollup.objects.get(day=old_day).count, 2)
+        self.assertEqual(rollups.total_visits(), 3)
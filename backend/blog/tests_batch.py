@@ -0,0 +1,65 @@
+import json
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.test import TestCase, AsyncClient, override_settings
+from blog import services
+from blog.authentication import generate_token
+from blog.models import ChatThread
+from blog.tests_services import FakeLangGraphServer, WAIT_BODY
+
+URL = '/api/chatproxy/runs/batch'
+
+
+class RunsBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ivy', password='pass1234')
+        other = User.objects.create_user(username='jack', password='pass1234')
+        ChatThread.objects.create(user=self.user, thread_id='t-mine', assistant_id='agent')
+        ChatThread.objects.create(user=other, thread_id='t-theirs', assistant_id='agent')
+        self.auth = f'Bearer {generate_token(self.user)}'
+        services._breakers.clear()
+        self.body = {
+            'assistant_id': 'agent',
+            'items': [
+                {'thread_id': 't-mine', 'input': {'messages': []}},
+                {'title': 'fresh', 'input': {'messages': []}},
+                {'thread_id': 't-theirs', 'input': {'messages': []}},
+            ],
+        }
+
+    def _post(self, body):
+        with FakeLangGraphServer() as server, override_settings(LANGGRAPH_API_URL=server.url), \
+                patch('blog.batch.create_langgraph_thread', return_value='t-new'):
+            resp = self.client.post(URL, body, content_type='application/json', HTTP_AUTHORIZATION=self.auth)
+            content = b''.join(resp.streaming_content) if resp.streaming else resp.content
+        return resp, content
+
+    def test_results_ordered_by_index(self):
+        resp, content = self._post(self.body)
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(content)['results']
+        self.assertEqual([r['status'] for r in results], [200, 200, 403])
+        self.assertEqual(results[0]['result'], json.loads(WAIT_BODY))
+        self.assertEqual(results[1]['thread_id'], 't-new')
+        created = ChatThread.objects.get(thread_id='t-new')
+        self.assertEqual((created.user, created.title), (self.user, 'fresh'))
+
+    def test_streamed_as_ndjson(self):
+        resp, content = self._post({**self.body, 'stream': True})
+        self.assertEqual(resp['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(sorted(r['index'] for r in lines), [0, 1, 2])
+
+    async def test_streamed_incrementally_under_asgi(self):
+        with FakeLangGraphServer() as server, override_settings(LANGGRAPH_API_URL=server.url), \
+                patch('blog.batch.create_langgraph_thread', return_value='t-new'):
+            resp = await AsyncClient().post(URL, {**self.body, 'stream': True}, content_type='application/json',
+                                            headers={'Authorization': self.auth})
+            self.assertTrue(resp.is_async)
+            lines = [json.loads(line) async for line in resp.streaming_content]
+        self.assertEqual(sorted(r['index'] for r in lines), [0, 1, 2])
+        self.assertTrue(await ChatThread.objects.filter(thread_id='t-new', user=self.user).aexists())
+
+    def test_rejects_invalid_items(self):
+        resp = self.client.post(URL, {'items': [{'input': {}}]}, content_type='application/json', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import time
+from django.utils import timezone
+from django.contrib.auth.models import User
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase
+from blog.batching import BatchWriter
+from blog.models import TokenUsage
+from blog.usage import record_token_usage, get_usage_writer, _write_usage
+
+
+class BatchWriterTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+
+    def test_background_flush_on_size_and_interval(self):
+        writer = BatchWriter('t', self.batches.append, batch_size=3, interval=0.05)
+        for i in range(4):
+            writer.put({'i': i})
+        deadline = time.monotonic() + 2
+        while writer.stats['flushed'] < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        writer.stop()
+        self.assertEqual([len(b) for b in self.batches], [3, 1])
+
+    def test_failed_batch_is_retried(self):
+        calls = []
+
+        def flaky(batch):
+            calls.append(batch)
+            if len(calls) == 1:
+                raise RuntimeError('database is locked')
+        writer = BatchWriter('t', flaky, batch_size=10, background=False)
+        writer.put({'i': 1})
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.pending(), 1)
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(writer.stats['errors'], 1)
+
+    def test_poison_row_is_isolated_then_dropped(self):
+        def strict(batch):
+            if any(item['i'] == 3 for item in batch):
+                raise ValueError('bad row')
+            self.batches.append(batch)
+        writer = BatchWriter('t', strict, batch_size=10, max_attempts=2, background=False)
+        for i in range(8):
+            writer.put({'i': i})
+        self.assertEqual(writer.flush(), 7)
+        self.assertEqual(writer.pending(), 1)
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.pending(), 0)
+        self.assertEqual(writer.stats['poisoned'], 1)
+        self.assertEqual(sorted(item['i'] for b in self.batches for item in b), [0, 1, 2, 4, 5, 6, 7])
+
+    def test_transient_errors_never_drop_rows(self):
+        def locked(batch):
+            raise OperationalError('database is locked')
+        writer = BatchWriter('t', locked, batch_size=10, max_attempts=1, background=False)
+        for i in range(4):
+            writer.put({'i': i})
+        for _ in range(3):
+            self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.pending(), 4)
+        self.assertEqual(writer.stats['poisoned'], 0)
+
+    def test_overflow_and_shutdown_spill_then_replay(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            def broken(batch):
+                raise RuntimeError('db down')
+            writer = BatchWriter('usage', broken, batch_size=10, max_pending=2, spill_dir=spill_dir, background=False)
+            for i in range(3):
+                writer.put({'i': i})
+            writer.stop()
+            self.assertEqual(writer.stats['spilled'], 3)
+            self.assertEqual(len(os.listdir(spill_dir)), 1)
+            restarted = BatchWriter('usage', self.batches.append, spill_dir=spill_dir, background=False)
+            self.assertEqual(restarted.replay(), 3)
+            restarted.flush()
+            self.assertEqual(os.listdir(spill_dir), [])
+        self.assertEqual(sorted(item['i'] for item in self.batches[0]), [0, 1, 2])
+
+    def test_replay_skips_corrupt_lines(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            with open(os.path.join(spill_dir, f'usage-{os.getpid()}.jsonl'), 'w') as f:
+                f.write('{"i": 0}\n{"i": 1}\n{"i": 2')
+            writer = BatchWriter('usage', self.batches.append, spill_dir=spill_dir, background=False)
+            self.assertEqual(writer.replay(), 2)
+            self.assertEqual(writer.stats['corrupt'], 1)
+            self.assertEqual(os.listdir(spill_dir), [])
+
+    def test_replay_leaves_files_of_live_workers(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            live = os.path.join(spill_dir, f'usage-{os.getppid()}.jsonl')
+            with open(live, 'w') as f:
+                f.write('{"i": 0}\n')
+            writer = BatchWriter('usage', self.batches.append, spill_dir=spill_dir, background=False)
+            self.assertEqual(writer.replay(), 0)
+            self.assertTrue(os.path.exists(live))
+
+    def test_replay_recovers_files_claimed_by_dead_workers(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            with open(os.path.join(spill_dir, 'usage-1.jsonl.replay-999999999'), 'w') as f:
+                f.write('{"i": 0}\n')
+            writer = BatchWriter('usage', self.batches.append, spill_dir=spill_dir, background=False)
+            self.assertEqual(writer.replay(), 1)
+            self.assertEqual(os.listdir(spill_dir), [])
+
+    def test_retry_count_follows_the_row(self):
+        seen = []
+
+        def write(batch):
+            seen.extend(batch)
+            raise RuntimeError('bad row')
+        writer = BatchWriter('usage', write, batch_size=10, background=False, max_attempts=2)
+        writer.put({'i': 0})
+        writer.flush()
+        self.assertEqual(writer.pending(), 1)
+        writer.flush()
+        self.assertEqual(writer.pending(), 0)
+        self.assertEqual(writer.stats['poisoned'], 1)
+        self.assertEqual(writer._attempts, {})
+
+
+class TokenUsageWriteBehindTests(TestCase):
+    def test_usage_is_written_in_bulk(self):
+        user = User.objects.create_user(username='kate', password='pass1234')
+        record_token_usage(user.id, 't1', 'gpt-4o', {'input_tokens': 1, 'output_tokens': 2, 'total_tokens': 3})
+        get_usage_writer().flush()
+        usage = TokenUsage.objects.get(thread_id='t1')
+        self.assertEqual((usage.model_name, usage.total_tokens), ('gpt-4o', 3))
+
+    def test_bad_usage_row_does_not_block_good_ones(self):
+        user = User.objects.create_user(username='liam', password='pass1234')
+        writer = BatchWriter('usage-test', _write_usage, batch_size=10, max_attempts=1, background=False)
+        for i in range(5):
+            writer.put({'user_id': user.id, 'thread_id': f't{i}', 'input_tokens': 1, 'output_tokens': 1,
+                        # NOT NULL violation on one row
+                        'total_tokens': None if i == 2 else 2, 'model_name': 'gpt-4o', 'timestamp': timezone.now()})
+        self.assertEqual(writer.flush(), 4)
+        self.assertEqual(writer.stats['poisoned'], 1)
+        self.assertEqual(sorted(TokenUsage.objects.values_list('thread_id', flat=True)), ['t0', 't1', 't3', 't4'])
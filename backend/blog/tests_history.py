@@ -0,0 +1,79 @@
+from unittest.mock import patch
+from django.test import SimpleTestCase, override_settings
+from blog import history
+
+
+class _Resp:
+    status_code = 200
+    headers = {'Content-Type': 'application/json'}
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeHistory:
+    """Newest-first checkpoint list answering LangGraph's limit/before params."""
+    def __init__(self, count):
+        self.states = []
+        self.calls = []
+        self.add(count)
+
+    def add(self, count):
+        start = len(self.states)
+        new = [{'checkpoint': {'checkpoint_id': f'cp{start + i:03d}'}, 'values': {}} for i in range(count)]
+        self.states = list(reversed(new)) + self.states
+
+    def __call__(self, path, params, timeout=None, micro_cache=True):
+        self.calls.append(dict(params, micro_cache=micro_cache))
+        states = self.states
+        if 'before' in params:
+            ids = [s['checkpoint']['checkpoint_id'] for s in states]
+            states = states[ids.index(params['before']) + 1:]
+        return _Resp(states[:int(params['limit'])])
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=5)
+class IncrementalHistoryTests(SimpleTestCase):
+    def setUp(self):
+        history._history_cache.clear()
+        self.fake = FakeHistory(12)
+        patcher = patch('blog.history.coalesced_get', self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_etag_round_trip_returns_not_modified(self):
+        first = history.get_thread_history('t', limit='8')
+        self.assertEqual(len(first.data), 8)
+        self.assertEqual(first.data[0]['checkpoint']['checkpoint_id'], 'cp011')
+        again = history.get_thread_history('t', limit='8', if_none_match=first.etag)
+        self.assertTrue(again.not_modified)
+        self.assertEqual(again.status_code, 304)
+
+    def test_head_probe_bypasses_micro_cache(self):
+        history.get_thread_history('t', limit='3')
+        self.assertFalse(self.fake.calls[0]['micro_cache'])
+        self.assertTrue(all(call['micro_cache'] for call in self.fake.calls[1:]))
+
+    def test_only_new_checkpoints_are_fetched(self):
+        history.get_thread_history('t', limit='8')
+        self.fake.add(2)
+        self.fake.calls.clear()
+        result = history.get_thread_history('t', limit='8')
+        self.assertEqual(result.data[0]['checkpoint']['checkpoint_id'], 'cp013')
+        # one head probe plus a single page that reaches the previously cached head
+        self.assertEqual(len(self.fake.calls), 2)
+
+    def test_since_returns_delta(self):
+        history.get_thread_history('t', limit='5')
+        self.fake.add(3)
+        result = history.get_thread_history('t', limit='5', since='cp011')
+        self.assertEqual(result.mode, 'delta')
+        self.assertEqual([history.checkpoint_id(s) for s in result.data], ['cp014', 'cp013', 'cp012'])
+
+    def test_unknown_since_falls_back_to_full(self):
+        result = history.get_thread_history('t', limit='3', since='missing')
+        self.assertEqual(result.mode, 'full')
+        self.assertEqual(len(result.data), 3)
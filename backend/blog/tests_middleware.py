@@ -0,0 +1,92 @@
+import gzip
+import json
+import zlib
+from unittest.mock import patch
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.utils import timezone
+from blog.batching import BatchWriter
+from blog.middleware import CompressionMiddleware, VisitMiddleware, negotiate_encoding, get_visit_writer
+from blog.models import SiteVisit
+from blog.sketches import VisitSketches
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _run(self, response, accept='gzip, deflate'):
+        request = self.factory.get('/api/chatproxy/threads/t/state', HTTP_ACCEPT_ENCODING=accept)
+        return CompressionMiddleware(lambda r: response)(request)
+
+    def test_negotiation_honours_q_values(self):
+        self.assertEqual(negotiate_encoding('gzip, deflate'), 'gzip')
+        self.assertIsNone(negotiate_encoding('gzip;q=0, identity'))
+        self.assertIsNone(negotiate_encoding(''))
+
+    def test_large_json_is_gzipped(self):
+        body = json.dumps({'messages': ['hello world'] * 500}).encode()
+        resp = self._run(HttpResponse(body, content_type='application/json'))
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(resp.content), body)
+        self.assertIn('Accept-Encoding', resp['Vary'])
+
+    @override_settings(COMPRESSION_MIN_SIZE=4096)
+    def test_small_or_encoded_responses_untouched(self):
+        small = self._run(HttpResponse(b'{"a": 1}', content_type='application/json'))
+        self.assertFalse(small.has_header('Content-Encoding'))
+        encoded = HttpResponse(b'x' * 10000, content_type='application/json')
+        encoded['Content-Encoding'] = 'br'
+        self.assertEqual(self._run(encoded)['Content-Encoding'], 'br')
+
+    def test_sse_events_are_flushed_individually(self):
+        events = [f'event: messages\ndata: {json.dumps({"i": i, "text": "token " * 20})}\n\n'.encode() for i in range(3)]
+        resp = self._run(StreamingHttpResponse(iter(events), content_type='text/event-stream'))
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        decoder = zlib.decompressobj(31)
+        chunks = list(resp.streaming_content)
+        # every compressed chunk decodes to its whole event without waiting for the next one
+        for event, chunk in zip(events, chunks):
+            self.assertEqual(decoder.decompress(chunk), event)
+
+
+class VisitMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.middleware = VisitMiddleware(lambda r: HttpResponse('ok'))
+
+    def test_visits_are_buffered_and_throttled_per_ip(self):
+        for ip in ('10.0.0.1', '10.0.0.1', '10.0.0.2'):
+            self.middleware(self.factory.get('/api/articles/', REMOTE_ADDR=ip))
+        get_visit_writer().flush()
+        self.assertEqual(sorted(SiteVisit.objects.values_list('ip_address', flat=True)), ['10.0.0.1', '10.0.0.2'])
+
+
+    def test_sketches_count_throttled_requests(self):
+        sketches = VisitSketches()
+        with patch('blog.middleware.visit_sketches', sketches):
+            for path in ('/api/articles/', '/api/articles/1/', '/api/articles/1/'):
+                self.middleware(self.factory.get(path, REMOTE_ADDR='10.0.0.1'))
+            get_visit_writer().flush()
+        self.assertEqual(SiteVisit.objects.count(), 1)
+        today = timezone.localdate()
+        merged = sketches.read(today, today)
+        self.assertEqual(merged['paths'].top(1), [{'key': '/api/articles/1/', 'count': 2}])
+        self.assertEqual(merged['unique_ips'].count(), 1)
+
+
+class BackpressureTests(SimpleTestCase):
+    def test_full_buffer_drops(self):
+        writer = BatchWriter('v', lambda batch: None, batch_size=1000, max_pending=10, background=False)
+        accepted = sum(writer.put({'i': i}) for i in range(15))
+        self.assertEqual((accepted, writer.stats['dropped']), (10, 5))
+
+    def test_high_water_mark_samples(self):
+        writer = BatchWriter('v', lambda batch: None, batch_size=1000, max_pending=100, background=False, sample_above=0.5)
+        accepted = sum(writer.put({'i': i}) for i in range(300))
+        self.assertEqual(accepted, writer.pending())
+        self.assertGreaterEqual(accepted, 50)
+        self.assertGreater(writer.stats['sampled_out'], 0)
+        self.assertEqual(accepted + writer.stats['sampled_out'] + writer.stats['dropped'], 300)
@@ -0,0 +1,82 @@
+import datetime
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from blog.authentication import generate_token
+from blog.models import ChatThread, SiteVisit, TokenUsage
+from blog.usage import record_token_usage, get_usage_writer
+from blog import rollups
+
+
+class QueryPlanTests(TestCase):
+    """
+    Runs each hot endpoint, then EXPLAIN QUERY PLAN on every SELECT it
+    issued. A filtered or ordered query that still scans a whole table is
+    missing an index. Unfiltered aggregates (site-wide totals) read every
+    row by design and are skipped.
+    """
+    def setUp(self):
+        self.admin = User.objects.create_user(username='root', password='pass1234', is_staff=True)
+        self.user = User.objects.create_user(username='alice', password='pass1234')
+        now = timezone.now()
+        for days in range(3):
+            SiteVisit.objects.create(ip_address='1.2.3.4', path='/api/articles/', timestamp=now - datetime.timedelta(days=days))
+        rollups.add_visits([now])
+        for i in range(3):
+            ChatThread.objects.create(user=self.user, thread_id=f't{i}', assistant_id='a1')
+            record_token_usage(self.user.id, f't{i}', 'gpt-4o', {'input_tokens': 1, 'output_tokens': 1, 'total_tokens': 2})
+        get_usage_writer().flush()
+        cache.clear()
+
+    def _auth(self, user):
+        return {'HTTP_AUTHORIZATION': f'Bearer {generate_token(user)}'}
+
+    def _full_scans(self, queries):
+        scans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or (' WHERE ' not in sql and ' ORDER BY ' not in sql):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    if detail.startswith('SCAN') and 'USING' not in detail:
+                        scans.append(f'{detail}\n    {sql}')
+        return scans
+
+    def assertNoFullScans(self, method, path, user, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = getattr(self.client, method)(path, params, **self._auth(user))
+        self.assertLess(resp.status_code, 500)
+        scans = self._full_scans(ctx.captured_queries)
+        self.assertFalse(scans, 'full table scans:\n' + '\n'.join(scans))
+        return resp
+
+    def test_dashboard(self):
+        resp = self.assertNoFullScans('get', '/api/dashboard/stats/', self.admin, granularity='hour')
+        self.assertEqual(resp.status_code, 200)
+
+    def test_admin_token_stats(self):
+        resp = self.assertNoFullScans('get', '/api/admin/token-stats/', self.admin)
+        self.assertEqual(resp.data['global_stats']['total'], 6)
+
+    def test_user_token_usage(self):
+        resp = self.assertNoFullScans('get', '/api/token-usage/', self.user)
+        self.assertEqual(len(resp.data['history']), 3)
+
+    def test_thread_list(self):
+        resp = self.assertNoFullScans('get', '/api/chat/threads/', self.user)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_ownership_check(self):
+        resp = self.assertNoFullScans('get', '/api/chatproxy/threads/t1/runs/stream', self.admin)
+        self.assertEqual(resp.status_code, 403)
+
+    def test_detects_full_scan(self):
+        with CaptureQueriesContext(connection) as ctx:
+            list(TokenUsage.objects.filter(model_name='gpt-4o'))
+        self.assertTrue(self._full_scans(ctx.captured_queries))
@@ -0,0 +1,110 @@
+import datetime
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from blog.authentication import generate_token
+from blog.models import SiteVisit, VisitHourlyRollup, VisitDailyRollup, TokenUsage, TokenUsageDaily
+from blog.usage import record_token_usage, get_usage_writer
+from blog import rollups
+
+
+class VisitRollupTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='root', password='pass1234', is_staff=True)
+        self.auth = f'Bearer {generate_token(self.admin)}'
+        self.now = timezone.now()
+        cache.clear()
+
+    def _visit(self, ts):
+        SiteVisit.objects.create(ip_address='1.2.3.4', path='/api/articles/', timestamp=ts)
+
+    def test_incremental_counts(self):
+        earlier = self.now - datetime.timedelta(days=2)
+        rollups.add_visits([self.now, self.now, earlier])
+        rollups.add_visits([self.now])
+        self.assertEqual(VisitDailyRollup.objects.get(day=timezone.localdate(self.now)).count, 3)
+        self.assertEqual(VisitHourlyRollup.objects.get(hour=rollups.hour_bucket(earlier)).count, 1)
+        self.assertEqual(rollups.total_visits(), 4)
+
+    def test_backfill_rebuilds_from_rows(self):
+        for days in (0, 0, 1, 40):
+            self._visit(self.now - datetime.timedelta(days=days))
+        rollups.add_visits([self.now] * 10)  # stale counts are replaced
+        call_command('backfill_visit_rollups', stdout=StringIO())
+        self.assertEqual(rollups.total_visits(), 4)
+        start = timezone.localdate(self.now - datetime.timedelta(days=1))
+        call_command('backfill_visit_rollups', start=str(start), stdout=StringIO())
+        self.assertEqual(rollups.total_visits(), 4)
+
+    def test_dashboard_reads_rollups_for_range(self):
+        rollups.add_visits([self.now - datetime.timedelta(days=20), self.now])
+        today = timezone.localdate()
+        resp = self.client.get('/api/dashboard/stats/', HTTP_AUTHORIZATION=self.auth)
+        # the dashboard request itself is recorded as a visit too
+        self.assertEqual([d['count'] for d in resp.data['daily_visits']], [2])
+        self.assertEqual(resp.data['total_visits'], 3)
+        resp = self.client.get('/api/dashboard/stats/', {'start': str(today - datetime.timedelta(days=30)), 'granularity': 'hour'},
+                               HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(len(resp.data['daily_visits']), 2)
+        self.assertEqual(sum(h['count'] for h in resp.data['hourly_visits']), 3)
+        bad = self.client.get('/api/dashboard/stats/', {'start': 'yesterday'}, HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(bad.status_code, 400)
+
+
+class TokenRollupTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='root', password='pass1234', is_staff=True)
+        self.user = User.objects.create_user(username='alice', password='pass1234')
+        self.now = timezone.now()
+        cache.clear()
+
+    def _usage(self, user, model_name, total, days=0):
+        TokenUsage.objects.create(user=user, thread_id='t1', model_name=model_name, input_tokens=total // 2,
+                                  output_tokens=total - total // 2, total_tokens=total,
+                                  timestamp=self.now - datetime.timedelta(days=days))
+
+    def test_usage_writes_update_rollups(self):
+        record_token_usage(self.user.id, 't1', 'gpt-4o', {'input_tokens': 3, 'output_tokens': 4, 'total_tokens': 7})
+        record_token_usage(self.user.id, 't1', 'gpt-4o', {'input_tokens': 1, 'output_tokens': 1, 'total_tokens': 2})
+        record_token_usage(self.user.id, 't1', None, {'input_tokens': 5, 'output_tokens': 0, 'total_tokens': 5})
+        get_usage_writer().flush()
+        row = TokenUsageDaily.objects.get(user=self.user, model_name='gpt-4o')
+        self.assertEqual((row.input_tokens, row.output_tokens, row.total_tokens, row.runs), (4, 5, 9, 2))
+        self.assertEqual(row.day, timezone.localdate(self.now))
+        self.assertEqual(TokenUsageDaily.objects.get(user=self.user, model_name='').total_tokens, 5)
+
+    def test_backfill_rebuilds_from_rows(self):
+        self._usage(self.user, 'gpt-4o', 10)
+        self._usage(self.user, 'gpt-4o', 20)
+        self._usage(self.user, None, 6, days=3)
+        self._usage(self.admin, 'claude', 8, days=3)
+        TokenUsageDaily.objects.create(user=self.user, day=timezone.localdate(self.now), model_name='gpt-4o', total_tokens=999)
+        call_command('backfill_token_rollups', stdout=StringIO())
+        self.assertEqual(rollups.token_totals(TokenUsageDaily.objects.all())['total'], 44)
+        row = TokenUsageDaily.objects.get(user=self.user, model_name='gpt-4o')
+        self.assertEqual((row.total_tokens, row.runs), (30, 2))
+        start = timezone.localdate(self.now - datetime.timedelta(days=1))
+        call_command('backfill_token_rollups', start=str(start), stdout=StringIO())
+        self.assertEqual(TokenUsageDaily.objects.count(), 3)
+
+    def test_endpoints_read_rollups(self):
+        for user, model_name, total, days in ((self.user, 'gpt-4o', 10, 0), (self.user, 'claude', 4, 2), (self.admin, 'gpt-4o', 7, 0)):
+            record_token_usage(user.id, 't1', model_name, {'input_tokens': total, 'output_tokens': 0, 'total_tokens': total})
+        get_usage_writer().flush()
+        TokenUsageDaily.objects.filter(model_name='claude').update(day=timezone.localdate(self.now) - datetime.timedelta(days=2))
+
+        admin_auth = f'Bearer {generate_token(self.admin)}'
+        resp = self.client.get('/api/admin/token-stats/', HTTP_AUTHORIZATION=admin_auth)
+        self.assertEqual(resp.data['global_stats'], {'total': 21, 'input': 21, 'output': 0})
+        self.assertEqual([(d['total_tokens'], d['count']) for d in resp.data['daily_usage']], [(4, 1), (17, 2)])
+
+        resp = self.client.get('/api/token-usage/', HTTP_AUTHORIZATION=f'Bearer {generate_token(self.user)}')
+        self.assertEqual(resp.data['totals']['total'], 14)
+        self.assertEqual([m['model_name'] for m in resp.data['by_model']], ['gpt-4o', 'claude'])
+        self.assertEqual(len(resp.data['history']), 2)
+        resp = self.client.get('/api/token-usage/', {'user_id': self.user.id, 'start': str(timezone.localdate(self.now))},
+                               HTTP_AUTHORIZATION=admin_auth)
+        self.assertEqual([d['total_tokens'] for d in resp.data['daily_usage']], [10])
@@ -0,0 +1,404 @@
+import re
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, AsyncClient, override_settings
+from blog.authentication import generate_token
+from blog.models import ChatThread, TokenUsage
+from blog import services
+from blog.services import UpstreamClient, CircuitBreaker
+
+SSE_BODY = (
+    'event: metadata\ndata: {"run_id": "r1"}\n\n'
+    'event: messages\ndata: {"usage_metadata": {"input_tokens": 1, "output_tokens": 2, "total_tokens": 3}}\n\n'
+    'event: end\ndata: null\n\n'
+).encode()
+# Deliberately not in DRF's canonical rendering (spacing, key order) to detect re-encoding
+WAIT_BODY = '{"values":  {"messages": []}, "z": 1, "a": "中文"}'.encode()
+
+
+class _FakeLangGraphHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = json.dumps({
+            'path': self.path,
+            'authorization': self.headers.get('Authorization'),
+            'accept': self.headers.get('Accept'),
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.endswith('/runs/wait'):
+            body, content_type = WAIT_BODY, 'application/json; charset=utf-8'
+        else:
+            body, content_type = SSE_BODY, 'text/event-stream'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeLangGraphServer:
+    """Local keep-alive HTTP server standing in for the LangGraph API."""
+    def __init__(self, handler=_FakeLangGraphHandler):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class UpstreamClientTests(SimpleTestCase):
+    def test_connections_are_reused(self):
+        with FakeLangGraphServer() as server:
+            client = UpstreamClient(server.url, pool_maxsize=2)
+            for _ in range(3):
+                resp = client.get('/threads/abc')
+                self.assertEqual(resp.json()['path'], '/threads/abc')
+            stats = client.stats()
+            client.close()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+    def test_service_headers_are_merged(self):
+        with FakeLangGraphServer() as server:
+            client = UpstreamClient(server.url + '/')
+            data = client.get('/ok', headers={'Accept': 'text/event-stream'}).json()
+            client.close()
+        self.assertTrue(data['authorization'].startswith('Bearer '))
+        self.assertEqual(data['accept'], 'text/event-stream')
+
+
+class AsyncRunsStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='carol', password='pass1234')
+        ChatThread.objects.create(user=self.user, thread_id='t-async', assistant_id='agent')
+        self.auth = f'Bearer {generate_token(self.user)}'
+
+    async def test_asgi_stream_is_relayed_with_async_iterator(self):
+        with FakeLangGraphServer() as server, override_settings(LANGGRAPH_API_URL=server.url):
+            client = AsyncClient()
+            resp = await client.post(
+                '/api/chatproxy/threads/t-async/runs/stream',
+                {'assistant_id': 'agent'},
+                content_type='application/json',
+                headers={'Authorization': self.auth},
+            )
+            self.assertTrue(resp.is_async)
+            body = b''.join([chunk async for chunk in resp.streaming_content])
+        # events are relayed unchanged apart from the replay ids
+        self.assertEqual(re.sub(rb'id: [0-9a-f]+:\d+\n', b'', body), SSE_BODY)
+        usage = await TokenUsage.objects.aget(thread_id='t-async')
+        self.assertEqual(usage.total_tokens, 3)
+
+
+    async def test_asgi_upstream_error_status_is_passed_through(self):
+        class _Rejecting(_FakeLangGraphHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                body = b'{"detail": "assistant not found"}'
+                self.send_response(422)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        with FakeLangGraphServer(_Rejecting) as server, override_settings(LANGGRAPH_API_URL=server.url):
+            resp = await AsyncClient().post(
+                '/api/chatproxy/threads/t-async/runs/stream',
+                {'assistant_id': 'missing'},
+                content_type='application/json',
+                headers={'Authorization': self.auth},
+            )
+        # Same status and body the sync path relays
+        self.assertEqual(resp.status_code, 422)
+        self.assertEqual(json.loads(resp.content), {'detail': 'assistant not found'})
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_threshold_and_rejects(self):
+        breaker = CircuitBreaker('threads', failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.snapshot()['rejected'], 1)
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = CircuitBreaker('state', failure_threshold=1, slow_call_seconds=0.5)
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_success(2.0)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_background_probe_half_opens_then_trial_closes(self):
+        breaker = CircuitBreaker('runs', failure_threshold=1, reset_timeout=0.01, probe=lambda: True)
+        breaker.record_failure()
+        deadline = time.monotonic() + 2
+        while breaker.state != CircuitBreaker.HALF_OPEN and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # only one trial at a time
+        breaker.record_success(0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def _half_open(self, **kwargs):
+        breaker = CircuitBreaker('runs', failure_threshold=1, **kwargs)
+        breaker.record_failure()
+        breaker.state = CircuitBreaker.HALF_OPEN
+        return breaker
+
+    def test_trial_without_verdict_frees_the_slot(self):
+        breaker = self._half_open()
+        client = UpstreamClient('http://127.0.0.1:9')
+        with patch('blog.services.get_circuit_breaker', return_value=breaker), \
+                patch.object(client.session, 'request', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                client.get('/threads/abc/runs')
+        client.close()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+    def test_stuck_trial_is_abandoned_after_timeout(self):
+        breaker = self._half_open(trial_timeout=0.05)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+
+
+class CircuitOpenViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='dave', password='pass1234')
+        ChatThread.objects.create(user=self.user, thread_id='t-open', assistant_id='agent')
+        self.auth = f'Bearer {generate_token(self.user)}'
+        services._breakers.clear()
+
+    def tearDown(self):
+        services._breakers.clear()
+
+    def test_open_breaker_fails_fast_with_503(self):
+        breaker = services.get_circuit_breaker('state')
+        breaker.probe = None
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        resp = self.client.get('/api/chatproxy/threads/t-open/state', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(resp.status_code, 503)
+        self.assertIn('Retry-After', resp.headers)
+
+    async def test_open_breaker_fails_fast_on_asgi_stream(self):
+        breaker = services.get_circuit_breaker('runs')
+        breaker.probe = None
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        resp = await AsyncClient().post('/api/chatproxy/threads/t-open/runs/stream', {'assistant_id': 'agent'},
+                                        content_type='application/json', headers={'Authorization': self.auth})
+        self.assertEqual(resp.status_code, 503)
+        self.assertIn('Retry-After', resp.headers)
+
+
+class AssistantsCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.delete(services.ASSISTANTS_CACHE_KEY)
+        self.calls = 0
+        self.release = threading.Event()
+
+    def tearDown(self):
+        cache.delete(services.ASSISTANTS_CACHE_KEY)
+
+    def _fake_client(self):
+        test = self
+
+        class _Resp:
+            status_code = 200
+            def json(self):
+                return [{'assistant_id': f'a{test.calls}'}]
+
+        class _Client:
+            def post(self, path, **kwargs):
+                test.calls += 1
+                test.release.wait(2)
+                return _Resp()
+        return _Client()
+
+    def test_cold_burst_triggers_single_upstream_call(self):
+        results = []
+        with patch('blog.services.get_upstream_client', return_value=self._fake_client()):
+            workers = [threading.Thread(target=lambda: results.append(services.get_assistants())) for _ in range(8)]
+            for w in workers:
+                w.start()
+            time.sleep(0.05)
+            self.release.set()
+            for w in workers:
+                w.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(r == ([{'assistant_id': 'a1'}], 200) for r in results))
+
+    @override_settings(CHAT_ASSISTANTS_CACHE_TTL=60)
+    def test_stale_entry_served_while_refreshing(self):
+        cache.set(services.ASSISTANTS_CACHE_KEY, {'data': ['old'], 'fetched_at': time.time() - 120}, 600)
+        self.release.set()
+        with patch('blog.services.get_upstream_client', return_value=self._fake_client()):
+            data, status_code = services.get_assistants()
+            self.assertEqual(data, ['old'])
+            deadline = time.monotonic() + 2
+            while cache.get(services.ASSISTANTS_CACHE_KEY)['data'] == ['old'] and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(cache.get(services.ASSISTANTS_CACHE_KEY)['data'], [{'assistant_id': 'a1'}])
+
+
+class CoalescedReadTests(SimpleTestCase):
+    def setUp(self):
+        services._read_cache.clear()
+        self.calls = []
+        self.release = threading.Event()
+
+    def _fake_client(self):
+        test = self
+
+        class _Resp:
+            status_code = 200
+
+        class _Client:
+            def get(self, path, params=None, **kwargs):
+                test.calls.append((path, params))
+                test.release.wait(2)
+                return _Resp()
+        return _Client()
+
+    def test_identical_concurrent_reads_share_one_call(self):
+        results = []
+        with patch('blog.services.get_upstream_client', return_value=self._fake_client()):
+            workers = [
+                threading.Thread(target=lambda: results.append(services.coalesced_get('/threads/t1/history', {'limit': '20'})))
+                for _ in range(5)
+            ]
+            other = threading.Thread(target=lambda: results.append(services.coalesced_get('/threads/t1/history', {'limit': '5'})))
+            for w in workers + [other]:
+                w.start()
+            time.sleep(0.05)
+            self.release.set()
+            for w in workers + [other]:
+                w.join()
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(len(results), 6)
+
+    def test_micro_cache_and_invalidation(self):
+        self.release.set()
+        with patch('blog.services.get_upstream_client', return_value=self._fake_client()):
+            first = services.coalesced_get('/threads/t2/state')
+            self.assertIs(services.coalesced_get('/threads/t2/state'), first)
+            services.invalidate_thread_reads('t2')
+            services.coalesced_get('/threads/t2/state')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_micro_cache_can_be_bypassed(self):
+        self.release.set()
+        with patch('blog.services.get_upstream_client', return_value=self._fake_client()):
+            services.coalesced_get('/threads/t3/history', {'limit': '1'})
+            services.coalesced_get('/threads/t3/history', {'limit': '1'}, micro_cache=False)
+            services.coalesced_get('/threads/t3/history', {'limit': '1'}, micro_cache=False)
+        self.assertEqual(len(self.calls), 3)
+
+
+class PassthroughTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='erin', password='pass1234')
+        ChatThread.objects.create(user=self.user, thread_id='t-pass', assistant_id='agent')
+        self.auth = f'Bearer {generate_token(self.user)}'
+        services._breakers.clear()
+
+    def _run_wait(self):
+        with FakeLangGraphServer() as server, override_settings(LANGGRAPH_API_URL=server.url):
+            resp = self.client.post('/api/chatproxy/threads/t-pass/runs/wait', {'assistant_id': 'agent'},
+                                    content_type='application/json', HTTP_AUTHORIZATION=self.auth)
+            body = b''.join(resp.streaming_content) if resp.streaming else resp.content
+        return resp, body
+
+    def test_body_and_headers_forwarded_unchanged(self):
+        resp, body = self._run_wait()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(body, WAIT_BODY)
+        self.assertEqual(resp['Content-Type'], 'application/json; charset=utf-8')
+        self.assertEqual(resp['Content-Length'], str(len(WAIT_BODY)))
+
+    @override_settings(CHATPROXY_PASSTHROUGH=False)
+    def test_parsing_fallback(self):
+        resp, body = self._run_wait()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(body)['a'], '中文')
+        self.assertNotEqual(body, WAIT_BODY)
+
+
+class ThreadPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.counter = 0
+        self.deleted = []
+
+    def _create(self, assistant_id):
+        self.counter += 1
+        return f'{assistant_id}-{self.counter}'
+
+    def test_miss_creates_then_pool_serves_claims(self):
+        pool = services.ThreadPool(size=2, create=self._create, delete=self.deleted.append)
+        pool._kick = lambda: None  # drive replenishment by hand
+        self.assertEqual(pool.claim('agent'), 'agent-1')
+        pool.replenish()
+        self.assertEqual(pool.snapshot()['pools'], {'agent': 2})
+        self.assertEqual(pool.claim('agent'), 'agent-2')
+        self.assertEqual(pool.snapshot()['hits'], 1)
+
+    def test_expired_and_excess_entries_are_reclaimed(self):
+        pool = services.ThreadPool(size=1, max_assistants=1, ttl=60, assistants=['a'], create=self._create, delete=self.deleted.append)
+        pool._kick = lambda: None
+        pool.replenish()
+        pool._pools['a'][0] = (time.monotonic() - 120, 'a-1')
+        pool.replenish()
+        self.assertEqual(self.deleted, ['a-1'])
+        pool.claim('b')  # evicts the least recently claimed pool
+        pool.replenish()
+        self.assertEqual(list(pool.snapshot()['pools']), ['b'])
+        self.assertEqual(self.deleted, ['a-1', 'a-2'])
+
+    def test_create_errors_are_counted(self):
+        def failing(assistant_id):
+            raise ConnectionError('down')
+        pool = services.ThreadPool(size=2, assistants=['agent'], create=failing, delete=self.deleted.append)
+        pool.replenish()
+        self.assertEqual(pool.snapshot()['errors'], 1)
+        self.assertEqual(pool.snapshot()['pools'], {'agent': 0})
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(services.get_thread_pool())
+
+    def test_background_worker_replenishes(self):
+        pool = services.ThreadPool(size=1, create=self._create, delete=self.deleted.append)
+        pool.claim('agent')
+        deadline = time.monotonic() + 2
+        while pool.snapshot()['pools']['agent'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pool.claim('agent'), 'agent-2')
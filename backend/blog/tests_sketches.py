@@ -0,0 +1,52 @@
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from blog.authentication import generate_token
+from blog.models import VisitSketch
+from blog.sketches import HyperLogLog, HeavyHitters, VisitSketches
+
+
+class SketchTests(SimpleTestCase):
+    def test_hyperloglog_estimate_and_merge(self):
+        a, b = HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            a.add(f'10.0.{i % 256}.{i // 256}')
+        for i in range(10000, 30000):
+            b.add(f'10.0.{i % 256}.{i // 256}')
+        self.assertAlmostEqual(a.count(), 20000, delta=20000 * 0.05)
+        self.assertEqual(HyperLogLog().count(), 0)
+        self.assertAlmostEqual(HyperLogLog.from_bytes(a.to_bytes()).merge(b).count(), 30000, delta=30000 * 0.05)
+
+    def test_heavy_hitters_rank_top_keys(self):
+        hitters = HeavyHitters(capacity=8)
+        for i in range(2000):
+            hitters.add(f'/api/articles/{i}/')
+            if i % 2 == 0:
+                hitters.add('/api/articles/')
+            if i % 5 == 0:
+                hitters.add('/api/chat/threads/')
+        top = hitters.top(2)
+        self.assertEqual([t['key'] for t in top], ['/api/articles/', '/api/chat/threads/'])
+        self.assertGreaterEqual(top[0]['count'], 1000)
+
+
+class VisitSketchPersistenceTests(TestCase):
+    def test_persist_folds_deltas_into_rows(self):
+        sketches = VisitSketches()
+        for i in range(3):
+            sketches.add(f'1.1.1.{i}', '/api/articles/', 'curl')
+        sketches.persist()
+        sketches.add('1.1.1.9', '/api/articles/', 'curl')
+        sketches.persist()
+        self.assertEqual(VisitSketch.objects.count(), 3)
+        today = timezone.localdate()
+        merged = sketches.read(today, today)
+        self.assertEqual(merged['unique_ips'].count(), 4)
+        self.assertEqual(merged['paths'].top(1), [{'key': '/api/articles/', 'count': 4}])
+
+    def test_dashboard_exposes_sketch_fields(self):
+        admin = User.objects.create_user(username='root', password='pass1234', is_staff=True)
+        resp = self.client.get('/api/dashboard/stats/', HTTP_AUTHORIZATION=f'Bearer {generate_token(admin)}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('range', resp.data['unique_visitors'])
+        self.assertIn('top_paths', resp.data)
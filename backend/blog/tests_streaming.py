@@ -0,0 +1,144 @@
+import re
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from blog import services
+from blog.authentication import generate_token
+from blog.models import ChatThread
+from blog.streaming import RunStream, RunStreamRegistry, run_streams
+from blog.tests_services import FakeLangGraphServer, SSE_BODY
+
+
+def _event(i):
+    return f'event: messages\ndata: {{"i": {i}}}\n\n'.encode()
+
+
+class RunStreamTests(SimpleTestCase):
+    def test_events_get_ids_and_replay_after_cursor(self):
+        stream = RunStream(1, 't')
+        stream.feed(_event(1) + _event(2)[:10])
+        stream.feed(_event(2)[10:] + _event(3))
+        stream.finish()
+        events, finished = stream.read_after(1)
+        self.assertTrue(finished)
+        self.assertEqual([seq for seq, _ in events], [2, 3])
+        self.assertIn(f'id: {stream.id}:3'.encode(), events[-1][1])
+        self.assertEqual(b''.join(stream.iter_events(2)), events[-1][1])
+
+    def test_ring_buffer_caps(self):
+        stream = RunStream(1, 't', max_events=3)
+        for i in range(10):
+            stream.feed(_event(i))
+        events, _ = stream.read_after(0)
+        self.assertEqual([seq for seq, _ in events], [8, 9, 10])
+        self.assertEqual(stream.dropped, 7)
+
+    def test_resume_checks_owner_and_thread(self):
+        registry = RunStreamRegistry()
+        stream = registry.create(1, 't')
+        self.assertEqual(registry.resume(f'{stream.id}:4', 1, 't'), (stream, 4))
+        self.assertEqual(registry.resume(f'{stream.id}:4', 2, 't'), (None, None))
+        self.assertEqual(registry.resume(f'{stream.id}:4', 1, 'other'), (None, None))
+        self.assertEqual(registry.resume('garbage', 1, 't'), (None, None))
+
+
+class ResumableRunsStreamTests(TransactionTestCase):
+    # The run is pumped on its own thread, which records usage through its own connection
+    def setUp(self):
+        self.user = User.objects.create_user(username='frank', password='pass1234')
+        ChatThread.objects.create(user=self.user, thread_id='t-resume', assistant_id='agent')
+        self.auth = f'Bearer {generate_token(self.user)}'
+        services._breakers.clear()
+
+    def test_reconnect_replays_missed_events_without_new_run(self):
+        url = '/api/chatproxy/threads/t-resume/runs/stream'
+        with FakeLangGraphServer() as server, override_settings(LANGGRAPH_API_URL=server.url):
+            resp = self.client.post(url, {'assistant_id': 'agent'}, content_type='application/json', HTTP_AUTHORIZATION=self.auth)
+            first = next(iter(resp.streaming_content))
+            resp.close()  # client drops after the first event
+            event_id = re.search(rb'id: (\S+)', first).group(1).decode()
+            resumed = self.client.post(url, {'assistant_id': 'agent'}, content_type='application/json',
+                                       HTTP_AUTHORIZATION=self.auth, HTTP_LAST_EVENT_ID=event_id)
+            rest = b''.join(resumed.streaming_content)
+        self.assertEqual(resumed['X-Run-Stream-Id'], resp['X-Run-Stream-Id'])
+        self.assertEqual(re.sub(rb'id: \S+\n', b'', first + rest), SSE_BODY)
+
+    def test_unknown_last_event_id_is_gone(self):
+        resp = self.client.post('/api/chatproxy/threads/t-resume/runs/stream', {}, content_type='application/json',
+                                HTTP_AUTHORIZATION=self.auth, HTTP_LAST_EVENT_ID='deadbeef:3')
+        self.assertEqual(resp.status_code, 410)
+
+
+class BroadcastTests(SimpleTestCase):
+    def test_subscribers_share_one_stream(self):
+        stream = RunStream(1, 't')
+        first = stream.iter_events(0, keepalive=0.01)
+        second = stream.iter_events(0, keepalive=0.01)
+        stream.feed(_event(1))
+        self.assertEqual(next(first), next(second))
+        self.assertEqual(stream.snapshot()['subscribers'], 2)
+        stream.feed(_event(2))
+        stream.finish()
+        self.assertEqual(len(list(first)), 1)
+        self.assertEqual(len(list(second)), 1)
+        self.assertEqual(stream.snapshot()['subscribers'], 0)
+
+    def test_slow_consumer_is_evicted(self):
+        stream = RunStream(1, 't', queue_size=2)
+        slow = stream.iter_events(0, keepalive=0.01)
+        fast = stream.iter_events(0, keepalive=0.01)
+        stream.feed(_event(1))
+        next(slow)
+        next(fast)
+        for i in range(2, 6):
+            stream.feed(_event(i))
+            next(fast)
+        rest = list(slow)
+        self.assertEqual(len(rest), 3)
+        self.assertIn(b'slow_consumer', rest[-1])
+        self.assertEqual(stream.evictions, 1)
+        stream.finish()
+        self.assertEqual(list(fast), [])
+
+    def test_find_by_thread_and_run_id(self):
+        registry = RunStreamRegistry()
+        stream = registry.create(1, 't')
+        stream.feed(b'event: metadata\ndata: {"run_id": "r9"}\n\n')
+        self.assertIs(registry.find(1, 't'), stream)
+        self.assertIs(registry.find(1, 't', 'r9'), stream)
+        self.assertIsNone(registry.find(2, 't'))
+        stream.finish()
+        self.assertIsNone(registry.find(1, 't'))
+        self.assertIs(registry.find(1, 't', stream.id), stream)
+
+
+class JoinRunTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='gina', password='pass1234')
+        ChatThread.objects.create(user=self.user, thread_id='t-join', assistant_id='agent')
+        self.auth = f'Bearer {generate_token(self.user)}'
+
+    def test_get_joins_live_run(self):
+        url = '/api/chatproxy/threads/t-join/runs/stream'
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=self.auth).status_code, 404)
+        stream = run_streams.create(self.user.id, 't-join')
+        stream.feed(_event(1))
+        resp = self.client.get(url, HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(resp['X-Run-Stream-Id'], stream.id)
+        stream.feed(_event(2))
+        stream.finish()
+        self.assertEqual(len(list(resp.streaming_content)), 2)
+
+    def test_sdk_join_path_replays_run(self):
+        stream = run_streams.create(self.user.id, 't-join')
+        stream.feed(_event(1))
+        location = self.client.get('/api/chatproxy/threads/t-join/runs/stream', HTTP_AUTHORIZATION=self.auth)['Content-Location']
+        self.assertEqual(location, f'/threads/t-join/runs/{stream.id}')
+        stream.feed(_event(2))
+        stream.finish()
+        # -1 is what the SDK sends when it has no cursor yet
+        resp = self.client.get(f'/api/chatproxy{location}/stream', HTTP_AUTHORIZATION=self.auth, HTTP_LAST_EVENT_ID='-1')
+        self.assertEqual(len(list(resp.streaming_content)), 2)
+        missing = self.client.get('/api/chatproxy/threads/t-join/runs/nope/stream', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(missing.status_code, 404)
+        posted = self.client.post(f'/api/chatproxy{location}/stream', {}, content_type='application/json', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(posted.status_code, 405)
@@ -53,3 +53,58 @@ class SSEUsageExtractorTests(SimpleTestCase):
         chunk = "data: {invalid_json\n\n"
         extractor.process_chunk(chunk)
         self.assertIsNone(extractor.last_usage)
+
+    def test_multibyte_character_split_across_chunks(self):
+        extractor = SSEUsageExtractor()
+        data = json.dumps({'content': '你好', 'usage_metadata': {'total_tokens': 7}}, ensure_ascii=False)
+        raw = f"data: {data}\n\n".encode('utf-8')
+        cut = raw.index('好'.encode('utf-8')) + 1
+        extractor.process_chunk(raw[:cut])
+        extractor.process_chunk(raw[cut:])
+        self.assertEqual(extractor.last_usage['total_tokens'], 7)
+
+    def test_crlf_and_multiline_data(self):
+        extractor = SSEUsageExtractor()
+        chunk = b'event: values\r\ndata: {"usage_metadata":\r\ndata:  {"total_tokens": 9}}\r\n\r\n'
+        extractor.process_chunk(chunk)
+        self.assertEqual(extractor.last_usage['total_tokens'], 9)
+
+    def test_flush_parses_unterminated_event(self):
+        extractor = SSEUsageExtractor()
+        extractor.process_chunk('data: {"usage_metadata": {"total_tokens": 4}}')
+        self.assertIsNone(extractor.last_usage)
+        extractor.flush()
+        self.assertEqual(extractor.last_usage['total_tokens'], 4)
+
+    def test_sums_usage_across_calls_by_model(self):
+        extractor = SSEUsageExtractor()
+        def chunk(message_id, usage, model):
+            data = [{'id': message_id, 'type': 'AIMessageChunk', 'usage_metadata': usage}, {'ls_model_name': model}]
+            return f"event: messages\ndata: {json.dumps(data)}\n\n"
+        extractor.process_chunk(chunk('m1', {'input_tokens': 5, 'output_tokens': 0, 'total_tokens': 5}, 'gpt-4o'))
+        extractor.process_chunk(chunk('m1', {'input_tokens': 0, 'output_tokens': 3, 'total_tokens': 3}, 'gpt-4o'))
+        extractor.process_chunk(chunk('m2', {'input_tokens': 2, 'output_tokens': 2, 'total_tokens': 4}, 'gpt-4o'))
+        extractor.process_chunk(chunk('m3', {'input_tokens': 1, 'output_tokens': 1, 'total_tokens': 2}, 'claude'))
+        # A later full-state event repeats m1 with its final usage and must not double count
+        values = {'messages': [{'id': 'm1', 'usage_metadata': {'input_tokens': 5, 'output_tokens': 3, 'total_tokens': 8},
+                                'response_metadata': {'model_name': 'gpt-4o'}}]}
+        extractor.process_chunk(f"event: values\ndata: {json.dumps(values)}\n\n")
+        self.assertEqual(extractor.usage_by_model(), {
+            'gpt-4o': {'input_tokens': 7, 'output_tokens': 5, 'total_tokens': 12},
+            'claude': {'input_tokens': 1, 'output_tokens': 1, 'total_tokens': 2},
+        })
+        self.assertEqual(extractor.total_usage['total_tokens'], 14)
+
+    def test_messages_without_id_are_not_double_counted(self):
+        extractor = SSEUsageExtractor()
+        first = {'type': 'ai', 'content': 'a', 'usage_metadata': {'input_tokens': 2, 'output_tokens': 1, 'total_tokens': 3}}
+        second = {'type': 'ai', 'content': 'b', 'usage_metadata': {'input_tokens': 4, 'output_tokens': 1, 'total_tokens': 5}}
+        # Each values event carries the whole state so far
+        extractor.process_chunk(f"event: values\ndata: {json.dumps({'messages': [first]})}\n\n")
+        extractor.process_chunk(f"event: values\ndata: {json.dumps({'messages': [first, second]})}\n\n")
+        self.assertEqual(extractor.total_usage, {'input_tokens': 6, 'output_tokens': 2, 'total_tokens': 8})
+
+    def test_non_usage_events_are_skipped(self):
+        extractor = SSEUsageExtractor()
+        extractor.process_chunk('event: metadata\ndata: {"usage_metadata": {"total_tokens": 1}}\n\n')
+        self.assertIsNone(extractor.last_usage)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ArticleViewSet, LoginView, LogoutView, CheckAuthView, DashboardStatsView, ChatThreadViewSet, ChatThreadHistoryView, RegisterView, ChatConfigView, ChatGatewayView, ChatProxyThreadsView, ChatProxyRunsWaitView, ChatProxyRunsStreamView, ChatProxyHistoryView, AdminUsersListView, AdminUserDetailView, ChatProxyThreadView, ChatProxyThreadStateView, AdminTokenStatsView, UserTokenUsageView, ChatAssistantsView
+from .views import ArticleViewSet, LoginView, LogoutView, CheckAuthView, DashboardStatsView, ChatThreadViewSet, ChatThreadHistoryView, RegisterView, ChatConfigView, ChatGatewayView, ChatProxyThreadsView, ChatProxyRunsWaitView, ChatProxyRunsStreamView, ChatProxyRunJoinView, ChatProxyHistoryView, AdminUsersListView, AdminUserDetailView, ChatProxyThreadView, ChatProxyThreadStateView, AdminTokenStatsView, UserTokenUsageView, ChatAssistantsView, AdminUpstreamStatsView, ChatProxyRunsBatchView, AdminVisitArchiveView, TokenRefreshView
 
 router = DefaultRouter()
 router.register(r'articles', ArticleViewSet)
@@ -8,6 +8,7 @@ router.register(r'articles', ArticleViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/login/', LoginView.as_view(), name='login'),
+    path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/logout/', LogoutView.as_view(), name='logout'),
     path('auth/check/', CheckAuthView.as_view(), name='check_auth'),
     path('auth/register/', RegisterView.as_view(), name='register'),
@@ -16,6 +17,8 @@ urlpatterns = [
     path('chat/', ChatGatewayView.as_view(), name='chat_gateway'),
     path('dashboard/stats/', DashboardStatsView.as_view(), name='dashboard_stats'),
     path('admin/token-stats/', AdminTokenStatsView.as_view(), name='admin_token_stats'),
+    path('admin/upstream/', AdminUpstreamStatsView.as_view(), name='admin_upstream_stats'),
+    path('admin/visits/archive/', AdminVisitArchiveView.as_view(), name='admin_visit_archive'),
     path('admin/users/', AdminUsersListView.as_view(), name='admin_users'),
     path('admin/users/<int:user_id>/', AdminUserDetailView.as_view(), name='admin_user_detail'),
     path('token-usage/', UserTokenUsageView.as_view(), name='user_token_usage'),
@@ -24,9 +27,11 @@ urlpatterns = [
     path('chat/threads/<str:thread_id>/history/', ChatThreadHistoryView.as_view(), name='chat_thread_history'),
     # Proxy endpoints for Chainlit/LangGraph
     path('chatproxy/threads', ChatProxyThreadsView.as_view(), name='chatproxy_threads'),
+    path('chatproxy/runs/batch', ChatProxyRunsBatchView.as_view(), name='chatproxy_runs_batch'),
     path('chatproxy/threads/<str:thread_id>', ChatProxyThreadView.as_view(), name='chatproxy_thread'),
     path('chatproxy/threads/<str:thread_id>/state', ChatProxyThreadStateView.as_view(), name='chatproxy_thread_state'),
     path('chatproxy/threads/<str:thread_id>/runs/wait', ChatProxyRunsWaitView.as_view(), name='chatproxy_runs_wait'),
     path('chatproxy/threads/<str:thread_id>/runs/stream', ChatProxyRunsStreamView.as_view(), name='chatproxy_runs_stream'),
+    path('chatproxy/threads/<str:thread_id>/runs/<str:run_id>/stream', ChatProxyRunJoinView.as_view(), name='chatproxy_run_join'),
     path('chatproxy/threads/<str:thread_id>/history', ChatProxyHistoryView.as_view(), name='chatproxy_history'),
 ]
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .batching import BatchWriter, get_batch_writer
+from .models import TokenUsage
+from . import rollups
+
+
+def _write_usage(items):
+    with transaction.atomic():
+        TokenUsage.objects.bulk_create([TokenUsage(**item) for item in items])
+        rollups.add_token_usage(items)
+
+
+def _decode_usage(item):
+    item['timestamp'] = parse_datetime(item['timestamp'])
+    return item
+
+
+def _make_usage_writer():
+    background = getattr(settings, 'WRITE_BEHIND_BACKGROUND', True)
+    return BatchWriter(
+        'token_usage',
+        _write_usage,
+        batch_size=getattr(settings, 'WRITE_BEHIND_BATCH_SIZE', 200) if background else 1,
+        interval=getattr(settings, 'WRITE_BEHIND_INTERVAL', 2.0),
+        max_pending=getattr(settings, 'WRITE_BEHIND_MAX_PENDING', 10000),
+        spill_dir=getattr(settings, 'WRITE_BEHIND_SPILL_DIR', None),
+        decode=_decode_usage,
+        background=background,
+        max_attempts=getattr(settings, 'WRITE_BEHIND_MAX_ATTEMPTS', 3),
+    )
+
+
+def get_usage_writer():
+    return get_batch_writer('token_usage', _make_usage_writer)
+
+
+def record_token_usage(user_id, thread_id, model_name, usage):
+    """Queue one TokenUsage row; it is inserted by the write-behind writer."""
+    return get_usage_writer().put({
+        'user_id': user_id,
+        'thread_id': thread_id,
+        'input_tokens': usage.get('input_tokens', 0),
+        'output_tokens': usage.get('output_tokens', 0),
+        'total_tokens': usage.get('total_tokens', 0),
+        'model_name': model_name,
+        'timestamp': timezone.now(),
+    })
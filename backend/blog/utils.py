@@ -1,44 +1,131 @@
+import re
 import json
+import hashlib
+
+USAGE_KEYS = ('input_tokens', 'output_tokens', 'total_tokens')
+# LangGraph stream events that never carry model usage
+NON_USAGE_EVENTS = {'metadata', 'end', 'error', 'custom', 'messages/metadata', 'feedback'}
+
 
 class SSEUsageExtractor:
     """
     Helper class to extract usage_metadata from an SSE stream incrementally.
     This avoids buffering the entire stream content in memory.
+
+    Chunks are framed as bytes by SSEFramer and an event is only decoded
+    once complete, so multi-byte UTF-8 characters split across chunks stay
+    intact and long events are not re-copied on every chunk.
+
+    Only events that can carry usage are decoded: the event type is checked
+    first, then the raw bytes are pre-scanned for ``usage_metadata``.
+    Usage is tracked per message id so a multi-step run is summed across
+    all of its LLM calls: ``messages`` chunks add up, while complete
+    messages (``messages/complete``, ``values``, ``updates``) replace what
+    was accumulated for their id. Complete messages without an id are
+    keyed by a digest of their content instead, since every ``values``
+    event repeats the whole message list. ``usage_by_model()`` gives the
+    totals per LLM model name (None when the stream does not say).
     """
     def __init__(self):
-        self.buffer = ""
+        self._framer = SSEFramer()
+        self._messages = {}
+        self._anonymous = 0
         self.last_usage = None
 
     def process_chunk(self, chunk):
         """
         Process a chunk of data (bytes or str).
         """
-        if isinstance(chunk, bytes):
-            text = chunk.decode('utf-8', errors='ignore')
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        for block in self._framer.feed(chunk):
+            self._parse_event(block)
+
+    def flush(self):
+        """Parse a final event that was not followed by a blank line."""
+        rest = self._framer.flush()
+        if rest.strip():
+            self._parse_event(rest)
+
+    def _parse_event(self, block):
+        # Optimization: Quick check on the raw bytes before any decoding
+        if b'usage_metadata' not in block:
+            return
+        event = None
+        # Multi-line data fields are joined with LF, as in the SSE spec
+        data_lines = []
+        for line in block.splitlines():
+            if line.startswith(b'data:'):
+                value = line[5:]
+                data_lines.append(value[1:] if value.startswith(b' ') else value)
+            elif line.startswith(b'event:'):
+                event = line[6:].strip().decode('utf-8', 'replace')
+        if not data_lines or event in NON_USAGE_EVENTS:
+            return
+        try:
+            data = json.loads(b'\n'.join(data_lines).decode('utf-8'))
+        except Exception:
+            # Ignore parse errors for individual events
+            return
+        if event == 'messages' and isinstance(data, list) and data and isinstance(data[0], dict):
+            # messages-tuple mode: [message chunk, metadata]
+            metadata = data[1] if len(data) > 1 and isinstance(data[1], dict) else {}
+            self._record(data[0], metadata.get('ls_model_name'), accumulate=True)
+        elif event and event.split('/')[0] in ('messages', 'values', 'updates'):
+            for message in self._iter_messages(data):
+                self._record(message, None, accumulate=False)
         else:
-            text = chunk
-        
-        self.buffer += text
-        
-        # Process complete events separated by double newlines
-        while '\n\n' in self.buffer:
-            event_text, self.buffer = self.buffer.split('\n\n', 1)
-            self._parse_event(event_text)
-
-    def _parse_event(self, event_text):
-        for line in event_text.split('\n'):
-            if line.startswith('data:'):
-                data_str = line[5:].strip()
-                try:
-                    # Optimization: Quick check before parsing JSON
-                    if 'usage_metadata' in data_str:
-                        data = json.loads(data_str)
-                        usage = self._find_usage(data)
-                        if usage:
-                            self.last_usage = usage
-                except Exception:
-                    # Ignore parse errors for individual lines
-                    pass
+            usage = self._find_usage(data)
+            if usage:
+                self._record({'usage_metadata': usage}, None, accumulate=False)
+
+    def _record(self, message, model_name, accumulate):
+        usage = message.get('usage_metadata')
+        if not isinstance(usage, dict):
+            return
+        self.last_usage = usage
+        model_name = (message.get('response_metadata') or {}).get('model_name') or model_name
+        key = message.get('id')
+        if key is None and accumulate:
+            # Chunks are never repeated, so each one counts
+            self._anonymous += 1
+            key = ('anonymous', self._anonymous)
+        elif key is None:
+            # The same complete message comes back in later snapshots unchanged
+            digest = hashlib.sha1(json.dumps(message, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+            key = ('anonymous', digest)
+        counts = {k: int(usage.get(k) or 0) for k in USAGE_KEYS}
+        previous = self._messages.get(key)
+        if accumulate and previous is not None:
+            counts = {k: previous[1][k] + counts[k] for k in USAGE_KEYS}
+            model_name = model_name or previous[0]
+        self._messages[key] = (model_name, counts)
+
+    def usage_by_model(self):
+        totals = {}
+        for model_name, counts in self._messages.values():
+            total = totals.setdefault(model_name, dict.fromkeys(USAGE_KEYS, 0))
+            for k in USAGE_KEYS:
+                total[k] += counts[k]
+        return totals
+
+    @property
+    def total_usage(self):
+        if not self._messages:
+            return None
+        return {k: sum(counts[k] for _, counts in self._messages.values()) for k in USAGE_KEYS}
+
+    def _iter_messages(self, obj):
+        """Yield message dicts carrying usage_metadata, without descending into them."""
+        if isinstance(obj, dict):
+            if obj.get('usage_metadata'):
+                yield obj
+                return
+            for v in obj.values():
+                yield from self._iter_messages(v)
+        elif isinstance(obj, list):
+            for item in obj:
+                yield from self._iter_messages(item)
 
     def _find_usage(self, obj):
         """
@@ -55,3 +142,52 @@ class SSEUsageExtractor:
                 res = self._find_usage(item)
                 if res: return res
         return None
+
+class SSEFramer:
+    """
+    Split a byte stream into raw SSE event blocks.
+    A block ends at a blank line (LF, CRLF or CR line endings). Bytes are kept
+    in a bytearray and only the unscanned tail is searched, so framing stays
+    linear in the stream length.
+    """
+    _boundary = re.compile(rb'\r\n\r\n|\n\n|\r\r')
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._scan = 0
+        self._cr = False
+
+    def feed(self, chunk):
+        self._buf += chunk
+        blocks = []
+        start = 0
+        # A boundary may straddle the previous chunk, so back up a few bytes
+        pos = max(self._scan - 3, 0)
+        if not self._cr and b'\r' in chunk:
+            self._cr = True
+        if not self._cr:
+            # LF-only streams (the common case) can use a plain find
+            while True:
+                end = self._buf.find(b'\n\n', pos)
+                if end < 0:
+                    break
+                blocks.append(bytes(self._buf[start:end]))
+                start = pos = end + 2
+        while self._cr:
+            match = self._boundary.search(self._buf, pos)
+            if match is None:
+                break
+            blocks.append(bytes(self._buf[start:match.start()]))
+            start = pos = match.end()
+        if start:
+            del self._buf[:start]
+        self._scan = len(self._buf)
+        return blocks
+
+    def flush(self):
+        """Return whatever is left once the stream has ended."""
+        rest = bytes(self._buf)
+        self._buf = bytearray()
+        self._scan = 0
+        self._cr = False
+        return rest
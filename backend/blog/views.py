@@ -1,24 +1,36 @@
 from rest_framework import viewsets, permissions, status, views, authentication
 from rest_framework.response import Response
 from django.contrib.auth import login, logout, authenticate
-from django.db.models import Count, Sum
-from django.db.models.functions import TruncDate
-from .models import Article, SiteVisit, ChatThread, TokenUsage
+from django.db.models import Count
+from .models import Article, SiteVisit, ChatThread, TokenUsage, TokenUsageDaily
 from .serializers import ArticleSerializer, SiteVisitSerializer, ChatThreadSerializer, UserSummarySerializer, UserDetailSerializer, TokenUsageSerializer
 import json
-from .authentication import generate_token, JWTAuthentication
+from .authentication import JWTAuthentication, principal_cache_stats, issue_refresh_token, rotate_refresh_token, revoke_refresh_token, token_response
 import datetime
-import os
-import requests
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+import time
 import logging
 from django.contrib.auth.models import User
 from .utils import SSEUsageExtractor
-from .services import create_langgraph_thread, get_service_headers, ServiceUnavailable, get_langgraph_base_url, DEFAULT_TIMEOUT, LONG_TIMEOUT, THREAD_TIMEOUT, MAX_LIMIT
+from .services import create_langgraph_thread, get_upstream_client, get_async_upstream_client, async_streaming_available, is_asgi_request, httpx, ServiceUnavailable, CircuitOpen, classify_endpoint, get_circuit_breaker, circuit_breaker_states, get_assistants, assistants_cache_stats, coalesced_get, invalidate_thread_reads, coalescing_snapshot, thread_pool_snapshot, DEFAULT_TIMEOUT, LONG_TIMEOUT, THREAD_TIMEOUT
+from .history import get_thread_history, supports_incremental, history_snapshot
+from .middleware import compression_snapshot
+from .streaming import run_streams, start_thread_pump, start_task_pump, aiter_blocking
+from .admission import get_run_admission
+from .batch import parse_batch, iter_batch, BatchItemError
+from .batching import batch_writer_stats
+from .usage import record_token_usage
+from .sketches import visit_sketches
+from .archive import read_archived_visits
+from .ownership import thread_owner, ownership_snapshot
+from . import rollups
 from .mixins import BaseAuthenticatedView, BaseAdminView
 
 logger = logging.getLogger(__name__)
 from django.conf import settings
-from django.http import StreamingHttpResponse, HttpResponseRedirect
+from asgiref.sync import async_to_sync, sync_to_async
+from django.http import HttpResponse, StreamingHttpResponse, HttpResponseRedirect
 from django.core.paginator import Paginator
 
 class IsAdminOrReadOnly(permissions.BasePermission):
@@ -63,12 +75,29 @@ class LoginView(views.APIView):
             return Response({'detail': '缺少用户名或邮箱'}, status=status.HTTP_400_BAD_REQUEST)
         if user is not None:
             login(request, user)
-            token = generate_token(user)
-            return Response({'detail': '登录成功', 'is_staff': user.is_staff, 'token': token})
+            return Response({'detail': '登录成功', 'is_staff': user.is_staff, **token_response(user, issue_refresh_token(user))})
         return Response({'detail': '密码错误'}, status=status.HTTP_401_UNAUTHORIZED)
 
+class TokenRefreshView(views.APIView):
+    """
+    Trade a refresh token for a new access token and a new refresh token.
+    Costs one indexed lookup instead of the password hash LoginView runs.
+    """
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    def get_authenticate_header(self, request):
+        # No authenticators here, but a rejected refresh token is still a 401
+        return JWTAuthentication().authenticate_header(request)
+
+    def post(self, request):
+        user, refresh = rotate_refresh_token(request.data.get('refresh'))
+        return Response(token_response(user, refresh))
+
 class LogoutView(views.APIView):
     def post(self, request):
+        if request.data.get('refresh'):
+            revoke_refresh_token(request.data['refresh'])
         logout(request)
         return Response({'detail': 'Logged out successfully'})
 
@@ -114,19 +143,25 @@ class ChatConfigView(views.APIView):
             'iss': 'django'
         })
 
+def _upstream_error(detail, e):
+    """
+    Error response for a failed upstream call. An open circuit breaker
+    answers 503 with Retry-After instead of the generic 502.
+    """
+    if isinstance(e, CircuitOpen):
+        return Response({'detail': e.detail, 'code': 'circuit_open'}, status=e.status_code, headers={'Retry-After': str(e.retry_after)})
+    if isinstance(e, ServiceUnavailable):
+        return Response({'detail': e.detail}, status=e.status_code)
+    return Response({'detail': detail, 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+
 class ChatAssistantsView(BaseAuthenticatedView):
+    jwt_claims_principal = True
     def get(self, request):
-        api_url = get_langgraph_base_url()
         try:
-            payload = {
-                'metadata': {},
-                'limit': MAX_LIMIT,
-                'offset': 0
-            }
-            resp = requests.post(f'{api_url}/assistants/search', json=payload, headers=get_service_headers(), timeout=DEFAULT_TIMEOUT)
-            return Response(resp.json(), status=resp.status_code)
+            data, status_code = get_assistants()
+            return Response(data, status=status_code)
         except Exception as e:
-            return Response({'detail': '获取助手列表失败', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error('获取助手列表失败', e)
 
 class ChatGatewayView(views.APIView):
     permission_classes = [permissions.AllowAny]
@@ -137,12 +172,63 @@ class ChatGatewayView(views.APIView):
         next_url = request.GET.get('next') or '/chat'
         return HttpResponseRedirect(f'/login?next={next_url}')
 
-def _assert_thread_owner(user, thread_id):
+def _iter_raw(resp):
     try:
-        ChatThread.objects.get(user=user, thread_id=thread_id)
-        return True
-    except ChatThread.DoesNotExist:
-        return False
+        yield from resp.raw.stream(64 * 1024, decode_content=False)
+    finally:
+        # Returns the connection to the pool once fully read, drops it otherwise
+        resp.close()
+
+class ClosingStreamingHttpResponse(StreamingHttpResponse):
+    """
+    Runs ``on_close`` once the server closes the response, whether the body
+    was fully sent, abandoned midway, or never iterated at all (a generator's
+    ``finally`` only runs in the last two cases if it was started).
+    """
+    def __init__(self, *args, on_close=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._on_close = on_close
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+def _proxy_response(view, resp, streamed=False, on_close=None):
+    """
+    Relay an upstream response. In passthrough mode the body bytes, status,
+    content type and length go out unchanged, without a JSON parse/render
+    round trip; a streamed response is piped straight from the socket and
+    ``on_close`` runs when it is closed. Views that need to inspect the body
+    set ``passthrough = False`` (or CHATPROXY_PASSTHROUGH is off) and get
+    the parsed payload instead.
+    """
+    content_type = resp.headers.get('Content-Type', 'application/json')
+    if not (getattr(view, 'passthrough', False) and getattr(settings, 'CHATPROXY_PASSTHROUGH', True)):
+        if 'application/json' in content_type:
+            return Response(resp.json(), status=resp.status_code)
+        return Response(resp.text, status=resp.status_code)
+    if streamed:
+        def close():
+            # Also covers a body that was never read, where _iter_raw never ran
+            resp.close()
+            if on_close is not None:
+                on_close()
+        response = ClosingStreamingHttpResponse(_iter_raw(resp), status=resp.status_code, content_type=content_type, on_close=close)
+        # Raw bytes are forwarded still encoded, so keep the upstream framing headers
+        for header in ('Content-Length', 'Content-Encoding'):
+            if header in resp.headers:
+                response[header] = resp.headers[header]
+        return response
+    response = HttpResponse(resp.content, status=resp.status_code, content_type=content_type)
+    response['Content-Length'] = str(len(resp.content))
+    return response
+
+def _assert_thread_owner(user, thread_id):
+    return thread_owner(thread_id) == user.pk
 
 class ChatProxyThreadsView(BaseAuthenticatedView):
     def post(self, request):
@@ -152,185 +238,421 @@ class ChatProxyThreadsView(BaseAuthenticatedView):
         try:
             thread_id = create_langgraph_thread(assistant_id)
         except ServiceUnavailable as e:
-            return Response({'detail': e.detail}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error(e.detail, e)
         except Exception as e:
-            return Response({'detail': '后端线程服务不可用', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error('后端线程服务不可用', e)
             
         obj = ChatThread.objects.create(user=request.user, thread_id=thread_id, assistant_id=assistant_id, title=title)
         return Response(ChatThreadSerializer(obj).data, status=status.HTTP_201_CREATED)
 
 class ChatProxyRunsWaitView(BaseAuthenticatedView):
+    passthrough = True
+
     def post(self, request, thread_id):
         if not _assert_thread_owner(request.user, thread_id):
             return Response({'detail': '无权访问该线程'}, status=status.HTTP_403_FORBIDDEN)
-        api_url = get_langgraph_base_url()
         payload = request.data
+        permit = get_run_admission().acquire(request.user.id)
         try:
-            resp = requests.post(f'{api_url}/threads/{thread_id}/runs/wait', json=payload, headers=get_service_headers(), timeout=LONG_TIMEOUT)
-            return Response(resp.json(), status=resp.status_code)
+            resp = get_upstream_client().post(f'/threads/{thread_id}/runs/wait', json=payload, stream=True, timeout=LONG_TIMEOUT)
+            invalidate_thread_reads(thread_id)
+            # The run holds its slot until the relayed body is done
+            response = _proxy_response(self, resp, streamed=True, on_close=permit.release)
         except Exception as e:
-            return Response({'detail': '运行失败', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            permit.release()
+            return _upstream_error('运行失败', e)
+        if not response.streaming:
+            permit.release()
+        return response
+
+
+class ChatProxyRunsBatchView(BaseAuthenticatedView):
+    """
+    Run many items (existing or new thread, assistant_id, input) against
+    runs/wait on a bounded worker pool. Returns all results ordered by
+    item index, or with ``"stream": true`` one NDJSON line per item as
+    each completes.
+    """
+    def post(self, request):
+        try:
+            items = parse_batch(request.data)
+        except BatchItemError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        requested = {thread_id for thread_id, _, _ in items if thread_id}
+        owned = set(ChatThread.objects.filter(user=request.user, thread_id__in=requested).values_list('thread_id', flat=True))
+        forbidden = [(i, t) for i, (t, _, _) in enumerate(items) if t and t not in owned]
+        runnable = [(i, t, payload) for i, (t, _, payload) in enumerate(items) if not t or t in owned]
+        user = request.user
+
+        def results():
+            for index, thread_id in forbidden:
+                yield {'index': index, 'status': 403, 'thread_id': thread_id, 'error': '无权访问该线程'}
+            for index, result in iter_batch(user.id, runnable):
+                if result.pop('created', False):
+                    # Runs on the consuming (request) thread, never in the pool
+                    thread_id, title, payload = items[index]
+                    ChatThread.objects.create(user=user, thread_id=result['thread_id'], assistant_id=payload['assistant_id'], title=title)
+                yield {'index': index, **result}
 
+        if request.data.get('stream'):
+            lines = (json.dumps(r, ensure_ascii=False).encode('utf-8') + b'\n' for r in results())
+            if is_asgi_request(request):
+                # A sync iterator would be drained in full before the first byte
+                lines = aiter_blocking(lines)
+            resp = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+            resp['Cache-Control'] = 'no-cache'
+            return resp
+        return Response({'results': sorted(results(), key=lambda r: r['index'])})
+
+
+def _record_token_usage(user, thread_id, payload, extractor):
+    """
+    Queue one TokenUsage row per model used in the run, summed over its LLM
+    calls. Rows are written by a background writer, so finishing a stream
+    never waits on the database.
+    """
+    try:
+        extractor.flush()
+        for model_name, usage in extractor.usage_by_model().items():
+            record_token_usage(user.id, thread_id, model_name or payload.get('assistant_id', 'unknown'), usage)
+    except Exception as e:
+        logger.error(f"[ChatProxy] Error saving token usage: {e}")
+
+def _sse_error_frame(detail, error):
+    data = json.dumps({'detail': detail, 'error': error}, ensure_ascii=False)
+    return f'event: error\ndata: {data}\n\n'.encode('utf-8')
 
 class ChatProxyRunsStreamView(BaseAuthenticatedView):
+    """
+    Proxy for runs/stream. The upstream stream is pumped into a RunStream
+    (ring buffer with event ids) independently of the client connection, so
+    a client that drops can POST again with Last-Event-ID and receive the
+    missed events followed by the live run, without starting a new run.
+    GET joins the run already in progress on the thread (another tab or
+    device) as an extra subscriber of the same upstream stream. Responses
+    carry Content-Location ``/threads/<id>/runs/<stream id>``, from which the
+    LangGraph SDK rejoins through ChatProxyRunJoinView after a reload.
+    RunStreams live in this process's memory, so resuming or joining only
+    works when the request reaches the worker that started the run.
+    Under both WSGI and ASGI the upstream status line is awaited before
+    responding, so a rejected run is relayed with upstream's status.
+    """
+    jwt_claims_principal = True
+    def get(self, request, thread_id, run_id=None):
+        if not _assert_thread_owner(request.user, thread_id):
+            return Response({'detail': '无权访问该线程'}, status=status.HTTP_403_FORBIDDEN)
+        last_event_id = request.headers.get('Last-Event-ID')
+        # The SDK sends -1 to ask for the run from its first event
+        if last_event_id and last_event_id != '-1':
+            stream, seq = run_streams.resume(last_event_id, request.user.id, thread_id)
+            if stream is None:
+                return Response({'detail': '该运行的事件缓冲已过期，无法续传'}, status=status.HTTP_410_GONE)
+            return self.stream_response(request, stream, seq)
+        stream = run_streams.find(request.user.id, thread_id, run_id or request.query_params.get('run_id'))
+        if stream is None:
+            return Response({'detail': '该线程没有进行中的运行'}, status=status.HTTP_404_NOT_FOUND)
+        return self.stream_response(request, stream, 0)
+
     def post(self, request, thread_id):
         if not _assert_thread_owner(request.user, thread_id):
             return Response({'detail': '无权访问该线程'}, status=status.HTTP_403_FORBIDDEN)
-        api_url = get_langgraph_base_url()
+        last_event_id = request.headers.get('Last-Event-ID')
+        if last_event_id:
+            stream, seq = run_streams.resume(last_event_id, request.user.id, thread_id)
+            if stream is None:
+                return Response({'detail': '该运行的事件缓冲已过期，无法续传'}, status=status.HTTP_410_GONE)
+            return self.stream_response(request, stream, seq)
         payload = request.data
+        permit = get_run_admission().acquire(request.user.id)
+        if async_streaming_available(request):
+            # Under ASGI the upstream stream is consumed on the event loop, so an
+            # in-flight generation costs a coroutine rather than a worker thread.
+            # The breaker is checked here so an open circuit still answers 503.
+            breaker = get_circuit_breaker(classify_endpoint(f'/threads/{thread_id}/runs/stream'))
+            if not breaker.allow():
+                permit.release()
+                return _upstream_error('流式运行失败', CircuitOpen(breaker.retry_after()))
+            try:
+                r = async_to_sync(self.async_open)(breaker, thread_id, payload)
+            except Exception as e:
+                permit.release()
+                return _upstream_error('流式运行失败', e)
+            if r.status_code != 200:
+                # Same as the sync path: the client sees upstream's status and body
+                permit.release()
+                content = async_to_sync(self.async_read)(r)
+                return HttpResponse(content, status=r.status_code, content_type=r.headers.get('Content-Type', 'application/json'))
+            stream = run_streams.create(request.user.id, thread_id)
+            stream.on_finish(permit.release)
+            # Started now rather than on first read, so the run (and its permit)
+            # finishes even if the client never reads the response
+            async_to_sync(start_task_pump)(stream, self.async_pump(stream, r, breaker, request.user, thread_id, payload))
+            return self.stream_response(request, stream, 0)
         try:
-            r = requests.post(f'{api_url}/threads/{thread_id}/runs/stream', json=payload, headers={'Authorization': get_service_headers()['Authorization'], 'Accept': 'text/event-stream', 'Content-Type': 'application/json'}, stream=True, timeout=LONG_TIMEOUT)
+            r = get_upstream_client().post(f'/threads/{thread_id}/runs/stream', json=payload, headers={'Accept': 'text/event-stream'}, stream=True, timeout=LONG_TIMEOUT)
         except Exception as e:
-            return Response({'detail': '流式运行失败', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
-        
-        def event_stream():
-            extractor = SSEUsageExtractor()
-            
-            # Use a smaller chunk size or iter_lines to avoid buffering in the proxy
-            for chunk in r.iter_content(chunk_size=None): # chunk_size=None means it will yield whatever is received
+            permit.release()
+            return _upstream_error('流式运行失败', e)
+        if r.status_code != 200:
+            permit.release()
+            return HttpResponse(r.content, status=r.status_code, content_type=r.headers.get('Content-Type', 'application/json'))
+
+        stream = run_streams.create(request.user.id, thread_id)
+        stream.on_finish(permit.release)
+        extractor = SSEUsageExtractor()
+
+        def on_done():
+            r.close()
+            invalidate_thread_reads(thread_id)
+            # Post-processing: Extract usage_metadata from the full stream content
+            _record_token_usage(request.user, thread_id, payload, extractor)
+
+        # chunk_size=None yields whatever is received, without extra buffering
+        start_thread_pump(stream, r.iter_content(chunk_size=None), on_chunk=extractor.process_chunk, on_done=on_done)
+        return self.stream_response(request, stream, 0)
+
+    def stream_response(self, request, stream, after):
+        keepalive = getattr(settings, 'CHAT_STREAM_KEEPALIVE', 15)
+        if async_streaming_available(request):
+            iterator = stream.aiter_events(after, keepalive=keepalive)
+        else:
+            iterator = stream.iter_events(after, keepalive=keepalive)
+        resp = StreamingHttpResponse(iterator, content_type='text/event-stream')
+        resp['Cache-Control'] = 'no-cache'
+        resp['X-Run-Stream-Id'] = stream.id
+        resp['Content-Location'] = f'/threads/{stream.thread_id}/runs/{stream.id}'
+        return resp
+
+    async def async_open(self, breaker, thread_id, payload):
+        """Send the run and wait for upstream's status line; the body is read later."""
+        client = get_async_upstream_client()
+        request = client.build_request('POST', f'/threads/{thread_id}/runs/stream', json=payload, headers={'Accept': 'text/event-stream'})
+        started = time.monotonic()
+        try:
+            r = await client.send(request, stream=True)
+        except httpx.TransportError:
+            breaker.record_failure(time.monotonic() - started)
+            raise
+        except BaseException:
+            # No verdict on upstream's health
+            breaker.release_trial()
+            raise
+        if r.status_code >= 500:
+            breaker.record_failure(time.monotonic() - started)
+        else:
+            breaker.record_success(time.monotonic() - started)
+        return r
+
+    async def async_read(self, r):
+        try:
+            return await r.aread()
+        finally:
+            await r.aclose()
+
+    async def async_pump(self, stream, r, breaker, user, thread_id, payload):
+        extractor = SSEUsageExtractor()
+        started = time.monotonic()
+        try:
+            async for chunk in r.aiter_bytes():
                 if chunk:
-                    yield chunk
+                    stream.feed(chunk)
                     try:
                         extractor.process_chunk(chunk)
                     except Exception:
                         pass
-            
-            # Post-processing: Extract usage_metadata from the full stream content
-            try:
-                if extractor.last_usage:
-                    TokenUsage.objects.create(
-                        user=request.user,
-                        thread_id=thread_id,
-                        input_tokens=extractor.last_usage.get('input_tokens', 0),
-                        output_tokens=extractor.last_usage.get('output_tokens', 0),
-                        total_tokens=extractor.last_usage.get('total_tokens', 0),
-                        model_name=payload.get('assistant_id', 'unknown')
-                    )
-            except Exception as e:
-                logger.error(f"[ChatProxy] Error saving token usage: {e}")
+        except httpx.HTTPError as e:
+            # Headers are already sent, so report the failure as an SSE event
+            if isinstance(e, httpx.TransportError):
+                breaker.record_failure(time.monotonic() - started)
+            logger.error(f"[ChatProxy] Async stream error: {e}")
+            stream.feed(_sse_error_frame('流式运行失败', str(e)))
+            stream.finish()
+            return
+        except BaseException:
+            stream.finish()
+            raise
+        finally:
+            await r.aclose()
+        try:
+            invalidate_thread_reads(thread_id)
+            await sync_to_async(_record_token_usage)(user, thread_id, payload, extractor)
+        finally:
+            # Readers see the end only after usage is recorded
+            stream.finish()
 
-        resp = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
-        return resp
+class ChatProxyRunJoinView(ChatProxyRunsStreamView):
+    """GET threads/<id>/runs/<run_id>/stream: the path the LangGraph SDK's joinStream uses."""
+    http_method_names = ['get', 'options']
+
+    def get(self, request, thread_id, run_id):
+        return super().get(request, thread_id, run_id)
 
 class ChatProxyThreadView(BaseAuthenticatedView):
+    jwt_claims_principal = True
+    passthrough = True
+
     def get(self, request, thread_id):
         if not _assert_thread_owner(request.user, thread_id):
             return Response({'detail': '无权访问该线程'}, status=status.HTTP_403_FORBIDDEN)
-        api_url = get_langgraph_base_url()
         try:
-            resp = requests.get(f'{api_url}/threads/{thread_id}', headers=get_service_headers(), timeout=DEFAULT_TIMEOUT)
-            return Response(resp.json(), status=resp.status_code)
+            resp = coalesced_get(f'/threads/{thread_id}', timeout=DEFAULT_TIMEOUT)
+            return _proxy_response(self, resp)
         except Exception as e:
-            return Response({'detail': '获取线程信息失败', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error('获取线程信息失败', e)
             
     def patch(self, request, thread_id):
         if not _assert_thread_owner(request.user, thread_id):
             return Response({'detail': '无权访问该线程'}, status=status.HTTP_403_FORBIDDEN)
-        api_url = get_langgraph_base_url()
         try:
-            resp = requests.patch(f'{api_url}/threads/{thread_id}', json=request.data, headers=get_service_headers(), timeout=DEFAULT_TIMEOUT)
-            return Response(resp.json(), status=resp.status_code)
+            resp = get_upstream_client().patch(f'/threads/{thread_id}', json=request.data, stream=True, timeout=DEFAULT_TIMEOUT)
+            invalidate_thread_reads(thread_id)
+            return _proxy_response(self, resp, streamed=True)
         except Exception as e:
-            return Response({'detail': '更新线程失败', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error('更新线程失败', e)
 
 class ChatProxyThreadStateView(BaseAuthenticatedView):
+    jwt_claims_principal = True
+    passthrough = True
+
     def get(self, request, thread_id):
         if not _assert_thread_owner(request.user, thread_id):
             return Response({'detail': '无权访问该线程'}, status=status.HTTP_403_FORBIDDEN)
-        api_url = get_langgraph_base_url()
         try:
-            logger.info(f"[ChatProxy] Getting state for thread {thread_id} from {api_url}")
-            resp = requests.get(f'{api_url}/threads/{thread_id}/state', headers=get_service_headers(), timeout=DEFAULT_TIMEOUT)
+            logger.info(f"[ChatProxy] Getting state for thread {thread_id}")
+            resp = coalesced_get(f'/threads/{thread_id}/state', timeout=DEFAULT_TIMEOUT)
             logger.info(f"[ChatProxy] Response status: {resp.status_code}")
-            
-            content_type = resp.headers.get('Content-Type', '')
-            if 'application/json' in content_type:
-                return Response(resp.json(), status=resp.status_code)
-            else:
-                return Response(resp.text, status=resp.status_code)
+            return _proxy_response(self, resp)
         except Exception as e:
             logger.error(f"[ChatProxy] Error: {e}")
-            return Response({'detail': '获取线程状态失败', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error('获取线程状态失败', e)
     
     def post(self, request, thread_id):
         if not _assert_thread_owner(request.user, thread_id):
             return Response({'detail': '无权访问该线程'}, status=status.HTTP_403_FORBIDDEN)
-        api_url = get_langgraph_base_url()
         try:
-            resp = requests.post(f'{api_url}/threads/{thread_id}/state', json=request.data, headers=get_service_headers(), timeout=DEFAULT_TIMEOUT)
-            return Response(resp.json(), status=resp.status_code)
+            resp = get_upstream_client().post(f'/threads/{thread_id}/state', json=request.data, stream=True, timeout=DEFAULT_TIMEOUT)
+            invalidate_thread_reads(thread_id)
+            return _proxy_response(self, resp, streamed=True)
         except Exception as e:
-            return Response({'detail': '更新线程状态失败', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error('更新线程状态失败', e)
+
+def _history_response(result):
+    if result.not_modified:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': result.etag})
+    headers = {'X-History-Mode': result.mode}
+    if result.etag:
+        headers['ETag'] = result.etag
+    return Response(result.data, status=result.status_code, headers=headers)
 
 class ChatProxyHistoryView(BaseAuthenticatedView):
+    jwt_claims_principal = True
+    passthrough = True
+
     def get(self, request, thread_id):
         if not _assert_thread_owner(request.user, thread_id):
             return Response({'detail': '无权访问该线程'}, status=status.HTTP_403_FORBIDDEN)
-        api_url = get_langgraph_base_url()
         try:
-            resp = requests.get(
-                f'{api_url}/threads/{thread_id}/history', 
+            if supports_incremental(request.GET):
+                result = get_thread_history(
+                    thread_id,
+                    limit=request.GET.get('limit'),
+                    since=request.GET.get('since'),
+                    if_none_match=request.headers.get('If-None-Match'),
+                )
+                return _history_response(result)
+            resp = coalesced_get(
+                f'/threads/{thread_id}/history', 
                 params=request.GET,
-                headers=get_service_headers(), 
                 timeout=THREAD_TIMEOUT
             )
-            return Response(resp.json(), status=resp.status_code)
+            return _proxy_response(self, resp)
         except Exception as e:
-            return Response({'detail': '获取历史失败', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error('获取历史失败', e)
+
 
+def _date_range(request, default_days=7):
+    """
+    ``start``/``end`` (YYYY-MM-DD, inclusive) from the query string; defaults
+    to the last ``default_days`` days. Returns (start, end, error_response).
+    """
+    today = timezone.localdate()
+    start = request.GET.get('start')
+    end = request.GET.get('end')
+    try:
+        end = parse_date(end) if end else today
+        start = parse_date(start) if start else end - datetime.timedelta(days=default_days - 1)
+    except ValueError:
+        start = end = None
+    if start is None or end is None:
+        return None, None, Response({'detail': '日期格式应为 YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+    if start > end:
+        return None, None, Response({'detail': '开始日期不能晚于结束日期'}, status=status.HTTP_400_BAD_REQUEST)
+    return start, end, None
 
 class DashboardStatsView(BaseAdminView):
+    """
+    Visit stats read from the hourly/daily rollups and per-day sketches, so
+    the cost depends on the requested range, not on the size of SiteVisit.
+    Accepts ``start``/``end`` dates (default: last 7 days) and
+    ``granularity=hour`` for hourly counts (up to 31 days).
+    """
+    # Polled by the dashboard, so it trusts the is_staff claim. Trade-off: an
+    # admin demoted or deactivated through another worker keeps seeing visit
+    # stats (including the recent visits list) until the token expires.
+    jwt_claims_principal = True
 
     def get(self, request):
-        # Total visits
-        total_visits = SiteVisit.objects.count()
-        
+        start, end, error = _date_range(request)
+        if error:
+            return error
+
         # Recent 20 visits
         recent_visits = SiteVisit.objects.order_by('-timestamp')[:20]
         recent_visits_data = SiteVisitSerializer(recent_visits, many=True).data
-        
-        # Daily visits (last 7 days)
-        last_7_days = datetime.datetime.now() - datetime.timedelta(days=7)
-        daily_visits = SiteVisit.objects.filter(timestamp__gte=last_7_days)\
-            .annotate(date=TruncDate('timestamp'))\
-            .values('date')\
-            .annotate(count=Count('id'))\
-            .order_by('date')
-            
-        return Response({
-            'total_visits': total_visits,
+
+        # Sketch-based stats: fixed-size per day, independent of the visit table size
+        today = timezone.localdate()
+        sketches = visit_sketches.read(start, end)
+        today_sketch = visit_sketches.read(today, today)
+
+        data = {
+            'total_visits': rollups.total_visits(),
             'recent_visits': recent_visits_data,
-            'daily_visits': list(daily_visits)
-        })
+            'daily_visits': rollups.daily_visits(start, end),
+            'start': start,
+            'end': end,
+            'unique_visitors': {
+                'today': today_sketch['unique_ips'].count(),
+                'range': sketches['unique_ips'].count(),
+            },
+            'top_paths': sketches['paths'].top(10),
+            'top_user_agents': sketches['user_agents'].top(10),
+        }
+        if request.GET.get('granularity') == 'hour':
+            if (end - start).days > 30:
+                return Response({'detail': '按小时统计的范围不能超过31天'}, status=status.HTTP_400_BAD_REQUEST)
+            data['hourly_visits'] = rollups.hourly_visits(start, end)
+        return Response(data)
 
 class AdminTokenStatsView(BaseAdminView):
+    # Aggregated token usage only; a revoked admin may still read it for up
+    # to JWT_ACCESS_TOKEN_TTL when the change happened in another worker.
+    jwt_claims_principal = True
 
     def get(self, request):
-        # Global stats
-        total_tokens = TokenUsage.objects.aggregate(
-            total=Sum('total_tokens'),
-            input=Sum('input_tokens'),
-            output=Sum('output_tokens')
-        )
-        
-        # Daily stats (last 7 days)
-        last_7_days = datetime.datetime.now() - datetime.timedelta(days=7)
-        daily_usage = TokenUsage.objects.filter(timestamp__gte=last_7_days)\
-            .annotate(date=TruncDate('timestamp'))\
-            .values('date')\
-            .annotate(
-                total_tokens=Sum('total_tokens'),
-                count=Count('id')
-            )\
-            .order_by('date')
-            
+        start, end, error = _date_range(request)
+        if error:
+            return error
+        # Both read TokenUsageDaily, so cost grows with days, not runs
+        qs = TokenUsageDaily.objects.all()
         return Response({
-            'global_stats': total_tokens,
-            'daily_usage': list(daily_usage)
+            'global_stats': rollups.token_totals(qs),
+            'daily_usage': rollups.daily_token_usage(qs, start, end),
+            'start': start,
+            'end': end,
         })
 
 class UserTokenUsageView(BaseAuthenticatedView):
-
     def get(self, request):
         user_id = request.GET.get('user_id')
         
@@ -339,27 +661,69 @@ class UserTokenUsageView(BaseAuthenticatedView):
              target_user = User.objects.filter(id=user_id).first()
              if not target_user:
                  return Response({'detail': 'User not found'}, status=404)
-             qs = TokenUsage.objects.filter(user=target_user)
         else:
              # Otherwise show current user's stats
-             qs = TokenUsage.objects.filter(user=request.user)
-             
-        # Aggregate totals
-        totals = qs.aggregate(
-            total=Sum('total_tokens'),
-            input=Sum('input_tokens'),
-            output=Sum('output_tokens')
-        )
-        
+             target_user = request.user
+
+        start, end, error = _date_range(request)
+        if error:
+            return error
+        days = TokenUsageDaily.objects.filter(user=target_user)
+
         # Recent usage history
-        history = qs.order_by('-timestamp')[:20]
+        history = TokenUsage.objects.filter(user=target_user).order_by('-timestamp')[:20]
         history_data = TokenUsageSerializer(history, many=True).data
         
         return Response({
-            'totals': totals,
+            'totals': rollups.token_totals(days),
+            'daily_usage': rollups.daily_token_usage(days, start, end),
+            'by_model': rollups.token_usage_by_model(days),
             'history': history_data
         })
 
+class AdminVisitArchiveView(BaseAdminView):
+    """
+    Visits already moved out of SiteVisit by ``archive_visits``, read from
+    the per-day archive files for ``start``..``end``. Optional ``path``
+    prefix filter and ``limit`` (default 1000, at most 10000).
+    """
+    def get(self, request):
+        start, end, error = _date_range(request)
+        if error:
+            return error
+        try:
+            limit = min(max(int(request.GET.get('limit', 1000)), 1), 10000)
+        except ValueError:
+            return Response({'detail': 'limit 必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        visits = read_archived_visits(start, end, path_prefix=request.GET.get('path') or None, limit=limit + 1)
+        return Response({
+            'start': start,
+            'end': end,
+            'visits': SiteVisitSerializer(visits[:limit], many=True).data,
+            'truncated': len(visits) > limit,
+        })
+
+class AdminUpstreamStatsView(BaseAdminView):
+    # Process counters with no user data, so a stale is_staff claim exposes
+    # little; worth skipping the user lookup on a frequently refreshed page.
+    jwt_claims_principal = True
+
+    def get(self, request):
+        return Response({
+            'pool': get_upstream_client().stats(),
+            'breakers': circuit_breaker_states(),
+            'assistants_cache': assistants_cache_stats,
+            'coalescing': coalescing_snapshot(),
+            'history': history_snapshot(),
+            'compression': compression_snapshot(),
+            'run_streams': run_streams.stats(),
+            'admission': get_run_admission().snapshot(),
+            'thread_pool': thread_pool_snapshot(),
+            'write_behind': batch_writer_stats(),
+            'principal_cache': principal_cache_stats(),
+            'thread_owners': ownership_snapshot(),
+        })
+
 class AdminUsersListView(BaseAdminView):
     def get(self, request):
         q = (request.GET.get('q') or '').strip()
@@ -396,6 +760,7 @@ class ChatThreadViewSet(viewsets.ModelViewSet):
     authentication_classes = [JWTAuthentication, authentication.SessionAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = 'thread_id'
+    jwt_claims_principal = True
     
     def get_queryset(self):
         return ChatThread.objects.filter(user=self.request.user).order_by('-updated_at')
@@ -407,9 +772,9 @@ class ChatThreadViewSet(viewsets.ModelViewSet):
         try:
             thread_id = create_langgraph_thread(assistant_id)
         except ServiceUnavailable as e:
-            return Response({'detail': e.detail}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error(e.detail, e)
         except Exception as e:
-            return Response({'detail': '后端线程服务不可用', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error('后端线程服务不可用', e)
             
         obj = ChatThread.objects.create(user=request.user, thread_id=thread_id, assistant_id=assistant_id, title=title)
         return Response(ChatThreadSerializer(obj).data, status=status.HTTP_201_CREATED)
@@ -435,11 +800,15 @@ class ChatThreadHistoryView(views.APIView):
             ct = ChatThread.objects.get(thread_id=thread_id, user=request.user)
         except ChatThread.DoesNotExist:
             return Response({'detail': '未找到线程'}, status=status.HTTP_404_NOT_FOUND)
-        api_url = os.getenv('LANGGRAPH_API_URL', 'http://127.0.0.1:2024')
         try:
-            resp = requests.get(f'{api_url}/threads/{ct.thread_id}/history', timeout=10)
-            if resp.status_code != 200:
-                return Response({'detail': '获取历史失败', 'status': resp.status_code, 'error': resp.text}, status=status.HTTP_502_BAD_GATEWAY)
-            return Response(resp.json())
+            result = get_thread_history(
+                ct.thread_id,
+                limit=request.GET.get('limit'),
+                since=request.GET.get('since'),
+                if_none_match=request.headers.get('If-None-Match'),
+            )
+            if result.status_code not in (200, 304):
+                return Response({'detail': '获取历史失败', 'status': result.status_code, 'error': result.data}, status=status.HTTP_502_BAD_GATEWAY)
+            return _history_response(result)
         except Exception as e:
-            return Response({'detail': '后端线程服务不可用', 'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            return _upstream_error('后端线程服务不可用', e)
@@ -1,4 +1,4 @@
-import axios from 'axios';
+import axios, { type InternalAxiosRequestConfig } from 'axios';
 
 const API_BASE_URL = import.meta.env.VITE_API_BASE || 'http://localhost:8000/api';
 
@@ -46,9 +46,12 @@ export const buildDjangoStaticUrl = (relativePath: string) => {
 
 export const buildStaticUrl = buildDjangoStaticUrl;
 
+const ACCESS_TOKEN_KEY = 'auth_token';
+const REFRESH_TOKEN_KEY = 'refresh_token';
+
 // CSRF Token handling for Django
 api.interceptors.request.use((config) => {
-  const token = localStorage.getItem('auth_token');
+  const token = localStorage.getItem(ACCESS_TOKEN_KEY);
   if (token) {
     config.headers['Authorization'] = `Bearer ${token}`;
   }
@@ -74,4 +77,87 @@ api.interceptors.request.use((config) => {
   return config;
 });
 
+export const storeTokens = (data: { token?: string; refresh?: string }) => {
+  if (data.token) localStorage.setItem(ACCESS_TOKEN_KEY, data.token);
+  if (data.refresh) localStorage.setItem(REFRESH_TOKEN_KEY, data.refresh);
+};
+
+export const clearTokens = () => {
+  localStorage.removeItem(ACCESS_TOKEN_KEY);
+  localStorage.removeItem(REFRESH_TOKEN_KEY);
+};
+
+export const getRefreshToken = () => localStorage.getItem(REFRESH_TOKEN_KEY);
+
+let refreshing: Promise<string | null> | null = null;
+
+// Refresh tokens are single-use, so concurrent callers share one request
+export const refreshAccessToken = (): Promise<string | null> => {
+  if (!refreshing) {
+    const refresh = getRefreshToken();
+    refreshing = (refresh
+      ? axios.post(`${normalizeBase(API_BASE_URL)}/auth/refresh/`, { refresh }).then((resp) => {
+          storeTokens(resp.data);
+          return resp.data.token as string;
+        })
+      : Promise.resolve(null))
+      .catch((err) => {
+        if (err?.response?.status === 401) clearTokens();
+        return null;
+      })
+      .finally(() => {
+        refreshing = null;
+      });
+  }
+  return refreshing;
+};
+
+// Access token for callers outside axios (e.g. the LangGraph SDK), renewed
+// first if it expires within a minute
+export const getAccessToken = async (): Promise<string | null> => {
+  const token = localStorage.getItem(ACCESS_TOKEN_KEY);
+  if (!token) return null;
+  try {
+    const payload = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+    if (payload.exp && payload.exp * 1000 - Date.now() < 60_000) {
+      return (await refreshAccessToken()) || token;
+    }
+  } catch (e) {
+    // Not a JWT we can read; let the server decide
+  }
+  return token;
+};
+
+// fetch for callers outside axios (the LangGraph SDK): reads the access token
+// per request, so long-lived clients never hold a stale one, and retries once
+// after a refresh when it is rejected
+export const authFetch = async (input: RequestInfo | URL, init: RequestInit = {}): Promise<Response> => {
+  const send = (token: string | null) => {
+    const headers = new Headers(init.headers);
+    if (token) headers.set('Authorization', `Bearer ${token}`);
+    return fetch(input, { ...init, headers });
+  };
+  const response = await send(await getAccessToken());
+  if (response.status !== 401 || !getRefreshToken()) return response;
+  const token = await refreshAccessToken();
+  return token ? send(token) : response;
+};
+
+// Endpoints whose 401 means bad credentials, not an expired access token
+const NO_REFRESH_URLS = /\/auth\/(login|refresh|logout)\/?$/;
+
+// Retry once with a fresh access token when the current one is rejected
+api.interceptors.response.use(undefined, async (error) => {
+  const config = error.config as (InternalAxiosRequestConfig & { _retried?: boolean }) | undefined;
+  if (error.response?.status === 401 && config && !config._retried && !NO_REFRESH_URLS.test(String(config.url || '').split('?')[0])) {
+    config._retried = true;
+    const token = await refreshAccessToken();
+    if (token) {
+      config.headers['Authorization'] = `Bearer ${token}`;
+      return api(config);
+    }
+  }
+  return Promise.reject(error);
+});
+
 export default api;
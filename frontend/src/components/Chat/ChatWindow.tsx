@@ -1,6 +1,6 @@
 import React from 'react';
 import { useStream } from '@langchain/langgraph-sdk/react';
-import { API_BASE_URL } from '../../api';
+import { API_BASE_URL, authFetch } from '../../api';
 import { normalizeMessages, exportToJSON, exportToMarkdown } from '../../utils/chatUtils';
 import { AssistantSelector } from './AssistantSelector';
 import { MessageList } from './MessageList';
@@ -33,7 +33,6 @@ const ChatWindow: React.FC<Props> = ({ assistantId, threadId, onThreadId }) => {
     } = useChat({ assistantId, threadId });
     
     const apiUrl = `${API_BASE_URL}${API_ENDPOINTS.CHAT_PROXY}`;
-    const token = localStorage.getItem('auth_token');
 
     const effectiveAssistantId = selectedAssistantId || assistantId;
 
@@ -49,7 +48,6 @@ const ChatWindow: React.FC<Props> = ({ assistantId, threadId, onThreadId }) => {
                 apiUrl={apiUrl}
                 assistantId={effectiveAssistantId}
                 threadId={threadId}
-                token={token}
                 user={user}
                 historyMessages={historyMessages}
                 onThreadId={onThreadId}
@@ -69,7 +67,6 @@ interface StreamWrapperProps {
     apiUrl: string;
     assistantId: string;
     threadId?: string;
-    token: string | null;
     user: any;
     historyMessages: any[];
     onThreadId?: (id: string) => void;
@@ -83,7 +80,7 @@ interface StreamWrapperProps {
 }
 
 const ChatStreamWrapper: React.FC<StreamWrapperProps> = ({
-    apiUrl, assistantId, threadId, token, user, historyMessages, onThreadId, onRollback, isRollingBack, isNew,
+    apiUrl, assistantId, threadId, user, historyMessages, onThreadId, onRollback, isRollingBack, isNew,
     initialInput, onInputUsed, assistants, onSelectAssistant
 }) => {
     const { messages, values, submit, isLoading, stop, error, getMessagesMetadata } = useStream({
@@ -91,9 +88,11 @@ const ChatStreamWrapper: React.FC<StreamWrapperProps> = ({
         assistantId,
         threadId: threadId === 'new' ? undefined : threadId,
         onThreadId,
-        defaultHeaders: {
-             'Authorization': token ? `Bearer ${token}` : ''
-        },
+        // A run still going after a reload is rejoined via GET .../runs/<id>/stream
+        reconnectOnMount: true,
+        // The access token is short-lived; authFetch attaches the current one
+        // to every request and refreshes it when rejected
+        callerOptions: { fetch: authFetch },
         onError: (e) => {
             console.error(MESSAGES.ERROR_STREAM, e);
         }
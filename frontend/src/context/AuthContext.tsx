@@ -1,5 +1,5 @@
 import React, { createContext, useState, useEffect, useContext } from 'react';
-import api from '../api';
+import api, { storeTokens, clearTokens, getRefreshToken } from '../api';
 import type { User, LoginCredentials, RegisterPayload } from '../types/auth';
 
 interface AuthContextType {
@@ -52,9 +52,7 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
   const login = async (credentials: LoginCredentials) => {
     const resp = await api.post('/auth/login/', credentials);
     const data = resp.data || {};
-    if (data.token) {
-      localStorage.setItem('auth_token', data.token);
-    }
+    storeTokens(data);
     // After login, we must re-check auth to get full user details including username
     await checkAuth();
     return data;
@@ -62,14 +60,14 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
 
   const logout = async () => {
     try {
-      await api.post('/auth/logout/');
+      await api.post('/auth/logout/', { refresh: getRefreshToken() });
     } catch (e) {
       console.warn('Logout failed', e);
     }
     setIsAuthenticated(false);
     setIsStaff(false);
     setUser(null);
-    localStorage.removeItem('auth_token');
+    clearTokens();
   };
 
   return (
@@ -1,4 +1,4 @@
-import api, { API_BASE_URL } from '../api';
+import api, { API_BASE_URL, authFetch } from '../api';
 import type { ChatThread, ChatAssistant, ChatMessage } from '../types/chat';
 
 export type { ChatThread, ChatAssistant, ChatMessage }; // Re-export for backward compatibility if needed, or better to remove later.
@@ -131,9 +131,6 @@ export const chatService = {
         onError: (err: any) => void,
         signal?: AbortSignal
     ) => {
-        const token = localStorage.getItem('auth_token');
-
-        
         try {
             // Use Client from @langchain/langgraph-sdk
             // Dynamic import to avoid SSR issues if any, though Client is isomorphic
@@ -143,13 +140,8 @@ export const chatService = {
 
             const client = new Client({
                 apiUrl: chatProxyBase,
-                // We need to pass the token. The SDK might not support Authorization header directly in constructor easily
-                // for all transports without a custom fetch.
-                // However, Client uses fetch. We can try to override fetch or headers.
-                // The SDK Client accepts `headers` in constructor options in recent versions.
-                defaultHeaders: {
-                    'Authorization': token ? `Bearer ${token}` : ''
-                }
+                // authFetch attaches a current access token to every request
+                callerOptions: { fetch: authFetch }
             });
 
             // The SDK stream method returns an async iterable
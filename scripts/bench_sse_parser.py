@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from blog.utils import SSEUsageExtractor
+
+
+class LegacySSEUsageExtractor:
+    """The previous str-buffer implementation, kept here for comparison."""
+    def __init__(self):
+        self.buffer = ""
+        self.last_usage = None
+
+    def process_chunk(self, chunk):
+        if isinstance(chunk, bytes):
+            text = chunk.decode("utf-8", errors="ignore")
+        else:
+            text = chunk
+        self.buffer += text
+        while "\n\n" in self.buffer:
+            event_text, self.buffer = self.buffer.split("\n\n", 1)
+            self._parse_event(event_text)
+
+    def _parse_event(self, event_text):
+        for line in event_text.split("\n"):
+            if line.startswith("data:"):
+                data_str = line[5:].strip()
+                try:
+                    if "usage_metadata" in data_str:
+                        data = json.loads(data_str)
+                        usage = self._find_usage(data)
+                        if usage:
+                            self.last_usage = usage
+                except Exception:
+                    pass
+
+    def _find_usage(self, obj):
+        if isinstance(obj, dict):
+            if obj.get("usage_metadata"):
+                return obj["usage_metadata"]
+            for v in obj.values():
+                res = self._find_usage(v)
+                if res:
+                    return res
+        elif isinstance(obj, list):
+            for item in obj:
+                res = self._find_usage(item)
+                if res:
+                    return res
+        return None
+
+
+def build_stream(size_mb: float, event_kb: float) -> bytes:
+    """Many token events of ``event_kb`` KB, with a usage event at the end."""
+    chars = max(1, int(event_kb * 1024 / 3))
+    text = ("流式输出 token " * (chars // 10 + 1))[:chars]
+    token = json.dumps([{"type": "AIMessageChunk", "content": text}, {"langgraph_node": "agent"}], ensure_ascii=False)
+    event = f"event: messages\ndata: {token}\n\n".encode("utf-8")
+    count = max(1, int(size_mb * 1024 * 1024 / len(event)))
+    usage = json.dumps([{"type": "AIMessageChunk", "content": "", "usage_metadata": {"input_tokens": 10, "output_tokens": count, "total_tokens": 10 + count}}, {}])
+    return event * count + f"event: messages\ndata: {usage}\n\n".encode("utf-8")
+
+
+def bench(cls, stream: bytes, chunk_size: int, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        extractor = cls()
+        start = time.perf_counter()
+        for i in range(0, len(stream), chunk_size):
+            extractor.process_chunk(stream[i:i + chunk_size])
+        best = min(best, time.perf_counter() - start)
+        assert extractor.last_usage, f"{cls.__name__} found no usage"
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare SSE usage extractor throughput")
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--event-kb", type=float, nargs="+", default=[0.2, 64, 1024])
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'event size':>12} {'legacy MB/s':>12} {'current MB/s':>13} {'speedup':>8}")
+    for event_kb in args.event_kb:
+        stream = build_stream(args.size_mb, event_kb)
+        mb = len(stream) / 1024 / 1024
+        legacy = bench(LegacySSEUsageExtractor, stream, args.chunk_size, args.rounds)
+        current = bench(SSEUsageExtractor, stream, args.chunk_size, args.rounds)
+        print(f"{event_kb:>10g}KB {mb / legacy:>12.1f} {mb / current:>13.1f} {legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()